@@ -0,0 +1,74 @@
+import copy
+import queue
+import threading
+import torch
+
+
+def snapshot(obj):
+    ''' Deep copy of a model (without its gradients), state dict or loss history, which a job can write while
+    training keeps updating the original '''
+    with torch.no_grad():
+        obj_copy = copy.deepcopy(obj)
+    if isinstance(obj_copy, torch.nn.Module):
+        for param in obj_copy.parameters():
+            param.grad = None
+    return obj_copy
+
+
+class ArtifactWriter:
+    ''' Writes training artifacts (models, checkpoints, loss tables and plots) on a worker thread, in the order they
+    were submitted, so that disk and matplotlib latency stays off the training loop.
+
+    A job may only read snapshots taken on the training thread, never state the loop keeps updating, and must draw
+    with the object-oriented matplotlib API (matplotlib.figure.Figure) since pyplot's global state belongs to the
+    training thread. Up to max_pending jobs are queued; submit() blocks beyond that. Jobs keep running after one
+    fails, and the first exception is re-raised on the training thread by the next submit(), flush() or close() '''
+
+    def __init__(self, max_pending = 8):
+        self._queue = queue.Queue(maxsize = max_pending)
+        self._error = None
+        self._worker = threading.Thread(target = self._run, daemon = True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                fn, args, kwargs = job
+                fn(*args, **kwargs)
+            except Exception as e:
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, fn, *args, **kwargs):
+        ''' Run fn(*args, **kwargs) on the worker thread '''
+        self._raise_error()
+        if self._worker is None:
+            raise RuntimeError('submit called on a closed ArtifactWriter')
+        self._queue.put((fn, args, kwargs))
+
+    def save_model(self, odenet, fp):
+        ''' Save a snapshot of odenet as it is now, with odenet.save(fp) '''
+        self.submit(snapshot(odenet).save, fp)
+
+    def flush(self):
+        ''' Wait until every job submitted so far is done '''
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        ''' Finish the queued jobs and stop the worker '''
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+        self._raise_error()
@@ -0,0 +1,91 @@
+import queue
+import threading
+import torch
+
+
+class BatchPrefetcher:
+    ''' Wraps a DataHandler so that the batches of an epoch are assembled on a worker thread, up to n_batches ahead of
+    the training step that consumes them. Batches are handed over as contiguous tensors; when they are assembled on
+    the CPU for a CUDA device they are pinned and copied on a side stream, off the critical path.
+
+    It is used in place of the DataHandler in the training loop: reset_epoch() starts the worker on a freshly shuffled
+    epoch, get_batch() returns the next batch and epoch_done turns True once the last batch of the epoch has been
+    handed out. Everything else is read from the wrapped DataHandler. The worker only draws random numbers from the
+    DataHandler's own batch generator, never from the global RNG the training thread uses '''
+
+    def __init__(self, data_handler, batch_size, n_batches = 2, device = None):
+        self.data_handler = data_handler
+        self.batch_size = batch_size
+        self.n_batches = n_batches
+        self.device = torch.device(data_handler.device if device is None else device)
+        self._stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        self._queue = None
+        self._worker = None
+        self._stop = threading.Event()
+        self.epoch_done = True
+
+    def __getattr__(self, name):
+        if name == 'data_handler':
+            raise AttributeError(name)
+        return getattr(self.data_handler, name)
+
+    def reset_epoch(self):
+        ''' Shuffle a new epoch (on the calling thread, so the shuffle order is unaffected) and start prefetching it '''
+        self.close()
+        self.data_handler.reset_epoch()
+        self.epoch_done = False
+        self._stop.clear()
+        self._queue = queue.Queue(maxsize = self.n_batches)
+        self._worker = threading.Thread(target = self._fill, args = (self._queue,), daemon = True)
+        self._worker.start()
+
+    def _fill(self, batches):
+        try:
+            while not self.data_handler.epoch_done and not self._stop.is_set():
+                batch = self._prepare(self.data_handler.get_batch(self.batch_size))
+                self._put(batches, (batch, self.data_handler.epoch_done))
+        except Exception as e:
+            self._put(batches, e)
+
+    def _put(self, batches, item):
+        while not self._stop.is_set():
+            try:
+                batches.put(item, timeout = 0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _prepare(self, tensors):
+        ''' Contiguous tensors on the target device, plus the CUDA event their copy must be waited on (or None) '''
+        tensors = tuple(tensor.contiguous() for tensor in tensors)
+        if self._stream is None or tensors[0].device.type != 'cpu':
+            return tensors, None
+        with torch.cuda.stream(self._stream):
+            tensors = tuple(tensor.pin_memory().to(self.device, non_blocking = True) for tensor in tensors)
+            copied = torch.cuda.Event()
+            copied.record(self._stream)
+        return tensors, copied
+
+    def get_batch(self, batch_size = None):
+        ''' The next (batch, t, target) of the epoch; batch_size is fixed at construction '''
+        if self.epoch_done:
+            raise RuntimeError('get_batch called after the last batch of the epoch; call reset_epoch first')
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            self.close()
+            raise item
+        (tensors, copied), self.epoch_done = item
+        if copied is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_event(copied)
+            for tensor in tensors:
+                tensor.record_stream(current_stream)
+        return tensors
+
+    def close(self):
+        ''' Stop the worker, dropping the batches it has prefetched '''
+        if self._worker is not None:
+            self._stop.set()
+            self._worker.join()
+            self._worker = None
+            self._queue = None
@@ -0,0 +1,64 @@
+# Compares the ODE solvers on the noiseless time pairs of a dataset, integrated with a trained ODE-Net. The decay rates
+# (gene_multipliers) of the model are scaled by every --stiffness factor, to see where the stiff and exponential
+# solvers start to pay off against dopri5. Reports function evaluations, wall time and the error against a tight dopri5
+# reference, per method and stiffness.
+import argparse
+from time import perf_counter
+
+import torch
+
+try:
+    from torchdiffeq.__init__ import odeint, SolverStats
+except ImportError:
+    from torchdiffeq import odeint, SolverStats
+
+from datahandler import DataHandler
+from odenet import ODENet
+from pairwise_solve import solve_pairs
+
+parser = argparse.ArgumentParser('Solver benchmark')
+parser.add_argument('--model', type=str, default='../../all_manuscript_models/sim690/phoenix/noise_0/best_val_model.pt')
+parser.add_argument('--neurons', type=int, default=50)
+parser.add_argument('--data', type=str, default='../../ground_truth_simulator/clean_data/chalmers_690genes_10samples_for_testing.csv')
+parser.add_argument('--methods', type=str, default='dopri5,batched_dopri5,rosenbrock23,etdrk4')
+parser.add_argument('--stiffness', type=str, default='1,10,60')
+parser.add_argument('--step_size', type=float, default=0.05, help='step_size of the fixed-grid methods (fraction of each pair)')
+parser.add_argument('--rtol', type=float, default=1e-7)
+parser.add_argument('--atol', type=float, default=1e-9)
+
+
+def solve(odenet, y0, t, method, options, **odeint_kwargs):
+    ''' End states of all pairs, their solver statistics and the wall time of the solve '''
+    stats = SolverStats()
+    start = perf_counter()
+    with torch.no_grad():
+        predictions = solve_pairs(odeint, odenet, y0, t, method, batched = True, stats = stats, options = options, **odeint_kwargs)
+    return predictions, stats, perf_counter() - start
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    data_handler = DataHandler.fromcsv(args.data, 'cpu', val_split = 0, batch_type = 'trajectory')
+    y0, t, _ = data_handler.get_true_mu_set_pairwise(batch_type = 'trajectory')
+    y0 = y0.double()
+    t = t.double()
+
+    odenet = ODENet('cpu', data_handler.dim, neurons = args.neurons)
+    odenet.load_model(args.model)
+    odenet.double()
+    trained_multipliers = odenet.gene_multipliers.detach().clone()
+    print('{} pairs of {} genes, largest trained decay rate {:.3g}'.format(y0.shape[0], data_handler.dim,
+                                                                           torch.relu(trained_multipliers).max().item()))
+
+    print('stiffness,method,nfe,accepted_steps,rejected_steps,time_s,max_abs_error')
+    for stiffness in [float(s) for s in args.stiffness.split(',')]:
+        with torch.no_grad():
+            odenet.gene_multipliers.copy_(stiffness * trained_multipliers)
+        reference, _, _ = solve(odenet, y0, t, 'dopri5', None, rtol = 1e-10, atol = 1e-12)
+        for method in args.methods.split(','):
+            options = {'step_size': args.step_size} if method == 'etdrk4' else None
+            tolerances = {} if method == 'etdrk4' else {'rtol': args.rtol, 'atol': args.atol}
+            predictions, stats, elapsed = solve(odenet, y0, t, method, options, **tolerances)
+            print('{:g},{},{},{},{},{:.3f},{:.2e}'.format(stiffness, method, stats.nfe['forward'], stats.accepted_steps['forward'],
+                                                        stats.rejected_steps['forward'], elapsed,
+                                                        (predictions - reference).abs().max().item()))
@@ -0,0 +1,62 @@
+import os
+import random
+import numpy as np
+import torch
+
+from data_parallel import gather_objects
+
+
+def rng_state():
+    ''' State of every random number generator training draws from '''
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+def save_checkpoint(fp, checkpoint):
+    ''' Write checkpoint (a dict of tensors and picklable objects) to fp atomically: it is written to a temporary file
+    next to fp and renamed over it, so a run that dies mid-write leaves the previous checkpoint intact '''
+    tmp_fp = fp + '.tmp'
+    with open(tmp_fp, 'wb') as f:
+        torch.save(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_fp, fp)
+
+def load_checkpoint(fp):
+    ''' Load a checkpoint written by save_checkpoint, from the file or from the output directory holding checkpoint.pt '''
+    if os.path.isdir(fp):
+        fp = os.path.join(fp, 'checkpoint.pt')
+    print('Resuming from checkpoint {}'.format(fp))
+    return torch.load(fp, map_location = 'cpu', weights_only = False)
+
+def training_checkpoint(odenet, opt, scheduler, data_handler, progress, solver_options, **run_state):
+    ''' Everything a training script needs to continue bit-for-bit: model, optimizer and scheduler states, the data
+    split, the loop's progress (a dict of its counters and loss histories), the random state and solver step size cache
+    of every rank and run_state (e.g. settings and the random state the run started from). Collective in
+    data-parallel training '''
+    checkpoint = {'model': odenet.state_dict(), 'optimizer': opt.state_dict(), 'scheduler': scheduler.state_dict(),
+                  'data_handler': data_handler.state_dict(), 'progress': progress,
+                  'rng_state': gather_objects(rng_state()), 'step_cache': gather_objects(solver_options.get('step_cache'))}
+    checkpoint.update(run_state)
+    return checkpoint
+
+def restore_training_checkpoint(checkpoint, odenet, opt, scheduler, data_handler, solver_options, rank = 0, world_size = 1):
+    ''' Load the states of training_checkpoint back (the random state last) and return the loop's progress '''
+    if len(checkpoint['rng_state']) != world_size:
+        raise ValueError('The checkpoint was written by {} processes, resume it with as many'.format(len(checkpoint['rng_state'])))
+    odenet.load_state_dict(checkpoint['model'])
+    opt.load_state_dict(checkpoint['optimizer'])
+    scheduler.load_state_dict(checkpoint['scheduler'])
+    data_handler.load_state_dict(checkpoint['data_handler'])
+    if checkpoint['step_cache'][rank] is not None:
+        solver_options['step_cache'] = checkpoint['step_cache'][rank]
+    set_rng_state(checkpoint['rng_state'][rank])
+    return checkpoint['progress']
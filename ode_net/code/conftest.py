@@ -0,0 +1,3 @@
+# The modules here import each other as top-level modules, so pytest puts this directory on sys.path (no __init__.py).
+# prescient_test.py is a training script, not a test module.
+collect_ignore = ['prescient_test.py']
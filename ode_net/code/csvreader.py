@@ -1,68 +1,116 @@
 import torch
 import numpy as np
 import csv
+import os
+import warnings
+from trajectory_store import TrajectoryStore
 try:
     from torchdiffeq.__init__ import odeint_adjoint as odeint
 except ImportError:
     from torchdiffeq import odeint_adjoint as odeint
 
 def expression_maker(val, log_scale):
+    ''' Transform expression values (a scalar or a NumPy array) to the requested scale '''
     if log_scale == "log":
         eps = 10**-3
-        if val < eps:
-            val = eps 
-        return(np.log(val))
+        return(np.log(np.maximum(val, eps)))
     elif log_scale == "reciprocal":
         return(np.reciprocal(val+1))    
     else: #i.e. "linear"
         #return(1/6 *(val))
         return(val)
 
-def readcsv(fp, device, noise_to_add, scale_expression, log_scale):
+def _parse_csv_values(fp):
+    ''' Parse the whole file in bulk into a flat float64 array (empty fields become NaN) and the row offsets into it '''
+    with open(fp, 'rb') as f:
+        text = f.read().replace(b'\r\n', b'\n').rstrip(b'\n')
+    if not text:
+        return np.zeros(0, dtype = np.float64), np.zeros(1, dtype = np.int64)
+    chars = np.frombuffer(text, dtype = np.uint8)
+    line_ends = np.append(np.flatnonzero(chars == ord('\n')), len(chars))
+    commas_before = np.searchsorted(np.flatnonzero(chars == ord(',')), line_ends)
+    row_lengths = np.diff(commas_before, prepend = 0) + 1
+    row_offsets = np.zeros(len(row_lengths) + 1, dtype = np.int64)
+    np.cumsum(row_lengths, out = row_offsets[1:])
+
+    # An empty field is two adjacent separators; replace() does not overlap, so two passes fill runs of them
+    fields = b',' + text.replace(b'\n', b',') + b','
+    for _ in range(2):
+        fields = fields.replace(b',,', b',nan,')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = np.fromstring(fields[1:-1], dtype = np.float64, sep = ',')
+    if len(values) != row_offsets[-1]:
+        raise ValueError("Could not parse field {} of {} as a number".format(len(values), fp))
+    return values, row_offsets
+
+def _cache_path(fp):
+    return fp + '.cache.npz'
+
+def _load_csv_values(fp, use_cache = True):
+    ''' Parsed (values, row_offsets) of a data CSV, read from its binary sidecar cache while the CSV is unchanged '''
+    source = os.stat(fp)
+    cache_fp = _cache_path(fp)
+    if use_cache and os.path.exists(cache_fp):
+        with np.load(cache_fp) as cache:
+            if cache['source_size'] == source.st_size and cache['source_mtime_ns'] == source.st_mtime_ns:
+                print("Loading parsed values from cache {}".format(cache_fp))
+                return cache['values'], cache['row_offsets']
+
+    values, row_offsets = _parse_csv_values(fp)
+    if use_cache:
+        write_values_cache(fp, values, row_offsets)
+    return values, row_offsets
+
+def write_values_cache(fp, values, row_offsets):
+    ''' Write the binary sidecar cache of a data CSV from values and row offsets laid out as _parse_csv_values returns
+    them, e.g. by a writer that already holds the parsed values '''
+    source = os.stat(fp)
+    cache_fp = _cache_path(fp)
+    tmp_fp = cache_fp + '.tmp'
+    try:
+        with open(tmp_fp, 'wb') as f:
+            np.savez(f, values = values, row_offsets = row_offsets,
+                     source_size = source.st_size, source_mtime_ns = source.st_mtime_ns)
+        os.replace(tmp_fp, cache_fp)
+    except OSError as e:
+        print("Could not write cache {}: {}".format(cache_fp, e))
+
+def readcsv_store(fp, noise_to_add, scale_expression, log_scale, use_cache = True, store_dir = None):
+    ''' Read a data CSV into a TrajectoryStore, memory-mapped from store_dir if given '''
     print("Reading from file {}".format(fp))
     print("Adding requested noise of {}".format(noise_to_add))
     print("Scaling gene-expression values by {} fold".format(scale_expression))
     print("\n")
-    data_np = []
-    data_pt = []
-    data_np_0noise = []
-    data_pt_0noise = []
-    t_np = []
-    t_pt = []
-    with open(fp, 'r') as f:
-        reader = csv.reader(f, delimiter=',')
-        rows = []
-        for r in reader:
-            with_NA_strings = [float(string) if string != "" else float("NaN") for string in r]
-            rows.append(with_NA_strings)
-        dim = int(rows[0][0])
-        ntraj = int(rows[0][1])
-        data = rows[1:]
-        #print(ntraj)
-        for traj in range(ntraj):
-            current_length = len(data[traj*(dim+1)])
-            traj_data = np.zeros((current_length, 1, dim), dtype=np.float32)
-            traj_data_0noise = np.zeros((current_length, 1, dim), dtype=np.float32)
-            for d in range(dim + 1):
-                if d == dim:
-                    # Row is time data
-                    row = [float(f) for f in data[traj*(dim+1) + d]]
-                    t_np.append(np.array(row))
-                    t_pt.append(torch.tensor(row).to(device))
-                else:
-                    #row is gene-expression data; so add noise here!
-                    row = [expression_maker(float(f)+ np.random.normal(0, noise_to_add), log_scale) for f in data[traj*(dim+1) + d]]
-                    traj_data[:,:,d] = scale_expression*np.expand_dims(np.array(row), axis=1)
-                    row_0noise =  [expression_maker(float(f), log_scale) for f in data[traj*(dim+1) + d]]
-                    traj_data_0noise[:,:,d] = scale_expression*np.expand_dims(np.array(row_0noise), axis=1)
-            
-            data_np.append(traj_data)
-            data_np_0noise.append(traj_data_0noise)
-            data_pt.append(torch.tensor(traj_data).to(device))
-            data_pt_0noise.append(torch.tensor(traj_data_0noise).to(device))
-           
+    values, row_offsets = _load_csv_values(fp, use_cache)
+    dim = int(values[0])
+    ntraj = int(values[1])
+    # Each trajectory is dim gene rows followed by one row of time points, after the header row
+    first_rows = 1 + np.arange(ntraj)*(dim+1)
+    lengths = row_offsets[first_rows + 1] - row_offsets[first_rows]
+    store = TrajectoryStore.allocate(dim, lengths, store_dir, share_0noise = noise_to_add == 0)
+    for traj in range(ntraj):
+        first_row = first_rows[traj]
+        start, end = row_offsets[first_row], row_offsets[first_row + dim]
+        current_length = lengths[traj]
+        if end - start != dim*current_length or row_offsets[first_row + dim + 1] - end != current_length:
+            raise ValueError("Rows of trajectory {} in {} differ in length".format(traj, fp))
+        expression = values[start:end].reshape(dim, current_length)
+        rows = slice(store.offsets[traj], store.offsets[traj+1])
+        store.times[rows] = values[end:row_offsets[first_row + dim + 1]]
+
+        #gene-expression data; so add noise here! (drawn in the same order as one value at a time)
+        noise = np.random.normal(0, noise_to_add, size = expression.shape)
+        store.values[rows] = (scale_expression*expression_maker(expression + noise, log_scale)).T
+        if store.values_0noise is not store.values:
+            store.values_0noise[rows] = (scale_expression*expression_maker(expression, log_scale)).T
+    store.flush()
+    return store
 
-    return data_np, data_pt, t_np, t_pt, dim, ntraj, data_np_0noise,data_pt_0noise
+def readcsv(fp, device, noise_to_add, scale_expression, log_scale, use_cache = True):
+    store = readcsv_store(fp, noise_to_add, scale_expression, log_scale, use_cache)
+    data_np, data_pt, t_np, t_pt, data_np_0noise, data_pt_0noise = store.as_lists(device)
+    return data_np, data_pt, t_np, t_pt, store.dim, store.ntraj, data_np_0noise,data_pt_0noise
 
 def writecsv(fp, dim, ntraj, data_np, t_np):
     ''' Write data from a datagenerator to a file '''
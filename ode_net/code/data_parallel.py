@@ -0,0 +1,70 @@
+import os
+import sys
+import torch
+import torch.distributed as dist
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+
+def init_data_parallel(backend = 'gloo', num_threads = 0):
+    ''' Join the process group described by the environment (as set by torchrun) and return (rank, world_size);
+    (0, 1) when the script was not launched as part of a group. num_threads sets torch's intra-op threads, 0 leaves
+    the default in a single process and splits the cores evenly between the ranks of a node otherwise. Ranks other
+    than 0 stop printing to stdout '''
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size > 1:
+        dist.init_process_group(backend, init_method = 'env://')
+        if num_threads == 0:
+            num_threads = max(1, (os.cpu_count() or 1) // int(os.environ.get('LOCAL_WORLD_SIZE', world_size)))
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if world_size == 1:
+        return 0, 1
+    rank = dist.get_rank()
+    if rank != 0:
+        sys.stdout = open(os.devnull, 'w')
+    return rank, world_size
+
+def is_data_parallel():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+def shared_seed():
+    ''' A random seed drawn on rank 0 and broadcast to all ranks '''
+    seed = torch.randint(2**62, (1,))
+    if is_data_parallel():
+        dist.broadcast(seed, src = 0)
+    return int(seed)
+
+def broadcast_module(module):
+    ''' Overwrite the parameters and buffers of module on every rank with those of rank 0 '''
+    if not is_data_parallel():
+        return
+    tensors = [tensor.data for tensor in list(module.parameters()) + list(module.buffers())]
+    for tensor in tensors:
+        dist.broadcast(tensor, src = 0)
+
+def average_gradients(module):
+    ''' Average the gradients of module over all ranks, with one all-reduce of the flattened gradients '''
+    if not is_data_parallel():
+        return
+    grads = [param.grad for param in module.parameters() if param.grad is not None]
+    flat_grads = _flatten_dense_tensors(grads)
+    dist.all_reduce(flat_grads)
+    flat_grads /= dist.get_world_size()
+    for grad, averaged in zip(grads, _unflatten_dense_tensors(flat_grads, grads)):
+        grad.copy_(averaged)
+
+def mean_across_ranks(value):
+    ''' Mean of a number over all ranks '''
+    if not is_data_parallel():
+        return value
+    total = torch.tensor(float(value), dtype = torch.float64)
+    dist.all_reduce(total)
+    return total.item()/dist.get_world_size()
+
+def gather_objects(obj):
+    ''' List of obj from every rank, indexed by rank ([obj] in a single process) '''
+    if not is_data_parallel():
+        return [obj]
+    objects = [None]*dist.get_world_size()
+    dist.all_gather_object(objects, obj)
+    return objects
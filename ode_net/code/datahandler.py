@@ -1,5 +1,7 @@
 #from datagenerator import DataGenerator
-from csvreader import readcsv, writecsv
+from csvreader import readcsv_store, writecsv
+from trajectory_store import TrajectoryStore
+import os
 import numpy as np
 import torch
 from math import ceil
@@ -18,16 +20,17 @@ import random
 
 class DataHandler:
 
-    def __init__(self, data_np, data_pt, time_np, time_pt, dim, ntraj, val_split, device, normalize, batch_type, batch_time, batch_time_frac, data_np_0noise, data_pt_0noise, img_save_dir, init_bias_y, fp_test = None, data_np_0noise_test = None, data_pt_0noise_test = None):
-        self.data_np = data_np
-        self.data_pt = data_pt
-        self.data_np_0noise = data_np_0noise
-        self.data_pt_0noise = data_pt_0noise
-        self.data_np_0noise_test = data_np_0noise_test
-        self.data_pt_0noise_test = data_pt_0noise_test
+    def __init__(self, data_np, data_pt, time_np, time_pt, dim, ntraj, val_split, device, normalize, batch_type, batch_time, batch_time_frac, data_np_0noise, data_pt_0noise, img_save_dir, init_bias_y, fp_test = None, data_np_0noise_test = None, data_pt_0noise_test = None, store = None, test_store = None):
+        # All trajectories live in one TrajectoryStore; the per-trajectory lists are views onto it
+        if store is None:
+            store = TrajectoryStore.from_lists(data_np, data_np_0noise, time_np)
+        if test_store is None and data_np_0noise_test is not None:
+            test_store = TrajectoryStore.from_lists(data_np_0noise_test, None, [np.zeros(len(traj)) for traj in data_np_0noise_test])
+        self.store = store
+        self.test_store = test_store
+        self.device = device
+        self._set_trajectory_views()
         
-        self.time_np = time_np
-        self.time_pt = time_pt
         self.dim = dim
         self.ntraj = ntraj
         self.batch_type = batch_type
@@ -35,13 +38,17 @@ class DataHandler:
         self.batch_npoints = int(ceil(batch_time_frac * batch_time))
         if normalize:
             self._normalize()
-        self.device = device
         self.val_split = val_split
         self.epoch_done = False
         self.img_save_dir = img_save_dir
         self.init_bias_y = init_bias_y
         self.num_trajs_to_plot = 7
         self.fp_test = fp_test
+        self._shard = None
+        # Batches draw from their own generator, seeded from the run's random state, so that a BatchPrefetcher
+        # assembling them on its worker thread never touches the global RNG of the training thread
+        self._batch_generator = torch.Generator(device = device)
+        self._batch_generator.manual_seed(int(torch.randint(2**62, (1,))))
         #self.noise = noise
 
         self._calc_datasize()
@@ -58,18 +65,30 @@ class DataHandler:
         else:
             print("Invalid batch type: '{}'".format(batch_type))
             raise ValueError
+        self._build_pair_table()
         
 
     @classmethod
-    def fromcsv(cls, fp, device, val_split, normalize=False, batch_type='single', batch_time=1, batch_time_frac=1.0, noise = 0, img_save_dir = "", scale_expression = 1, log_scale = False, init_bias_y = 0, fp_test = None):
-        ''' Create a datahandler from a CSV file '''
-        data_np, data_pt, t_np, t_pt, dim, ntraj, data_np_0noise, data_pt_0noise = readcsv(fp, device, noise_to_add = noise, scale_expression = scale_expression, log_scale = log_scale)    
+    def fromcsv(cls, fp, device, val_split, normalize=False, batch_type='single', batch_time=1, batch_time_frac=1.0, noise = 0, img_save_dir = "", scale_expression = 1, log_scale = False, init_bias_y = 0, fp_test = None, store_dir = None):
+        ''' Create a datahandler from a CSV file; with store_dir the data are memory-mapped from .npy files written there '''
+        store = readcsv_store(fp, noise_to_add = noise, scale_expression = scale_expression, log_scale = log_scale, store_dir = store_dir)
+        test_store = None
         if fp_test is not None:
             print("separate test set provided!")
-            _, _, _, _, _, _, data_np_0noise_test, data_pt_0noise_test = readcsv(fp_test, device, noise_to_add = 0, scale_expression = scale_expression, log_scale = log_scale)
-            return DataHandler(data_np, data_pt, t_np, t_pt, dim, ntraj, val_split, device, normalize, batch_type, batch_time, batch_time_frac, data_np_0noise, data_pt_0noise, img_save_dir, init_bias_y, fp_test, data_np_0noise_test, data_pt_0noise_test )
+            test_store_dir = None if store_dir is None else os.path.join(store_dir, 'test')
+            test_store = readcsv_store(fp_test, noise_to_add = 0, scale_expression = scale_expression, log_scale = log_scale, store_dir = test_store_dir)
+        return cls.fromstore(store, device, val_split, normalize, batch_type, batch_time, batch_time_frac, img_save_dir, init_bias_y, fp_test, test_store)
+
+    @classmethod
+    def fromstore(cls, store, device, val_split, normalize=False, batch_type='single', batch_time=1, batch_time_frac=1.0, img_save_dir = "", init_bias_y = 0, fp_test = None, test_store = None):
+        ''' Create a datahandler from an already loaded TrajectoryStore (and noiseless test store), e.g. one memory-mapped
+        with TrajectoryStore.load and shared by several processes '''
+        data_np, data_pt, t_np, t_pt, data_np_0noise, data_pt_0noise = store.as_lists(device)
+        if test_store is not None:
+            _, _, _, _, data_np_0noise_test, data_pt_0noise_test = test_store.as_lists(device)
+            return DataHandler(data_np, data_pt, t_np, t_pt, store.dim, store.ntraj, val_split, device, normalize, batch_type, batch_time, batch_time_frac, data_np_0noise, data_pt_0noise, img_save_dir, init_bias_y, fp_test, data_np_0noise_test, data_pt_0noise_test, store = store, test_store = test_store)
         else:
-            return DataHandler(data_np, data_pt, t_np, t_pt, dim, ntraj, val_split, device, normalize, batch_type, batch_time, batch_time_frac, data_np_0noise, data_pt_0noise, img_save_dir, init_bias_y )
+            return DataHandler(data_np, data_pt, t_np, t_pt, store.dim, store.ntraj, val_split, device, normalize, batch_type, batch_time, batch_time_frac, data_np_0noise, data_pt_0noise, img_save_dir, init_bias_y, store = store)
 
     @classmethod
     def fromgenerator(cls, generator, val_split, device, normalize=False):
@@ -81,19 +100,91 @@ class DataHandler:
         ''' Saves the data to a CSV file '''
         writecsv(fp, self.dim, self.ntraj, self.data_np, self.time_np)
 
+    def _set_trajectory_views(self):
+        self.data_np, self.data_pt, self.time_np, self.time_pt, self.data_np_0noise, self.data_pt_0noise = self.store.as_lists(self.device)
+        if self.test_store is not None:
+            _, _, _, _, self.data_np_0noise_test, self.data_pt_0noise_test = self.test_store.as_lists(self.device)
+        else:
+            self.data_np_0noise_test = None
+            self.data_pt_0noise_test = None
+
     def _normalize(self):
-        max_val = 0
-        for data in self.data_pt:
-            if torch.max(torch.abs(data)) > max_val:
-                max_val = torch.max(torch.abs(data))
-        for i in range(self.ntraj):
-            self.data_pt[i] = torch.div(self.data_pt[i], max_val)
-            self.data_np[i] = self.data_np[i] / max_val.numpy()
+        max_val = np.nanmax(np.abs(self.store.values))
+        self.store.divide_values(max_val)
+        self._set_trajectory_views()
+
+    def _build_pair_table(self):
+        ''' Contiguous table of the training samples that the epoch sampler shuffles: trajectory ids for batch type
+        'trajectory', otherwise the store rows of the (trajectory, time index) pairs '''
+        if self.batch_type == 'trajectory':
+            self._train_table = np.asarray(self.train_set_original)
+        else:
+            train_pairs = np.asarray(self.train_set_original, dtype = np.int64).reshape(-1, 2)
+            self._train_table = torch.from_numpy(self.store.flat_rows(train_pairs)).to(self.device)
+            self._train_time_starts = torch.from_numpy(train_pairs[:, 1]).to(self.device)
+
+    def shard(self, rank, world_size, seed):
+        ''' Train on one of world_size shards of every epoch, for data-parallel training: all ranks shuffle the epoch
+        with the same seed (independently of the global RNG) and rank takes every world_size-th sample of it. The
+        shuffle is padded by wrapping around, so that every rank takes the same number of batches '''
+        self._shard = (rank, world_size, seed)
+        self._shard_epoch = 0
+        self._batch_generator.manual_seed(seed + 1 + rank)
+
+    @property
+    def shard_length(self):
+        ''' Number of training samples this process visits per epoch '''
+        if self._shard is None:
+            return self.train_data_length
+        return int(ceil(self.train_data_length / self._shard[1]))
+
+    def state_dict(self):
+        ''' The train/validation split, the sharding progress and the batch generator, for resuming a run '''
+        return {'val_set_indx': self.val_set_indx, 'train_set_original': self.train_set_original,
+                'shard_epoch': self._shard_epoch if self._shard is not None else 0,
+                'batch_generator': self._batch_generator.get_state()}
+
+    def load_state_dict(self, state):
+        ''' Restore the split (and sharding progress) of state_dict(), rebuilding the validation set and training table '''
+        self.val_set_indx = state['val_set_indx']
+        self.train_set_original = state['train_set_original']
+        self.n_val = len(self.val_set_indx)
+        self.train_data_length = len(self.train_set_original)
+        self._true_mu_set_pairwise = {}
+        if self.batch_type == 'single':
+            self._create_validation_set_single()
+        elif self.batch_type == 'trajectory':
+            self._create_validation_set_traj()
+        else:
+            self._create_validation_set_time()
+        self._build_pair_table()
+        if self._shard is not None:
+            self._shard_epoch = state['shard_epoch']
+        if 'batch_generator' in state:
+            self._batch_generator.set_state(state['batch_generator'])
 
     def reset_epoch(self):
-        self.train_set = self.train_set_original.copy()
+        if self._shard is None:
+            order = np.random.permutation(self.train_data_length)
+        else:
+            rank, world_size, seed = self._shard
+            order = np.random.default_rng((seed, self._shard_epoch)).permutation(self.train_data_length)
+            order = np.resize(order, self.shard_length*world_size)[rank::world_size]
+            self._shard_epoch += 1
+        self._epoch_order = torch.from_numpy(order)
+        self._epoch_position = 0
         self.epoch_done = False
 
+    def _next_epoch_indices(self, batch_size):
+        ''' Positions in the pair table of the next batch_size samples of this epoch; the last batch takes what is left '''
+        start = self._epoch_position
+        end = start + batch_size
+        if end >= len(self._epoch_order):
+            end = len(self._epoch_order)
+            self.epoch_done = True # We are doing the last items in current epoch
+        self._epoch_position = end
+        return self._epoch_order[start:end]
+
     def get_batch(self, batch_size):
         if self.batch_type == 'single':
             return self._get_batch_single(batch_size)
@@ -104,88 +195,63 @@ class DataHandler:
 
     def _get_batch_single(self, batch_size):
         ''' Get a batch of data, it's corresponding time data and the target data '''
-        train_set_size = len(self.train_set)
-
-        if train_set_size > batch_size:
-            indx = np.random.choice(train_set_size, batch_size, replace=False)
-        else:
-            indx = np.arange(train_set_size)
-            self.epoch_done = True # We are doing the last items in current epoch
-        indx = np.sort(indx)[::-1]
-        batch_indx = [self.train_set[x] for x in indx]
-        batch = []
-        t = []
-        target = []
-        for i in batch_indx:
-            batch.append(self.data_pt[i[0]][i[1]])
-            target.append(self.data_pt[i[0]][i[1] + 1])
-            t.append(torch.stack([self.time_pt[i[0]][i[1] + ii] for ii in range(2)]))
-        for i in indx:
-            self.train_set.pop(i)
-        # Convert the lists to tensors
-        reshape_size = batch_size if train_set_size > batch_size else train_set_size
-        batch = torch.stack(batch).to(self.device)
-        t = torch.stack(t).to(self.device)
-        target = torch.stack(target).to(self.device)
-        return batch, t, target
+        rows = self._train_table[self._next_epoch_indices(batch_size).to(self.device)]
+        values_pt, _, times_pt = self.store.tensors(self.device)
+        return self._gather_rows(values_pt, times_pt, rows, rows)
+
+    def _gather_pairs(self, store, pairs, noiseless = False):
+        ''' (data, t, target) for (trajectory, time index) pairs, as shaped by stacking data_pt[traj][index] '''
+        values_pt, values_0noise_pt, _ = store.tensors(self.device)
+        _, _, times_pt = self.store.tensors(self.device)
+        data_rows = torch.from_numpy(store.flat_rows(pairs)).to(self.device)
+        time_rows = torch.from_numpy(self.store.flat_rows(pairs)).to(self.device)
+        return self._gather_rows(values_0noise_pt if noiseless else values_pt, times_pt, data_rows, time_rows)
+
+    def _gather_rows(self, values_pt, times_pt, data_rows, time_rows):
+        ''' (data, t, target) for the pairs starting at the given store rows '''
+        data = values_pt[data_rows].unsqueeze(1)
+        target = values_pt[data_rows + 1].unsqueeze(1)
+        t = torch.stack((times_pt[time_rows], times_pt[time_rows + 1]), dim = 1)
+        return data, t, target
 
     def _get_batch_traj(self, batch_size):
         ''' Get a batch of data, it's corresponding time data and the target data '''
-        train_set_size = len(self.train_set)
-
-        if train_set_size > 1:
-            i = np.random.choice(train_set_size, replace=False)
-            indx = self.train_set[i]
-            self.train_set = np.delete(self.train_set, i)
-        else:
-            indx = self.train_set[0]
-            self.epoch_done = True # We are doing the last items in current epoch
-        # Convert the lists to tensors
-        batch = self.data_pt[indx][0:-1].to(self.device)
-        t = []
-        for i in range(self.time_pt[indx].shape[0] - 1):
-            t.append(torch.tensor([self.time_pt[indx][i], self.time_pt[indx][i+1]]))
-        t = torch.stack(t)
-        target = self.data_pt[indx][1::].to(self.device)
+        indx = self._train_table[int(self._next_epoch_indices(1)[0])]
+        rows = torch.from_numpy(self._trajectory_pair_rows([indx])).to(self.device)
+        values_pt, _, times_pt = self.store.tensors(self.device)
+        batch, t, target = self._gather_rows(values_pt, times_pt, rows, rows)
 
         #IH: 9/10/2021 - added these to handle unequal time availability 
         #comment these out when not requiring nan-value checking
-        not_nan_idx = [i for i in range(len(t)) if not torch.isnan(t[i]).any().item()]
-        batch = batch[not_nan_idx]
-        t = t[not_nan_idx]
-        target = target[not_nan_idx]
+        return self._drop_nan_times(batch, t, target)
 
+    def _trajectory_pair_rows(self, trajs):
+        ''' Store rows starting each consecutive pair of time points of the given trajectories, in that order '''
+        trajs = np.asarray(trajs, dtype = np.int64)
+        starts = self.store.offsets[trajs]
+        n_pairs = self.store.offsets[trajs + 1] - starts - 1
+        pair_starts = np.cumsum(n_pairs) - n_pairs
+        return np.arange(n_pairs.sum()) + np.repeat(starts - pair_starts, n_pairs)
 
-        return batch, t, target
+    def _drop_nan_times(self, data, t, target):
+        ''' Drop the pairs whose time points are missing (NaN), with one mask instead of a check per pair '''
+        not_nan = ~torch.isnan(t).any(dim = 1)
+        return data[not_nan], t[not_nan], target[not_nan]
 
     def _get_batch_time(self, batch_size):
         ''' Get a batch of data, it's corresponding time data and the target data '''
-        train_set_size = len(self.train_set)
-
-        if train_set_size > batch_size:
-            indx = np.random.choice(train_set_size, batch_size, replace=False)
-        else:
-            indx = np.arange(train_set_size)
-            self.epoch_done = True # We are doing the last items in current epoch
-        indx = np.sort(indx)[::-1]
-        batch_indx = [self.train_set[x] for x in indx]
-        batch = []
-        t = []
-        target = []
-        for i in batch_indx:
-            sub_indx = np.random.choice(np.arange(start=i[1], stop=i[1]+self.batch_time), size=self.batch_npoints, replace=False)
-            sub_indx = np.sort(sub_indx)
-            sub_indx = np.append(sub_indx, sub_indx[-1]+1)
-            batch.append(torch.stack([self.data_pt[i[0]][ii] for ii in sub_indx[0:-1]]))
-            target.append(torch.stack([self.data_pt[i[0]][ii+1] for ii in sub_indx[1::]]))
-            t.append(torch.tensor([self.time_pt[i[0]][ii] for ii in sub_indx]))
-        for i in indx:
-            self.train_set.pop(i)
-        # Convert the lists to tensors
-        reshape_size = batch_size if train_set_size > batch_size else train_set_size
-        batch = torch.stack(batch).squeeze().to(self.device)
-        t = torch.stack(t).to(self.device)
-        target = torch.stack(target).squeeze().to(self.device)
+        indx = self._next_epoch_indices(batch_size).to(self.device)
+        start_rows = self._train_table[indx]
+        # batch_npoints sorted distinct offsets into each window of batch_time points, plus the point after the last
+        window_offsets = torch.rand(len(indx), self.batch_time, device = self.device,
+                                    generator = self._batch_generator).argsort(dim = 1)[:, :self.batch_npoints]
+        window_offsets = window_offsets.sort(dim = 1).values
+        window_offsets = torch.cat((window_offsets, window_offsets[:, -1:] + 1), dim = 1)
+        sub_rows = start_rows.unsqueeze(1) + window_offsets
+        values_pt, _, times_pt = self.store.tensors(self.device)
+        batch = values_pt[sub_rows[:, 0:-1]].unsqueeze(2).squeeze()
+        target = values_pt[sub_rows[:, 1::] + 1].unsqueeze(2).squeeze()
+        t = times_pt[sub_rows]
         return batch, t, target
 
     def _split_data_single(self, val_split):
@@ -227,6 +293,8 @@ class DataHandler:
             self._calc_datasize_time()
         else:
             self._calc_datasize_single()
+        self._pair_table = np.asarray(self.indx, dtype = np.int64).reshape(-1, 2)
+        self._true_mu_set_pairwise = {}
 
     def _calc_datasize_single(self):
         self.datasize = 0
@@ -263,45 +331,44 @@ class DataHandler:
 
     
     def get_true_mu_set_pairwise(self, val_only = False, batch_type = "trajectory"):
+        ''' Noiseless (data, t, target) pairs; built on the first call and reused afterwards, as the data never change '''
+        key = (val_only, batch_type)
+        if key not in self._true_mu_set_pairwise:
+            self._true_mu_set_pairwise[key] = self._build_true_mu_set_pairwise(val_only, batch_type)
+        return self._true_mu_set_pairwise[key]
+
+    def _build_true_mu_set_pairwise(self, val_only, batch_type):
         if self.fp_test is None:
-            noiseless_data_to_care_about = self.data_pt_0noise
             if batch_type == "trajectory":
                 if val_only:
-                    all_indx = [self.indx[x] for x in np.arange(len(self.indx)) if self.indx[x][0] in  self.val_set_indx]
-                    all_indx = sorted(all_indx, key=lambda x: np.where(self.val_set_indx == x[0]))
+                    # Pairs of the validation trajectories, ordered like val_set_indx
+                    val_position = np.full(self.ntraj, -1)
+                    val_position[self.val_set_indx] = np.arange(len(self.val_set_indx))
+                    pair_position = val_position[self._pair_table[:, 0]]
+                    in_val = pair_position >= 0
+                    all_indx = self._pair_table[in_val][np.argsort(pair_position[in_val], kind = 'stable')]
                 else:
-                    all_indx = [self.indx[x] for x in np.arange(len(self.indx))]
-            if batch_type == "single":
+                    all_indx = self._pair_table
+            elif batch_type == "single":
                 if val_only:
                     all_indx = self.val_set_indx
                 else:
-                    all_indx = [self.indx[x] for x in np.arange(len(self.indx))]
+                    all_indx = self._pair_table
+            else:
+                raise ValueError("Invalid batch type: '{}'".format(batch_type))
         else:
             noiseless_data_to_care_about = self.data_pt_0noise_test
             n_test_samples = len(noiseless_data_to_care_about) * (noiseless_data_to_care_about[0].shape[0] - 1)
             print("Number of test set points: ", n_test_samples)
-            all_indx = [self.indx[x] for x in np.arange(n_test_samples)]
+            all_indx = self._pair_table[:n_test_samples]
             
-        mean_data = []
-        mean_target = []
-        mean_t = []
-
-        for i in all_indx:
-            mean_data.append(noiseless_data_to_care_about[i[0]][i[1]])
-            mean_target.append(noiseless_data_to_care_about[i[0]][i[1] + 1])
-            mean_t.append(torch.stack([self.time_pt[i[0]][i[1] + ii] for ii in range(2)]))
-        mean_data = torch.stack(mean_data).to(self.device)
-        mean_target = torch.stack(mean_target).to(self.device)
-        mean_t = torch.stack(mean_t).to(self.device)
+        # Times always come from the training data, as the test set shares its time points
+        store = self.store if self.fp_test is None else self.test_store
+        mean_data, mean_t, mean_target = self._gather_pairs(store, all_indx, noiseless = True)
 
         #IH: 9/10/2021 - added these to handle unequal time availability 
         #comment these out when not requiring nan-value checking
-        not_nan_idx = [i for i in range(len(mean_t)) if not torch.isnan(mean_t[i]).any().item()]
-        mean_data = mean_data[not_nan_idx]
-        mean_t = mean_t[not_nan_idx]
-        mean_target = mean_target[not_nan_idx]
-
-        return mean_data, mean_t, mean_target
+        return self._drop_nan_times(mean_data, mean_t, mean_target)
        
     def get_true_mu_set_init_val_based(self, val_only = False): 
         
@@ -383,13 +450,7 @@ class DataHandler:
         self.val_target = []
         self.val_t = []
         if self.val_set_indx:
-            for i in self.val_set_indx:
-                self.val_data.append(self.data_pt[i[0]][i[1]])
-                self.val_target.append(self.data_pt[i[0]][i[1] + 1])
-                self.val_t.append(torch.stack([self.time_pt[i[0]][i[1] + ii] for ii in range(2)]))
-            self.val_data = torch.stack(self.val_data).to(self.device)
-            self.val_target = torch.stack(self.val_target).to(self.device)
-            self.val_t = torch.stack(self.val_t).to(self.device)
+            self.val_data, self.val_t, self.val_target = self._gather_pairs(self.store, self.val_set_indx)
 
     def _create_validation_set_traj(self):
         ''' Create the validation set '''
@@ -397,14 +458,10 @@ class DataHandler:
         self.val_target = []
         self.val_t = []
         if self.val_set_indx.any():
-            for i in self.val_set_indx:
-                self.val_data.append(self.data_pt[i][0:-1]) 
-                self.val_target.append(self.data_pt[i][1::])
-                self.val_t.append(torch.stack([torch.stack((self.time_pt[i][s], self.time_pt[i][s +1])) for s in range(len(self.time_pt[i])-1)]))
-                #self.val_t.append(self.time_pt[i]) IH commented out and added line above for traj method 3/21/23
-            self.val_data = torch.cat(self.val_data, dim = 0).to(self.device) 
-            self.val_target = torch.cat(self.val_target, dim = 0).to(self.device) 
-            self.val_t = torch.cat(self.val_t, dim = 0).to(self.device) 
+            # All consecutive pairs of the validation trajectories, gathered from the store in one go
+            rows = torch.from_numpy(self._trajectory_pair_rows(self.val_set_indx)).to(self.device)
+            values_pt, _, times_pt = self.store.tensors(self.device)
+            self.val_data, self.val_t, self.val_target = self._gather_rows(values_pt, times_pt, rows, rows)
 
             
 
@@ -19,6 +19,7 @@ except ImportError:
 
 #from datagenerator import DataGenerator
 from datahandler import DataHandler
+from influence import InfluenceScorer
 from odenet import ODENet
 from read_config import read_arguments_from_file
 from visualization_inte import *
@@ -33,6 +34,9 @@ parser = argparse.ArgumentParser('Testing')
 parser.add_argument('--settings', type=str, default='config_inte.cfg')
 clean_name =  "desmedt_11165genes_1sample_186T" 
 parser.add_argument('--data', type=str, default='/home/ubuntu/neural_ODE/breast_cancer_data/clean_data/{}.csv'.format(clean_name))
+parser.add_argument('--memory_budget_mb', type=int, default=2048)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--resume', action='store_true', help='keep the scores of an interrupted run of the same model, seed and genes')
 
 args = parser.parse_args()
 device = "cpu"
@@ -62,19 +66,11 @@ if __name__ == "__main__":
 
     time_pts_to_project = torch.from_numpy(np.arange(0,1,0.1))
     n_random_inputs_per_gene = 200
-    all_scores = []
-    #Read in the prior matrix
-    for this_gene in range(data_handler.dim):
-        this_init = 1*(torch.rand(n_random_inputs_per_gene,1,data_handler.dim, device = data_handler.device) - 0.5)
-        unpert_out = odeint(odenet,this_init, time_pts_to_project, method= settings['method'])
-        this_pert_col =  1*(torch.rand(n_random_inputs_per_gene,device = data_handler.device) - 0.5)
-        this_init[:,0, this_gene] = this_pert_col 
-        pert_out = odeint(odenet,this_init, time_pts_to_project, method= settings['method']) 
-        all_other_genes = [idx for idx in range(data_handler.dim) if idx != this_gene]
-        this_gene_score = torch.mean(abs(unpert_out[1:,:,:,all_other_genes] - pert_out[1:,:,:,all_other_genes]))
-        all_scores.append(this_gene_score.item())
-        print(this_gene)
-
-    print("done, saving now!")
-    np.savetxt('/home/ubuntu/neural_ODE/ode_net/code/model_inspect/inferred_influence_{}.csv'.format(data_handler.dim), 
-                    all_scores, delimiter=',') 
\ No newline at end of file
+    # The unperturbed trajectories are solved once; the perturbations of many genes are solved together per batch
+    scorer = InfluenceScorer(odenet, data_handler.dim, time_pts_to_project, method = settings['method'],
+                             n_inputs = n_random_inputs_per_gene, memory_budget_mb = args.memory_budget_mb,
+                             seed = args.seed, device = data_handler.device)
+    # Scores are streamed to the file as they are computed; with --resume a rerun picks up where it stopped
+    all_scores = scorer.score(out_fp = '/home/ubuntu/neural_ODE/ode_net/code/model_inspect/inferred_influence_{}.csv'.format(data_handler.dim),
+                              resume = args.resume, model_fp = pretrained_model_file)
+    print("done!")
@@ -0,0 +1,94 @@
+# Imports
+import argparse
+import numpy as np
+import torch
+
+from datahandler import DataHandler
+from odenet import ODENet
+from read_config import read_arguments_from_file
+
+
+def sample_states(data_handler, n_states = 10000, seed = None):
+    ''' Up to n_states observed expression states (rows of the training data), drawn without replacement '''
+    values = data_handler.store.values
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(values.shape[0], size = min(n_states, values.shape[0]), replace = False))
+    return torch.from_numpy(np.asarray(values[rows])).to(data_handler.device)
+
+def extract_grn(odenet, states, top_k = None, target_chunk = 2048, include_decay = False, state_chunk = 4096):
+    ''' Effects of every regulator on every target, as the Jacobian of odenet.forward averaged over states, laid out
+    like effects_mat: entry [j, i] is d f_i / d y_j, regulators in rows and targets in columns. Without include_decay
+    the -gene_multipliers decay on the diagonal is left out, as it is not a regulatory edge.
+
+    Returns a dense (ndim, ndim) tensor, or with top_k a sparse COO tensor keeping the top_k largest effects (in
+    absolute value) per target. The effects are built target_chunk targets at a time, so the top_k path never holds
+    the dense matrix '''
+    with torch.no_grad():
+        diag, u, v = odenet.mean_jacobian_structure(states, chunk_size = state_chunk)
+        ndim = diag.shape[0]
+        rows, cols, values = [], [], []
+        dense = None if top_k is not None else torch.empty(ndim, ndim, dtype = u.dtype, device = u.device)
+        for start in range(0, ndim, target_chunk):
+            targets = torch.arange(start, min(start + target_chunk, ndim), device = u.device)
+            effects = v.matmul(u[targets].t())
+            if include_decay:
+                effects[targets, targets - start] += diag[targets]
+            if top_k is None:
+                dense[:, targets] = effects
+                continue
+            top = effects.abs().topk(min(top_k, ndim), dim = 0).indices
+            top_values = effects.gather(0, top).reshape(-1)
+            # Targets with fewer than top_k nonzero effects (e.g. a zero gene multiplier) keep only those
+            nonzero = top_values != 0
+            rows.append(top.reshape(-1)[nonzero])
+            cols.append(targets.repeat(top.shape[0])[nonzero])
+            values.append(top_values[nonzero])
+    if top_k is None:
+        return dense
+    indices = torch.stack((torch.cat(rows), torch.cat(cols)))
+    return torch.sparse_coo_tensor(indices, torch.cat(values), (ndim, ndim)).coalesce()
+
+def write_edge_list(fp, effects):
+    ''' Write a sparse effects matrix as a 1-based (regulator, target, value) edge list, the format
+    prior_loss.read_prior_matrix(sparse = True) reads '''
+    effects = effects.coalesce().cpu()
+    indices = effects.indices().numpy() + 1
+    table = np.column_stack((indices[0], indices[1], effects.values().numpy()))
+    np.savetxt(fp, table, fmt = ['%d', '%d', '%.8g'], delimiter = ',')
+    print("Written to file {}".format(fp))
+
+
+parser = argparse.ArgumentParser('Extract a GRN from a trained model')
+parser.add_argument('--settings', type=str, default='config_inte.cfg')
+parser.add_argument('--data', type=str, default='../../ground_truth_simulator/clean_data/chalmers_690genes_10samples_for_testing.csv')
+parser.add_argument('--model', type=str, default='output/_pretrained_best_model/best_val_model.pt')
+parser.add_argument('--n_states', type=int, default=10000)
+parser.add_argument('--top_k', type=int, default=None)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--out', type=str, default='model_inspect/effects_mat.csv')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    settings = read_arguments_from_file(args.settings)
+    device = "cpu"
+    data_handler = DataHandler.fromcsv(args.data, device, settings['val_split'], normalize=settings['normalize_data'],
+                                        batch_type=settings['batch_type'], batch_time=settings['batch_time'],
+                                        batch_time_frac=settings['batch_time_frac'],
+                                        noise = 0,
+                                        img_save_dir = "NULL",
+                                        scale_expression = settings['scale_expression'],
+                                        log_scale = settings['log_scale'],
+                                        init_bias_y = settings['init_bias_y'])
+    odenet = ODENet(device, data_handler.dim, explicit_time=settings['explicit_time'], neurons = settings['neurons_per_layer'],
+                    log_scale = settings['log_scale'], init_bias_y = settings['init_bias_y'])
+    odenet.float()
+    odenet.load(args.model)
+
+    states = sample_states(data_handler, args.n_states, args.seed)
+    print("Averaging the Jacobian over {} observed states".format(states.shape[0]))
+    effects = extract_grn(odenet, states, top_k = args.top_k)
+    if args.top_k is None:
+        np.savetxt(args.out, effects.cpu().numpy(), delimiter=",")
+        print("Written to file {}".format(args.out))
+    else:
+        write_edge_list(args.out, effects)
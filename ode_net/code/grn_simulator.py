@@ -0,0 +1,229 @@
+import argparse
+import ast
+import csv
+import operator
+import os
+import numpy as np
+import torch
+try:
+    from torchdiffeq.__init__ import odeint
+except ImportError:
+    from torchdiffeq import odeint
+
+from csvreader import write_values_cache
+
+
+_BINARY_OPS = {ast.Add: torch.add, ast.Sub: torch.sub, ast.Mult: torch.mul, ast.Div: torch.div}
+_CONSTANT_OPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+
+def read_ode_system(fp):
+    ''' (node, eqn) rows of an ode_system_functions CSV, in file order; eqn is "input gene" for input genes '''
+    with open(fp, 'r', newline = '') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [(node, eqn) for node, eqn in reader]
+
+
+class GRNSystem:
+    ''' The ground-truth GRN of an ode_system_functions CSV, compiled once into a vectorized right-hand side.
+
+    Genes are ordered like the columns of the R simulator's data files: input genes first, then the other genes, each
+    in file order. Every distinct Hill term fAct(TF, EC50, n) (fInh(TF, EC50, n) = 1 - fAct) is evaluated in one
+    gathered op over all genes, and the arithmetic of the equations is flattened into slots that are evaluated level by
+    level, one indexed op per level and operator, so the cost does not depend on the number of genes in Python.
+    Input genes are held constant '''
+
+    def __init__(self, ode_system, device = 'cpu', dtype = torch.float64):
+        input_genes = [node for node, eqn in ode_system if eqn == 'input gene']
+        other_genes = [(node, eqn) for node, eqn in ode_system if eqn != 'input gene']
+        self.gene_names = input_genes + [node for node, eqn in other_genes]
+        self.n_inputs = len(input_genes)
+        self.dim = len(self.gene_names)
+        self.device = device
+        self.dtype = dtype
+        self._gene_index = {name: i for i, name in enumerate(self.gene_names)}
+
+        # Slots: gene values, then constants, Hill terms and operator results, deduplicated by their definition
+        self._slots = {}
+        self._constants, self._hill_terms, self._ops = [], [], []
+        self._constant_values = {}
+        self._levels = [0] * self.dim
+        roots = [self._compile(ast.parse(eqn, mode = 'eval').body) for node, eqn in other_genes]
+        self._finalize(roots)
+
+    @classmethod
+    def fromcsv(cls, fp, device = 'cpu', dtype = torch.float64):
+        return cls(read_ode_system(fp), device, dtype)
+
+    def _slot(self, key, level, register):
+        if key not in self._slots:
+            self._slots[key] = self.dim + len(self._slots)
+            self._levels.append(level)
+            register()
+        return self._slots[key]
+
+    def _constant(self, value):
+        slot = self._slot(('const', value), 0, lambda: self._constants.append(value))
+        self._constant_values[slot] = value
+        return slot
+
+    def _compile(self, node):
+        ''' Slot holding the value of an expression node '''
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return self._constant(float(node.value))
+        if isinstance(node, ast.Name):
+            if node.id not in self._gene_index:
+                raise ValueError('Unknown gene {} in equation'.format(node.id))
+            return self._gene_index[node.id]
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            if isinstance(node.operand, ast.Constant):
+                return self._constant(-float(node.operand.value))
+            return self._binary_op(ast.Sub, self._constant(0.), self._compile(node.operand))
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            return self._binary_op(type(node.op), self._compile(node.left), self._compile(node.right))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ('fAct', 'fInh'):
+            tf, ec50, n = node.args
+            if not isinstance(tf, ast.Name) or tf.id not in self._gene_index:
+                raise ValueError('{} expects a gene as its first argument: {}'.format(node.func.id, ast.dump(node)))
+            key = ('hill', self._gene_index[tf.id], float(ast.literal_eval(ec50)), float(ast.literal_eval(n)))
+            act = self._slot(key, 0, lambda: self._hill_terms.append(key[1:]))
+            if node.func.id == 'fInh':
+                return self._binary_op(ast.Sub, self._constant(1.), act)
+            return act
+        raise ValueError('Unsupported expression in equation: {}'.format(ast.dump(node)))
+
+    def _binary_op(self, op, left, right):
+        # Fold constants and the identities the R equation generator emits, like "1 * fAct(...)" and "(...) / 1"
+        left_value, right_value = self._constant_values.get(left), self._constant_values.get(right)
+        if left_value is not None and right_value is not None:
+            return self._constant(_CONSTANT_OPS[op](left_value, right_value))
+        if (op in (ast.Mult, ast.Div) and right_value == 1.) or (op in (ast.Add, ast.Sub) and right_value == 0.):
+            return left
+        if (op is ast.Mult and left_value == 1.) or (op is ast.Add and left_value == 0.):
+            return right
+        level = max(self._levels[left], self._levels[right]) + 1
+        return self._slot((op, left, right), level, lambda: self._ops.append((op, left, right)))
+
+    def _finalize(self, roots):
+        ''' Index tensors of the compiled slots, with the operators grouped by level '''
+        as_index = lambda values: torch.tensor(values, dtype = torch.long, device = self.device)
+        as_float = lambda values: torch.tensor(values, dtype = self.dtype, device = self.device)
+        self.n_slots = self.dim + len(self._slots)
+        self.constant_slots = as_index([self._slots[('const', value)] for value in self._constants])
+        self.constant_values = as_float(self._constants)
+        hill = np.array(self._hill_terms, dtype = np.float64).reshape(-1, 3)
+        self.hill_slots = as_index([self._slots[('hill',) + tuple(term)] for term in self._hill_terms])
+        self.hill_tf = as_index(hill[:, 0].astype(np.int64))
+        self.hill_n = as_float(hill[:, 2])
+        ec50_n = hill[:, 1] ** hill[:, 2]
+        self.hill_B = as_float((ec50_n - 1) / (2*ec50_n - 1))
+        self.hill_K_n = self.hill_B - 1
+
+        grouped = {}
+        for op, left, right in self._ops:
+            out = self._slots[(op, left, right)]
+            grouped.setdefault((self._levels[out], op), []).append((out, left, right))
+        self.op_levels = []
+        for level, op in sorted(grouped, key = lambda level_op: level_op[0]):
+            out, left, right = zip(*grouped[(level, op)])
+            self.op_levels.append((_BINARY_OPS[op], as_index(out), as_index(left), as_index(right)))
+        self.rate_slots = as_index(roots)
+        self.n_hill_terms = len(self._hill_terms)
+        del self._slots, self._levels, self._ops, self._constant_values
+
+    def __call__(self, t, y):
+        ''' dy/dt for states y of shape (..., dim); autonomous, t is ignored '''
+        # Slot-major layout, so that every gather and scatter moves whole contiguous rows
+        flat_y = y.reshape(-1, self.dim).t()
+        slots = flat_y.new_empty(self.n_slots, flat_y.shape[1])
+        slots[:self.dim] = flat_y
+        slots[self.constant_slots] = self.constant_values.unsqueeze(1)
+        tf_n = flat_y[self.hill_tf].clamp(min = 0) ** self.hill_n.unsqueeze(1)
+        slots[self.hill_slots] = self.hill_B.unsqueeze(1) * tf_n / (self.hill_K_n.unsqueeze(1) + tf_n)
+        for op, out, left, right in self.op_levels:
+            slots[out] = op(slots[left], slots[right])
+        rates = torch.zeros_like(flat_y)
+        rates[self.n_inputs:] = slots[self.rate_slots]
+        return rates.t().reshape(y.shape)
+
+    def sample_initial_conditions(self, n_samples, input_gene_var = 1, output_gene_var = 1, seed = None):
+        ''' Initial states drawn like SimulationGRN_core_init_var.R (unimodal, uncorrelated inputs): every input gene
+        has a normal input model with a Beta(10, 10) mean, truncated to [0, 1] by redrawing, and every other gene starts
+        from Beta(2/output_gene_var, 2/output_gene_var) shifted by a per-gene U(-0.25, 0.25) and clipped to [0, 1] '''
+        rng = np.random.default_rng(seed)
+        y0 = np.empty((n_samples, self.dim))
+
+        means = rng.beta(10, 10, size = self.n_inputs)
+        sds = np.maximum(rng.beta(15, 15, size = self.n_inputs) * np.minimum(means, 1 - means)/3, 0.01) * input_gene_var
+        inputs = np.full((n_samples, self.n_inputs), -1.)
+        out_of_bounds = np.ones(inputs.shape, dtype = bool)
+        while out_of_bounds.any():
+            draws = rng.normal(means, sds, size = inputs.shape)
+            inputs[out_of_bounds] = draws[out_of_bounds]
+            out_of_bounds = (inputs < 0) | (inputs > 1)
+        y0[:, :self.n_inputs] = inputs
+
+        n_outputs = self.dim - self.n_inputs
+        shape = 2/output_gene_var
+        y0[:, self.n_inputs:] = rng.beta(shape, shape, size = (n_samples, n_outputs)) + rng.uniform(-0.25, 0.25, size = n_outputs)
+        return np.clip(y0, 0, 1)
+
+    def simulate(self, y0, times, batch_size = 1000, method = 'dopri5', rtol = 1e-6, atol = 1e-8):
+        ''' Noiseless trajectories (n_samples, len(times), dim) from initial states y0, integrated batch_size samples at
+        a time '''
+        t = torch.as_tensor(times, dtype = self.dtype, device = self.device)
+        y0 = torch.as_tensor(y0, dtype = self.dtype, device = self.device)
+        trajectories = np.empty((y0.shape[0], len(times), self.dim))
+        with torch.no_grad():
+            for start in range(0, y0.shape[0], batch_size):
+                solution = odeint(self, y0[start:start + batch_size], t, method = method, rtol = rtol, atol = atol)
+                trajectories[start:start + batch_size] = solution.transpose(0, 1).cpu().numpy()
+        return trajectories
+
+
+def write_dataset(fp, trajectories, times, noise = 0, seed = None, write_cache = True):
+    ''' Write trajectories (n_samples, n_times, dim) in the data CSV format readcsv expects, optionally with normal
+    noise of sd noise added, plus the binary sidecar readcsv loads instead of parsing the CSV '''
+    n_samples, n_times, dim = trajectories.shape
+    if noise > 0:
+        trajectories = trajectories + np.random.default_rng(seed).normal(0, noise, size = trajectories.shape)
+    # Header row, then per sample one row per gene and a row of time points
+    blocks = np.empty((n_samples, dim + 1, n_times))
+    blocks[:, :dim] = trajectories.transpose(0, 2, 1)
+    blocks[:, dim] = times
+    blocks = blocks.reshape(-1, n_times)
+    with open(fp, 'w') as f:
+        f.write('{},{}\n'.format(dim, n_samples))
+        # %.17g round-trips float64, so the CSV parses to exactly the cached values
+        np.savetxt(f, blocks, fmt = '%.17g', delimiter = ',')
+    if write_cache:
+        values = np.concatenate(([dim, n_samples], blocks.reshape(-1))).astype(np.float64)
+        row_offsets = np.concatenate(([0], 2 + n_times*np.arange(blocks.shape[0] + 1))).astype(np.int64)
+        write_values_cache(fp, values, row_offsets)
+    print("Written to file {}".format(fp))
+
+
+parser = argparse.ArgumentParser('Simulate a ground-truth GRN')
+parser.add_argument('--ode_system', type=str, default='../../ground_truth_simulator/clean_data/ode_system_functions.csv')
+parser.add_argument('--samples', type=int, default=160)
+parser.add_argument('--times', type=float, nargs='+', default=[0, 2, 3, 7, 9])
+parser.add_argument('--noise', type=float, nargs='+', default=[0])
+parser.add_argument('--input_gene_var', type=float, default=1)
+parser.add_argument('--output_gene_var', type=float, default=1)
+parser.add_argument('--batch_size', type=int, default=1000)
+parser.add_argument('--seed', type=int, default=None)
+parser.add_argument('--device', type=str, default='cpu')
+parser.add_argument('--out_dir', type=str, default='../../ground_truth_simulator/clean_data')
+parser.add_argument('--name', type=str, default='simulated')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    system = GRNSystem.fromcsv(args.ode_system, device = args.device)
+    print("Compiled {} genes ({} inputs) into {} Hill terms and {} operator levels".format(
+        system.dim, system.n_inputs, system.n_hill_terms, len(system.op_levels)))
+    y0 = system.sample_initial_conditions(args.samples, args.input_gene_var, args.output_gene_var, args.seed)
+    trajectories = system.simulate(y0, args.times, batch_size = args.batch_size)
+    for noise in args.noise:
+        fp = os.path.join(args.out_dir, '{}_{}genes_{}samples_noise_{}.csv'.format(args.name, system.dim, args.samples, noise))
+        write_dataset(fp, trajectories, args.times, noise = noise, seed = args.seed)
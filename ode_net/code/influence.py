@@ -0,0 +1,113 @@
+import json
+import os
+import numpy as np
+import torch
+try:
+    from torchdiffeq.__init__ import odeint
+except ImportError:
+    from torchdiffeq import odeint
+
+
+class InfluenceScorer:
+    ''' Perturbation influence of every gene on the rest of a trained model.
+
+    n_inputs random initial states are drawn once and their unperturbed trajectories are solved once. The influence of
+    gene g is the mean absolute change of all the other genes over the projected time points (after the first) when
+    column g of the initial states is replaced by fresh random values. The perturbations of many genes are stacked into
+    one batch per solve, with as many genes per batch as fit memory_budget_mb. The random states and perturbation
+    columns are drawn from seed (per gene for the columns), so the scores do not depend on how genes are chunked '''
+
+    # Copies of the state per batch row that a solve keeps alive besides its output: solver stages, error estimate and
+    # interpolation coefficients of dopri5, plus the ODENet intermediates
+    STATE_COPIES_PER_ROW = 16
+
+    def __init__(self, odenet, dim, t, method = 'dopri5', n_inputs = 200, scale = 1, memory_budget_mb = 1024,
+                 seed = None, device = 'cpu', options = None):
+        self.odenet = odenet
+        self.dim = dim
+        self.t = torch.as_tensor(t).to(device)
+        self.method = method
+        self.options = options
+        self.n_inputs = n_inputs
+        self.scale = scale
+        self.device = device
+        self.seed = int(torch.randint(2**62, (1,))) if seed is None else seed
+        self.dtype = next(odenet.parameters()).dtype
+
+        bytes_per_row = (len(self.t) + self.STATE_COPIES_PER_ROW) * dim * torch.finfo(self.dtype).bits // 8
+        rows_in_budget = memory_budget_mb * 2**20 // bytes_per_row
+        self.genes_per_chunk = max(1, int(rows_in_budget // n_inputs))
+
+        generator = torch.Generator(device = device).manual_seed(self.seed)
+        self.init_states = self._uniform((n_inputs, 1, dim), generator)
+        self.baseline = self._solve(self.init_states)
+
+    def _uniform(self, shape, generator):
+        return (torch.rand(shape, generator = generator, device = self.device, dtype = self.dtype) - 0.5)*self.scale
+
+    def _solve(self, init_states):
+        with torch.no_grad():
+            return odeint(self.odenet, init_states, self.t, method = self.method, options = self.options)
+
+    def score_chunk(self, genes):
+        ''' Influence scores of the given genes, from one stacked solve '''
+        genes = torch.as_tensor(genes, dtype = torch.long, device = self.device)
+        n_genes = len(genes)
+        columns = torch.stack([self._uniform((self.n_inputs,), torch.Generator(device = self.device).manual_seed(self.seed + 1 + int(gene)))
+                               for gene in genes])
+        perturbed = self.init_states.repeat(n_genes, 1, 1).reshape(n_genes, self.n_inputs, self.dim)
+        perturbed[torch.arange(n_genes, device = self.device), :, genes] = columns
+        perturbed_out = self._solve(perturbed.reshape(n_genes*self.n_inputs, 1, self.dim))
+
+        # |perturbed - unperturbed| of every gene, minus that of the perturbed gene itself
+        baseline = self.baseline[1:].reshape(-1, 1, self.n_inputs, self.dim)
+        change = (perturbed_out[1:].reshape(-1, n_genes, self.n_inputs, self.dim) - baseline).abs()
+        total = change.sum(dim = (0, 2, 3))
+        own = change[:, torch.arange(n_genes, device = self.device), :, genes].sum(dim = (1, 2))
+        n_values = (len(self.t) - 1) * self.n_inputs * (self.dim - 1)
+        return ((total - own)/n_values).cpu().numpy()
+
+    def run_info(self, genes, model_fp = None):
+        ''' What identifies a scoring run, kept next to its output file so that only the same run is resumed '''
+        return {'model': model_fp, 'seed': self.seed, 'n_inputs': self.n_inputs, 'scale': self.scale, 'method': self.method,
+                't': self.t.tolist(), 'genes': [int(gene) for gene in genes]}
+
+    def score(self, genes = None, out_fp = None, verbose = True, resume = False, model_fp = None):
+        ''' Influence scores of genes (all by default), in order. With out_fp the scores are written to that file chunk
+        by chunk as they are computed, one per line, next to a out_fp.json sidecar describing the run (model_fp, seed,
+        n_inputs, time points and genes). The file is overwritten unless resume is set, in which case the genes already
+        scored there are not recomputed, provided the sidecar matches this run '''
+        genes = np.arange(self.dim) if genes is None else np.asarray(genes)
+        done = []
+        if out_fp is not None:
+            info_fp = out_fp + '.json'
+            info = self.run_info(genes, model_fp)
+            if resume and os.path.exists(out_fp):
+                saved_info = None
+                if os.path.exists(info_fp):
+                    with open(info_fp) as f:
+                        saved_info = json.load(f)
+                if saved_info != info:
+                    raise ValueError("{} was written by another run (see {}), score without resume to overwrite it".format(out_fp, info_fp))
+                done = list(np.loadtxt(out_fp, delimiter = ',', ndmin = 1))[:len(genes)]
+                if done and verbose:
+                    print("Resuming after {} genes already scored in {}".format(len(done), out_fp))
+            else:
+                with open(info_fp, 'w') as f:
+                    json.dump(info, f)
+
+        scores = done
+        out_file = open(out_fp, 'a' if done else 'w') if out_fp is not None else None
+        try:
+            for start in range(len(done), len(genes), self.genes_per_chunk):
+                chunk_scores = self.score_chunk(genes[start:start + self.genes_per_chunk])
+                scores.extend(chunk_scores)
+                if out_file is not None:
+                    np.savetxt(out_file, chunk_scores, delimiter = ',')
+                    out_file.flush()
+                if verbose:
+                    print("Scored {}/{} genes".format(len(scores), len(genes)))
+        finally:
+            if out_file is not None:
+                out_file.close()
+        return np.asarray(scores)
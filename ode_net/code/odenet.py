@@ -4,6 +4,7 @@ import sys
 import numpy as np
 
 from torch.nn.init import calculate_gain
+from torch.autograd.function import once_differentiable
 #torch.set_num_threads(36)
 
 def off_diag_init(m):
@@ -39,11 +40,170 @@ class LogShiftedSoftSignMod(nn.Module):
         return(torch.log1p(soft_sign_mod))  
 
 
+def _compressed_indices(indices, size):
+    ''' CSR row pointers for sorted row indices '''
+    crow_indices = torch.zeros(size + 1, dtype = torch.long, device = indices.device)
+    crow_indices[1:] = torch.bincount(indices, minlength = size).cumsum(0)
+    return crow_indices
+
+
+class _SparseLinearFunction(torch.autograd.Function):
+    ''' input @ W^T for the CSR weight of a SparseLinear, with gradients for its non-zero values only '''
+
+    @staticmethod
+    def forward(ctx, input, values, layer):
+        ctx.layer = layer
+        ctx.save_for_backward(input, values)
+        weight = torch.sparse_csr_tensor(layer.crow_indices, layer.col_indices, values, (layer.out_features, layer.in_features))
+        return torch.mm(weight, input.t()).t()
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        layer = ctx.layer
+        input, values = ctx.saved_tensors
+        grad_input = grad_values = None
+        if ctx.needs_input_grad[0]:
+            weight_t = torch.sparse_csr_tensor(layer.transpose_crow_indices, layer.row_indices[layer.transpose_order],
+                                               values[layer.transpose_order], (layer.in_features, layer.out_features))
+            grad_input = torch.mm(weight_t, grad_output.t()).t()
+        if ctx.needs_input_grad[1]:
+            # dL/dW sampled on the support only, never forming the dense gradient
+            support = torch.sparse_csr_tensor(layer.crow_indices, layer.col_indices, torch.zeros_like(values), (layer.out_features, layer.in_features))
+            grad_values = torch.sparse.sampled_addmm(support, grad_output.t().contiguous(), input, beta = 0).values()
+        return grad_input, grad_values, None
+
+
+class _SumsProdsFunction(torch.autograd.Function):
+    ''' cat((W_s softsign(y) + b_s, exp(W_p log1p(softsign(y)) + b_p)), dim = -1), i.e. the dense net_sums and net_prods
+    branches of ODENet, with both branches run as one batched GEMM and a fused closed-form backward '''
+
+    @staticmethod
+    def forward(ctx, y, sums_weight, sums_bias, prods_weight, prods_bias):
+        ndim = y.shape[-1]
+        neurons = sums_weight.shape[0]
+        shifted_input = y.reshape(-1, ndim) - 0.5
+        denom = torch.abs(shifted_input).add_(1)
+        branch_inputs = torch.empty(2, shifted_input.shape[0], ndim, dtype = y.dtype, device = y.device)
+        torch.div(shifted_input, denom, out = branch_inputs[0])
+        torch.log1p(branch_inputs[0], out = branch_inputs[1])
+        stacked_weight = torch.stack((sums_weight.t(), prods_weight.t()))
+        sums_prods_concat = torch.empty(shifted_input.shape[0], 2, neurons, dtype = y.dtype, device = y.device)
+        torch.baddbmm(torch.stack((sums_bias, prods_bias)).unsqueeze(1), branch_inputs, stacked_weight, out = sums_prods_concat.transpose(0, 1))
+        sums_prods_concat[:, 1].exp_()
+        ctx.save_for_backward(branch_inputs, denom, sums_prods_concat, stacked_weight)
+        ctx.y_shape = y.shape
+        return sums_prods_concat.view(*y.shape[:-1], 2*neurons)
+
+    @staticmethod
+    @once_differentiable
+    def backward(ctx, grad_output):
+        branch_inputs, denom, sums_prods_concat, stacked_weight = ctx.saved_tensors
+        neurons = stacked_weight.shape[2]
+        grad_branches = grad_output.reshape(-1, 2, neurons).transpose(0, 1)
+        # through the exp of the prods branch
+        grad_branches = torch.stack((grad_branches[0], grad_branches[1]*sums_prods_concat[:, 1]))
+        grad_y = grad_weights = grad_biases = None
+        if ctx.needs_input_grad[0]:
+            grad_inputs = torch.bmm(grad_branches, stacked_weight.transpose(1, 2))
+            soft_sign = branch_inputs[0]
+            grad_y = ((grad_inputs[0] + grad_inputs[1]/(1 + soft_sign))/denom**2).reshape(ctx.y_shape)
+        if ctx.needs_input_grad[1] or ctx.needs_input_grad[3]:
+            grad_weights = torch.bmm(grad_branches.transpose(1, 2), branch_inputs)
+        if ctx.needs_input_grad[2] or ctx.needs_input_grad[4]:
+            grad_biases = grad_branches.sum(1)
+        return (grad_y, None if grad_weights is None else grad_weights[0], None if grad_biases is None else grad_biases[0],
+                None if grad_weights is None else grad_weights[1], None if grad_biases is None else grad_biases[1])
+
+
+class SparseLinear(nn.Module):
+    ''' nn.Linear whose weight only stores its non-zero entries (in CSR order) as trainable values '''
+
+    def __init__(self, in_features, out_features, row_indices, col_indices, values, bias = None):
+        super(SparseLinear, self).__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        order = self._set_support(row_indices, col_indices)
+        self.values = nn.Parameter(values[order].clone())
+        if bias is None:
+            self.register_parameter('bias', None)
+        else:
+            self.bias = nn.Parameter(bias.clone())
+
+    @classmethod
+    def from_linear(cls, linear):
+        ''' Sparse copy of an nn.Linear, keeping the support of its non-zero weights '''
+        weight = linear.weight.detach()
+        row_indices, col_indices = weight.nonzero(as_tuple = True)
+        bias = None if linear.bias is None else linear.bias.detach()
+        return cls(linear.in_features, linear.out_features, row_indices, col_indices, weight[row_indices, col_indices], bias)
+
+    def _set_support(self, row_indices, col_indices):
+        ''' Store the support sorted in CSR order, plus the CSR layout of its transpose for the backward pass.
+        Returns the sorting permutation '''
+        order = torch.argsort(row_indices*self.in_features + col_indices)
+        row_indices = row_indices[order]
+        col_indices = col_indices[order]
+        self.register_buffer('row_indices', row_indices)
+        self.register_buffer('col_indices', col_indices)
+        self.register_buffer('crow_indices', _compressed_indices(row_indices, self.out_features))
+        transpose_order = torch.argsort(col_indices*self.out_features + row_indices)
+        self.register_buffer('transpose_order', transpose_order)
+        self.register_buffer('transpose_crow_indices', _compressed_indices(col_indices[transpose_order], self.in_features))
+        return order
+
+    @property
+    def weight(self):
+        ''' Dense (out_features, in_features) weight, e.g. for extracting the model matrix '''
+        weight = torch.zeros(self.out_features, self.in_features, dtype = self.values.dtype, device = self.values.device)
+        return weight.index_put((self.row_indices, self.col_indices), self.values)
+
+    def forward(self, input):
+        output = _SparseLinearFunction.apply(input.reshape(-1, self.in_features), self.values, self)
+        if self.bias is not None:
+            output = output + self.bias
+        return output.reshape(*input.shape[:-1], self.out_features)
+
+    @torch.no_grad()
+    def rewire(self, fraction, optimizer = None, generator = None):
+        ''' Prune the given fraction of weights with the smallest magnitude and regrow as many at random empty positions,
+        starting from zero (SET, Mocanu et al. 2018), drawn from generator if given. The optimizer state of the moved
+        weights is reset.
+        Returns the number of weights moved '''
+        nnz = self.values.numel()
+        n_moved = min(int(fraction*nnz), self.in_features*self.out_features - nnz)
+        if n_moved <= 0:
+            return 0
+        dropped = torch.topk(self.values.abs(), n_moved, largest = False).indices
+        occupied = torch.zeros(self.out_features*self.in_features, dtype = torch.bool, device = self.values.device)
+        occupied[self.row_indices*self.in_features + self.col_indices] = True
+        empty = (~occupied).nonzero().squeeze(1)
+        grown = empty[torch.randperm(empty.numel(), generator = generator, device = empty.device)[:n_moved]]
+
+        row_indices = self.row_indices.clone()
+        col_indices = self.col_indices.clone()
+        row_indices[dropped] = grown // self.in_features
+        col_indices[dropped] = grown % self.in_features
+        order = self._set_support(row_indices, col_indices)
+
+        state_tensors = [self.values]
+        if optimizer is not None:
+            state_tensors += [state for state in optimizer.state.get(self.values, {}).values()
+                              if torch.is_tensor(state) and state.shape == self.values.shape]
+        for tensor in state_tensors:
+            tensor[dropped] = 0
+            tensor.copy_(tensor[order])
+        return n_moved
+
+    def extra_repr(self):
+        return 'in_features={}, out_features={}, nnz={}, bias={}'.format(self.in_features, self.out_features,
+                                                                          self.values.numel(), self.bias is not None)
+
+
 class ODENet(nn.Module):
     ''' ODE-Net class implementation '''
 
     
-    def __init__(self, device, ndim, explicit_time=False, neurons=100, log_scale = "linear", init_bias_y = 0):
+    def __init__(self, device, ndim, explicit_time=False, neurons=100, log_scale = "linear", init_bias_y = 0, sparse = False):
         ''' Initialize a new ODE-Net '''
         super(ODENet, self).__init__()
 
@@ -97,6 +257,10 @@ class ODENet(nn.Module):
                 #nn.init.orthogonal_(n.weight, gain = calculate_gain("sigmoid"))
                 nn.init.sparse_(n.weight,  sparsity=0.95, std = 0.05)
                 
+        if sparse:
+            # Keep only the support left by sparse_() instead of storing and multiplying the zeros densely
+            for net in (self.net_prods, self.net_sums, self.net_alpha_combine):
+                net.linear_out = SparseLinear.from_linear(net.linear_out)
         
         self.net_prods.to(device)
         self.gene_multipliers.to(device)
@@ -104,18 +268,142 @@ class ODENet(nn.Module):
         self.net_alpha_combine.to(device)
         
         
+    @property
+    def sparse(self):
+        ''' Whether the linear layers are SparseLinear (also true for a sparse model loaded from file) '''
+        return isinstance(self.net_sums.linear_out, SparseLinear)
+
+    def rewire(self, fraction, optimizer = None, generator = None):
+        ''' Re-prune the support of every sparse layer, see SparseLinear.rewire '''
+        return sum(net.linear_out.rewire(fraction, optimizer, generator) for net in (self.net_prods, self.net_sums, self.net_alpha_combine))
+
+    @property
+    def fused_branches(self):
+        ''' Whether net_sums and net_prods are the standard softsign / log-softsign activations into dense linear layers,
+        which _SumsProdsFunction computes in one pass '''
+        return ([type(m) for m in self.net_sums] == [SoftsignMod, nn.Linear] and
+                [type(m) for m in self.net_prods] == [LogShiftedSoftSignMod, nn.Linear])
+
+    def _sums_prods_concat(self, y):
+        ''' cat((net_sums(y), exp(net_prods(y))), dim = -1), fused into one batched GEMM when fused_branches '''
+        if not self.fused_branches:
+            sums = self.net_sums(y)
+            prods = torch.exp(self.net_prods(y))
+            return torch.cat((sums, prods), dim= - 1)
+        lin_sums = self.net_sums.linear_out
+        lin_prods = self.net_prods.linear_out
+        return _SumsProdsFunction.apply(y, lin_sums.weight, lin_sums.bias, lin_prods.weight, lin_prods.bias)
+
     def forward(self, t, y):
-        sums = self.net_sums(y)
-        prods = torch.exp(self.net_prods(y))
-        sums_prods_concat = torch.cat((sums, prods), dim= - 1)
+        sums_prods_concat = self._sums_prods_concat(y)
         joint = self.net_alpha_combine(sums_prods_concat)
         final = torch.relu(self.gene_multipliers)*(joint-y)
         return(final) 
 
-    def prior_only_forward(self, t, y):
-        sums = self.net_sums(y)
-        prods = torch.exp(self.net_prods(y))
+    def diagonal_decay(self):
+        ''' Rates c of the linear decay term -c*y in forward(), used by the exponential integrators '''
+        return torch.relu(self.gene_multipliers)
+
+    def jacobian_structure(self, t, y):
+        ''' Jacobian of forward() with respect to y as diag(d) + U V^T per state vector, used by the stiff solvers.
+        Returns (d, U, V) with d shaped like y and U, V of shape (*y.shape, 2*neurons) '''
+        lin_sums = self.net_sums.linear_out
+        lin_prods = self.net_prods.linear_out
+        lin_alpha = self.net_alpha_combine.linear_out
+        neurons = lin_sums.out_features
+
+        shifted_input = y - 0.5
+        denom = 1 + torch.abs(shifted_input)
+        soft_sign = shifted_input/denom
+        prods = torch.exp(torch.log1p(soft_sign).matmul(lin_prods.weight.t()) + lin_prods.bias)
+        gene_mult = torch.relu(self.gene_multipliers)
+        d_soft_sign = 1/denom**2
+
+        diag = (-gene_mult).expand_as(y)
+        # d joint_i / d y_j = sum_k alpha_sums[i,k] W_sums[k,j] s'_j + alpha_prods[i,k] prods_k W_prods[k,j] l'_j
+        u = gene_mult.unsqueeze(-1)*torch.cat((lin_alpha.weight[:, :neurons].expand(*y.shape, neurons),
+                                                 lin_alpha.weight[:, neurons:]*prods.unsqueeze(-2)), dim = -1)
+        v = torch.cat((lin_sums.weight.t()*d_soft_sign.unsqueeze(-1),
+                       lin_prods.weight.t()*(d_soft_sign/(1 + soft_sign)).unsqueeze(-1)), dim = -1)
+        return diag, u, v
+
+    def mean_jacobian_structure(self, y, chunk_size = 4096):
+        ''' Jacobian of forward() averaged over the states y (..., ndim), as diag(d) + U V^T with d of shape (ndim,)
+        and U, V of shape (ndim, 2*neurons). Only the prods columns of V depend on the states jointly, through the
+        mean outer product of prods and the log-softsign derivative, which is accumulated chunk_size states at a time '''
+        lin_sums = self.net_sums.linear_out
+        lin_prods = self.net_prods.linear_out
+        lin_alpha = self.net_alpha_combine.linear_out
+        neurons = lin_sums.out_features
+
+        y = y.reshape(-1, self.ndim)
+        mean_d_soft_sign = torch.zeros(self.ndim, dtype = y.dtype, device = y.device)
+        mean_prods_d_log = torch.zeros(neurons, self.ndim, dtype = y.dtype, device = y.device)
+        for start in range(0, y.shape[0], chunk_size):
+            shifted_input = y[start:start + chunk_size] - 0.5
+            denom = 1 + torch.abs(shifted_input)
+            soft_sign = shifted_input/denom
+            d_soft_sign = 1/denom**2
+            prods = torch.exp(torch.log1p(soft_sign).matmul(lin_prods.weight.t()) + lin_prods.bias)
+            mean_d_soft_sign += d_soft_sign.sum(0)
+            mean_prods_d_log += prods.t().matmul(d_soft_sign/(1 + soft_sign))
+        mean_d_soft_sign /= y.shape[0]
+        mean_prods_d_log /= y.shape[0]
+
+        gene_mult = torch.relu(self.gene_multipliers).reshape(self.ndim)
+        u = gene_mult.unsqueeze(-1)*lin_alpha.weight
+        v = torch.cat((lin_sums.weight.t()*mean_d_soft_sign.unsqueeze(-1), (lin_prods.weight*mean_prods_d_log).t()), dim = -1)
+        return -gene_mult, u, v
+
+    @property
+    def has_analytic_vjp(self):
+        ''' Whether vjp() is available (not for the explicit-time architecture or sparse weights) '''
+        return not self.explicit_time and not self.sparse
+
+    def vjp(self, t, y, v):
+        ''' Closed-form vector-Jacobian product of forward(), used by the adjoint in place of autograd.
+        Returns (forward(t, y), v^T df/dy, v^T df/dp) with the parameter terms ordered like self.parameters() '''
+        lin_sums = self.net_sums.linear_out
+        lin_prods = self.net_prods.linear_out
+        lin_alpha = self.net_alpha_combine.linear_out
+        neurons = lin_sums.out_features
+
+        # Forward pass, keeping the intermediate terms the derivatives need
+        shifted_input = y - 0.5
+        denom = 1 + torch.abs(shifted_input)
+        soft_sign = shifted_input/denom
+        log_soft_sign = torch.log1p(soft_sign)
+        sums = soft_sign.matmul(lin_sums.weight.t()) + lin_sums.bias
+        prods = torch.exp(log_soft_sign.matmul(lin_prods.weight.t()) + lin_prods.bias)
         sums_prods_concat = torch.cat((sums, prods), dim= - 1)
+        joint = sums_prods_concat.matmul(lin_alpha.weight.t())
+        gene_mult = torch.relu(self.gene_multipliers)
+        joint_minus_y = joint - y
+        final = gene_mult*joint_minus_y
+
+        # Backward pass
+        v_joint = gene_mult*v
+        v_concat = v_joint.matmul(lin_alpha.weight)
+        v_sums = v_concat[..., :neurons]
+        v_prods_pre = v_concat[..., neurons:]*prods
+        d_soft_sign = 1/denom**2
+        v_y = v_sums.matmul(lin_sums.weight)*d_soft_sign + v_prods_pre.matmul(lin_prods.weight)*d_soft_sign/(1 + soft_sign) - v_joint
+
+        def batch_outer(a, b):
+            return a.reshape(-1, a.shape[-1]).t().matmul(b.reshape(-1, b.shape[-1]))
+
+        param_grads = {
+            'gene_multipliers': (v*joint_minus_y).reshape(-1, self.ndim).sum(0, keepdim = True)*(self.gene_multipliers > 0),
+            'net_prods.linear_out.weight': batch_outer(v_prods_pre, log_soft_sign),
+            'net_prods.linear_out.bias': v_prods_pre.reshape(-1, neurons).sum(0),
+            'net_sums.linear_out.weight': batch_outer(v_sums, soft_sign),
+            'net_sums.linear_out.bias': v_sums.reshape(-1, neurons).sum(0),
+            'net_alpha_combine.linear_out.weight': batch_outer(v_joint, sums_prods_concat)
+        }
+        return final, v_y, tuple(param_grads[name] for name, _ in self.named_parameters())
+
+    def prior_only_forward(self, t, y):
+        sums_prods_concat = self._sums_prods_concat(y)
         joint = self.net_alpha_combine(sums_prods_concat)
         return(joint)
 
@@ -144,10 +432,11 @@ class ODENet(nn.Module):
         prod_path =  fp[:idx] + '_prods' + fp[idx:]
         sum_path = fp[:idx] + '_sums' + fp[idx:]
         alpha_comb_path = fp[:idx] + '_alpha_comb' + fp[idx:]
-        self.net_prods = torch.load(prod_path)
-        self.net_sums = torch.load(sum_path)
-        self.gene_multipliers = torch.load(gene_mult_path)
-        self.net_alpha_combine = torch.load(alpha_comb_path)
+        # The files hold whole modules, which torch.load only unpickles with weights_only = False
+        self.net_prods = torch.load(prod_path, weights_only = False)
+        self.net_sums = torch.load(sum_path, weights_only = False)
+        self.gene_multipliers = torch.load(gene_mult_path, weights_only = False)
+        self.net_alpha_combine = torch.load(alpha_comb_path, weights_only = False)
         
         self.net_prods.to('cpu')
         self.net_sums.to('cpu')
@@ -170,4 +459,73 @@ class ODENet(nn.Module):
                 sys.exit(0)
 
     def to(self, device):
-        self.net.to(device)
\ No newline at end of file
+        self.net.to(device)
+
+
+class EnsembleODENet(nn.Module):
+    ''' Independent ODE-Net replicates trained as one model. Each weight carries a leading replicate dimension and
+    forward() evaluates all replicates with batched matmuls. States are shaped (..., n_replicates, ndim): replicate r
+    integrates y[..., r, :], so a (batch, 1, ndim) batch repeated along dim -2 solves every replicate from the same
+    data, row by row as for a single ODENet '''
+
+    def __init__(self, replicates):
+        ''' Stack the weights of a list of (dense, non explicit-time) ODENets '''
+        super(EnsembleODENet, self).__init__()
+        first = replicates[0]
+        self.n_replicates = len(replicates)
+        self.ndim = first.ndim
+        self.neurons = first.net_sums.linear_out.out_features
+        self.log_scale = first.log_scale
+        self.init_bias_y = first.init_bias_y
+
+        def stack(get):
+            return nn.Parameter(torch.stack([get(odenet).detach() for odenet in replicates]).clone())
+        self.sums_weight = stack(lambda odenet: odenet.net_sums.linear_out.weight)
+        self.sums_bias = stack(lambda odenet: odenet.net_sums.linear_out.bias)
+        self.prods_weight = stack(lambda odenet: odenet.net_prods.linear_out.weight)
+        self.prods_bias = stack(lambda odenet: odenet.net_prods.linear_out.bias)
+        self.alpha_weight = stack(lambda odenet: odenet.net_alpha_combine.linear_out.weight)
+        self.gene_multipliers = stack(lambda odenet: odenet.gene_multipliers.reshape(odenet.ndim))
+
+    def expand_states(self, y):
+        ''' Repeat (..., 1, ndim) states for every replicate '''
+        return y.repeat_interleave(self.n_replicates, dim = -2)
+
+    def replicate_mse(self, predictions, target):
+        ''' Mean squared error of every replicate, for predictions (..., n_replicates, ndim) '''
+        errors = ((predictions - target)**2).reshape(-1, self.n_replicates, self.ndim)
+        return errors.mean(dim = (0, 2))
+
+    def prior_only_forward(self, t, y):
+        shape = y.shape
+        by_replicate = y.reshape(-1, self.n_replicates, self.ndim).transpose(0, 1)
+        shifted_input = by_replicate - 0.5
+        soft_sign = shifted_input/(1 + torch.abs(shifted_input))
+        sums = torch.baddbmm(self.sums_bias.unsqueeze(1), soft_sign, self.sums_weight.transpose(1, 2))
+        prods = torch.exp(torch.baddbmm(self.prods_bias.unsqueeze(1), torch.log1p(soft_sign), self.prods_weight.transpose(1, 2)))
+        joint = torch.bmm(torch.cat((sums, prods), dim = -1), self.alpha_weight.transpose(1, 2))
+        return joint.transpose(0, 1).reshape(shape)
+
+    def forward(self, t, y):
+        return torch.relu(self.gene_multipliers)*(self.prior_only_forward(t, y) - y)
+
+    def diagonal_decay(self):
+        ''' Rates c of the linear decay term -c*y in forward(), used by the exponential integrators '''
+        return torch.relu(self.gene_multipliers)
+
+    def replicate(self, index):
+        ''' A standalone ODENet with the current weights of one replicate (e.g. to save or inspect it) '''
+        odenet = ODENet(self.sums_weight.device, self.ndim, neurons = self.neurons, log_scale = self.log_scale,
+                        init_bias_y = self.init_bias_y)
+        with torch.no_grad():
+            odenet.net_sums.linear_out.weight.copy_(self.sums_weight[index])
+            odenet.net_sums.linear_out.bias.copy_(self.sums_bias[index])
+            odenet.net_prods.linear_out.weight.copy_(self.prods_weight[index])
+            odenet.net_prods.linear_out.bias.copy_(self.prods_bias[index])
+            odenet.net_alpha_combine.linear_out.weight.copy_(self.alpha_weight[index])
+            odenet.gene_multipliers.copy_(self.gene_multipliers[index].reshape(1, self.ndim))
+        return odenet
+
+    def save_replicate(self, index, fp):
+        ''' Save one replicate to file, in the format of ODENet.save '''
+        self.replicate(index).save(fp)
@@ -0,0 +1,73 @@
+import torch
+import torch.nn as nn
+
+
+class PairwiseRescaledODE(nn.Module):
+    ''' Wraps an ODE-Net so that every (t_i, t_{i+1}) pair of a batch is integrated over the common interval [0, 1] '''
+
+    def __init__(self, odenet, t_start, dt):
+        super(PairwiseRescaledODE, self).__init__()
+        self.odenet = odenet
+        # One start time and interval length per batch row, broadcastable against the (batch, 1, ndim) state
+        self.t_start = t_start
+        self.dt = dt
+
+    @classmethod
+    def from_pairs(cls, odenet, t_pairs, state_ndim):
+        ''' Create the wrapper from a (batch, 2) tensor of time pairs '''
+        broadcast_shape = (t_pairs.shape[0],) + (1,) * (state_ndim - 1)
+        t_start = t_pairs[:, 0].reshape(broadcast_shape)
+        dt = (t_pairs[:, 1] - t_pairs[:, 0]).reshape(broadcast_shape)
+        return cls(odenet, t_start, dt)
+
+    def select_rows(self, index):
+        ''' Restrict the wrapper to a subset of batch rows (used by the batched adaptive solvers) '''
+        return PairwiseRescaledODE(self.odenet, self.t_start[index], self.dt[index])
+
+    def diagonal_decay(self):
+        return self.dt * self.odenet.diagonal_decay()
+
+    def jacobian_structure(self, s, y):
+        t = self.t_start + s * self.dt
+        diag, u, v = self.odenet.jacobian_structure(t, y)
+        return self.dt * diag, self.dt.unsqueeze(-1) * u, v
+
+    @property
+    def has_analytic_vjp(self):
+        return getattr(self.odenet, 'has_analytic_vjp', False)
+
+    def vjp(self, s, y, v):
+        ''' Closed-form vector-Jacobian product of forward(), see ODENet.vjp '''
+        t = self.t_start + s * self.dt
+        final, v_y, v_params = self.odenet.vjp(t, y, self.dt * v)
+        return self.dt * final, v_y, v_params
+
+    def forward(self, s, y):
+        # dy/ds = dt * f(t_start + s*dt, y), with s running from 0 to 1 for every row
+        t = self.t_start + s * self.dt
+        return self.dt * self.odenet(t, y)
+
+
+def pair_options(options, time):
+    ''' Solver options for solving one pair directly over time[0:2]. A fixed step_size is a fraction of the pair's
+    interval, as it is in the rescaled batched solve, so here it is converted to absolute time '''
+    if not options or options.get('step_size') is None:
+        return options
+    interval = abs(float(time[1] - time[0]))
+    if interval == 0:
+        return options
+    return dict(options, step_size = options['step_size'] * interval)
+
+def solve_pairs(odeint_fn, odenet, y0, t_pairs, method, batched = True, **odeint_kwargs):
+    ''' Solve y0[i] from t_pairs[i, 0] to t_pairs[i, 1] for every row i and return the end states '''
+    if not batched:
+        predictions = torch.zeros(y0.shape, dtype = y0.dtype, device = y0.device)
+        options = odeint_kwargs.pop('options', None)
+        for index, (time, batch_point) in enumerate(zip(t_pairs, y0)):
+            predictions[index] = odeint_fn(odenet, batch_point, time, method = method, options = pair_options(options, time), **odeint_kwargs)[1]
+        return predictions
+
+    #only the first two time points of each row are used, exactly like the [1] index of the per-sample loop
+    rescaled_odenet = PairwiseRescaledODE.from_pairs(odenet, t_pairs[:, 0:2], y0.dim())
+    unit_interval = torch.tensor([0.0, 1.0], dtype = t_pairs.dtype, device = y0.device)
+    return odeint_fn(rescaled_odenet, y0, unit_interval, method = method, **odeint_kwargs)[1]
@@ -0,0 +1,105 @@
+import os
+from math import ceil
+import numpy as np
+import torch
+from csvreader import _parse_csv_values
+
+
+def _parse_dense_prior(fp):
+    ''' (rows, cols, values, shape) of the nonzeros of a dense CSV matrix. Empty fields are kept as NaN entries, as
+    np.genfromtxt reads them '''
+    values, row_offsets = _parse_csv_values(fp)
+    row_lengths = np.diff(row_offsets)
+    rows = np.repeat(np.arange(len(row_lengths), dtype = np.int64), row_lengths)
+    cols = np.arange(len(values), dtype = np.int64) - row_offsets[rows]
+    nonzero = np.flatnonzero(values)
+    shape = (len(row_lengths), int(row_lengths.max()) if len(row_lengths) else 0)
+    return rows[nonzero], cols[nonzero], values[nonzero], shape
+
+def _parse_edge_list_prior(fp):
+    ''' (rows, cols, values) of a 1-based (row, col, value) edge list CSV '''
+    mat = np.loadtxt(fp, delimiter = ',', ndmin = 2)
+    return mat[:, 0].astype(np.int64) - 1, mat[:, 1].astype(np.int64) - 1, mat[:, 2]
+
+def _load_prior_entries(fp, sparse, use_cache = True):
+    ''' Parsed (rows, cols, values, shape) of a prior matrix file, read from its binary sidecar cache while the file is
+    unchanged. shape is None for edge lists, whose size is set by the number of genes '''
+    source = os.stat(fp)
+    cache_fp = fp + '.cache.npz'
+    if use_cache and os.path.exists(cache_fp):
+        with np.load(cache_fp) as cache:
+            if (cache['source_size'] == source.st_size and cache['source_mtime_ns'] == source.st_mtime_ns
+                    and bool(cache['sparse']) == sparse):
+                print("Loading prior matrix from cache {}".format(cache_fp))
+                shape = None if sparse else tuple(cache['shape'])
+                return cache['rows'], cache['cols'], cache['values'], shape
+
+    if sparse:
+        rows, cols, values = _parse_edge_list_prior(fp)
+        shape = None
+    else:
+        rows, cols, values, shape = _parse_dense_prior(fp)
+    if use_cache:
+        tmp_fp = cache_fp + '.tmp'
+        try:
+            with open(tmp_fp, 'wb') as f:
+                np.savez(f, rows = rows, cols = cols, values = values, sparse = sparse,
+                         shape = np.array(shape if shape is not None else (-1, -1), dtype = np.int64),
+                         source_size = source.st_size, source_mtime_ns = source.st_mtime_ns)
+            os.replace(tmp_fp, cache_fp)
+        except OSError as e:
+            print("Could not write cache {}: {}".format(cache_fp, e))
+    return rows, cols, values, shape
+
+def read_prior_matrix(prior_mat_file_loc, sparse = False, num_genes = 11165, use_cache = True):
+    ''' Prior matrix as a coalesced sparse COO float tensor, from a dense CSV or (sparse = True) a 1-based
+    (row, col, value) edge list of a num_genes x num_genes matrix. Only the nonzeros are ever held in memory '''
+    rows, cols, values, shape = _load_prior_entries(prior_mat_file_loc, sparse, use_cache)
+    if shape is None:
+        shape = (num_genes, num_genes)
+    indices = torch.from_numpy(np.stack([rows, cols]))
+    return torch.sparse_coo_tensor(indices, torch.from_numpy(values), shape).coalesce().float()
+
+def flip_prior_signs(prior_mat):
+    ''' prior_mat with the sign of every stored entry flipped at random, keeping it sparse '''
+    prior_mat = prior_mat.coalesce()
+    signs = 2*torch.randint(low = 0, high = 2, size = prior_mat.values().shape, dtype = prior_mat.dtype) - 1
+    return torch.sparse_coo_tensor(prior_mat.indices(), prior_mat.values()*signs, prior_mat.shape).coalesce()
+
+
+class PriorSampler:
+    ''' Random states and the derivatives the prior matrix implies for them (states @ prior_mat), for the prior loss.
+
+    Instead of keeping all K states and their targets resident, the K states are split into chunks of batch_size
+    rows. Every chunk is regenerated on demand from its own seed, so a training step only ever holds one sub-batch and
+    its target, which is computed on the fly through a sparse copy of prior_mat. With batch_size = None (or >= K)
+    every step uses all K states, like the original resident prior batch '''
+
+    def __init__(self, prior_mat, K = 10000, batch_size = None, scale = 2, device = 'cpu', seed = None):
+        ''' prior_mat is a dense or sparse (ndim, ndim) matrix; states are uniform on [-scale/2, scale/2] '''
+        if batch_size is None or batch_size > K:
+            batch_size = K
+        self.ndim = prior_mat.shape[0]
+        self.K = K
+        self.batch_size = batch_size
+        self.n_chunks = ceil(K / batch_size)
+        self.scale = scale
+        self.device = device
+        self.seed = int(torch.randint(2**62, (1,))) if seed is None else seed
+        # states @ prior_mat = (prior_mat^T @ states^T)^T, with prior_mat^T stored as CSR
+        prior_mat_t = prior_mat.t().coalesce() if prior_mat.is_sparse else prior_mat.t()
+        self.prior_mat_t = prior_mat_t.float().to_sparse_csr().to(device)
+
+    def target(self, states):
+        ''' states @ prior_mat for states of shape (..., ndim) '''
+        flat_states = states.reshape(-1, self.ndim)
+        return torch.mm(self.prior_mat_t, flat_states.t()).t().reshape(states.shape)
+
+    def sample(self, chunk = None):
+        ''' (batch_for_prior, prior_grad) for one random chunk (or the given one), shaped (rows, 1, ndim) '''
+        if chunk is None:
+            chunk = int(torch.randint(self.n_chunks, (1,)))
+        rows = min(self.batch_size, self.K - chunk*self.batch_size)
+        generator = torch.Generator(device = self.device).manual_seed(self.seed + chunk)
+        batch_for_prior = (torch.rand(rows, 1, self.ndim, generator = generator, device = self.device) - 0.5)*self.scale
+        return batch_for_prior, self.target(batch_for_prior)
@@ -2,12 +2,15 @@
 import configparser
 
 
-def read_arguments_from_file(fp):
-    """Reads run arguments from file"""
+def read_arguments_from_file(fp, overrides = None):
+    """Reads run arguments from file, with the raw values of overrides (a dict of setting: value) replacing those of
+    the file before conversion"""
     config = configparser.ConfigParser()
     config.read(fp)
 
     settings = config['settings']
+    for key, value in (overrides or {}).items():
+        settings[key] = str(value)
 
     return _convert_arguments(settings)
 
@@ -17,7 +20,18 @@ def _convert_arguments(settings):
     converted_settings['viz_every_iteration'] = False
     converted_settings['verbose'] = True
     converted_settings['method'] = settings['method']
+    converted_settings['batched_solve'] = settings.getboolean('batched_solve', fallback = False)
+    converted_settings['adjoint_mode'] = settings.get('adjoint_mode', fallback = 'continuous')
+    converted_settings['checkpoint_budget'] = settings.getint('checkpoint_budget', fallback = None)
+    converted_settings['step_cache'] = settings.getboolean('step_cache', fallback = False)
+    converted_settings['step_size'] = settings.getfloat('step_size', fallback = None)
+    if converted_settings['step_size'] is not None and not 0 < converted_settings['step_size'] <= 1:
+        raise ValueError('step_size is a fraction of each time pair\'s interval and must be in (0, 1], got {}'.format(converted_settings['step_size']))
+    converted_settings['solver_timing'] = settings.getboolean('solver_timing', fallback = False)
     converted_settings['neurons_per_layer'] = settings.getint('neurons_per_layer')
+    converted_settings['sparse_weights'] = settings.getboolean('sparse_weights', fallback = False)
+    converted_settings['sparse_rewire_every'] = settings.getint('sparse_rewire_every', fallback = 0)
+    converted_settings['sparse_rewire_fraction'] = settings.getfloat('sparse_rewire_fraction', fallback = 0.1)
     converted_settings['optimizer'] = settings['optimizer']
 
     converted_settings['batch_type'] = settings['batch_type']
@@ -41,6 +55,14 @@ def _convert_arguments(settings):
     converted_settings['debug'] = False  
     converted_settings['output_dir'] = "output"
     converted_settings['normalize_data'] = settings.getboolean('normalize_data')  
+    converted_settings['memmap_data'] = settings.getboolean('memmap_data', fallback = False)
+    converted_settings['prefetch_batches'] = settings.getint('prefetch_batches', fallback = 0)
+    converted_settings['num_threads'] = settings.getint('num_threads', fallback = 0)
+    converted_settings['ensemble_replicates'] = settings.getint('ensemble_replicates', fallback = 4)
+    converted_settings['checkpoint_every'] = settings.getint('checkpoint_every', fallback = 0)
+    converted_settings['prior_K'] = settings.getint('prior_K', fallback = 10000)
+    converted_settings['prior_batch_size'] = settings.getint('prior_batch_size', fallback = None)
+    converted_settings['prior_scale'] = settings.getfloat('prior_scale', fallback = None)
     converted_settings['explicit_time'] = False
     converted_settings['relative_error'] = False
 
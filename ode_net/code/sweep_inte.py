@@ -0,0 +1,305 @@
+# Imports
+import os
+import csv
+import json
+import shutil
+import argparse
+import itertools
+import tempfile
+import traceback
+from datetime import datetime
+from math import ceil
+from time import perf_counter
+import numpy as np
+
+import torch
+import torch.multiprocessing as mp
+import torch.optim as optim
+
+try:
+    from torchdiffeq.__init__ import StepSizeCache, supports_checkpoint_adjoint
+except ImportError:
+    from torchdiffeq import StepSizeCache, supports_checkpoint_adjoint
+
+from csvreader import readcsv_store
+from datahandler import DataHandler
+from odenet import ODENet
+from prior_loss import PriorSampler, read_prior_matrix
+from read_config import read_arguments_from_file
+from trajectory_store import TrajectoryStore
+from train_inte import training_step, validation, get_true_val_set_r2
+
+# Settings that change what is read from file (the prior matrix is picked by the noise level); every distinct
+# combination of them in a sweep is loaded once and shared by all trials using it
+DATASET_SETTINGS = ('noise', 'scale_expression', 'log_scale')
+# Sweepable values that are not cfg settings, with their train_inte.py defaults
+SWEEP_ONLY_SETTINGS = {'loss_lambda': 1}
+epochs_to_fail_to_terminate = 40
+
+
+def expand_search(spec, rng):
+    ''' One dict of setting overrides per trial. spec is {"search": "grid" or "random", "params": {...}, "n_trials": N}:
+    a grid takes every combination of the listed values, a random search draws n_trials settings, each from a list of
+    values or from {"uniform": [low, high]}, {"loguniform": [low, high]} or {"randint": [low, high]} '''
+    params = spec['params']
+    search = spec.get('search', 'grid')
+    if search == 'grid':
+        for name, values in params.items():
+            if not isinstance(values, list):
+                raise ValueError("Grid search needs a list of values for '{}'".format(name))
+        return [dict(zip(params.keys(), values)) for values in itertools.product(*params.values())]
+    elif search == 'random':
+        return [{name: _sample(values, rng) for name, values in params.items()} for _ in range(spec['n_trials'])]
+    raise ValueError("Unknown search '{}', use 'grid' or 'random'".format(search))
+
+def _sample(values, rng):
+    if isinstance(values, list):
+        return values[rng.integers(len(values))]
+    (kind, (low, high)), = values.items()
+    if kind == 'uniform':
+        return float(rng.uniform(low, high))
+    elif kind == 'loguniform':
+        return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+    elif kind == 'randint':
+        return int(rng.integers(low, high + 1))
+    raise ValueError("Unknown distribution '{}'".format(kind))
+
+def trial_settings(settings_fp, overrides):
+    ''' Converted settings of one trial, with the sweep-only values added '''
+    cfg_overrides = {name: value for name, value in overrides.items() if name not in SWEEP_ONLY_SETTINGS}
+    settings = read_arguments_from_file(settings_fp, cfg_overrides)
+    for name in cfg_overrides:
+        if name not in settings:
+            raise ValueError("Unknown setting '{}'".format(name))
+    for name, default in SWEEP_ONLY_SETTINGS.items():
+        settings[name] = overrides.get(name, default)
+    return settings
+
+def dataset_key(settings):
+    return tuple(settings[name] for name in DATASET_SETTINGS)
+
+def load_shared_datasets(all_settings, data_fp, test_fp, prior_fp_template, shared_dir):
+    ''' Read every distinct dataset of the sweep once, as stores memory-mapped from shared_dir (which the trials map
+    again instead of re-reading the CSVs), plus its prior matrix, whose nonzeros are written next to the store for the
+    trials to map the same way. Returns {dataset_key: (store_dir, test_store_dir, prior_dir)} '''
+    datasets = {}
+    for settings in all_settings:
+        key = dataset_key(settings)
+        if key in datasets:
+            continue
+        store_dir = os.path.join(shared_dir, 'dataset_{}'.format(len(datasets)))
+        store = readcsv_store(data_fp, settings['noise'], settings['scale_expression'], settings['log_scale'], store_dir = store_dir)
+        test_store_dir = None
+        if test_fp is not None:
+            test_store_dir = os.path.join(store_dir, 'test')
+            readcsv_store(test_fp, 0, settings['scale_expression'], settings['log_scale'], store_dir = test_store_dir)
+        prior_dir = os.path.join(store_dir, 'prior')
+        save_shared_prior(read_prior_matrix(prior_fp_template.format(settings['noise']), sparse = False, num_genes = store.dim), prior_dir)
+        datasets[key] = (store_dir, test_store_dir, prior_dir)
+    return datasets
+
+def save_shared_prior(prior_mat, prior_dir):
+    ''' Write the indices, values and shape of a sparse prior matrix to prior_dir, for load_shared_prior '''
+    os.makedirs(prior_dir, exist_ok = True)
+    prior_mat = prior_mat.coalesce()
+    np.save(os.path.join(prior_dir, 'indices.npy'), prior_mat.indices().numpy())
+    np.save(os.path.join(prior_dir, 'values.npy'), prior_mat.values().numpy())
+    np.save(os.path.join(prior_dir, 'shape.npy'), np.array(prior_mat.shape, dtype = np.int64))
+
+def load_shared_prior(prior_dir):
+    ''' The sparse prior matrix of save_shared_prior, backed by memory maps of its files, so that the workers share
+    its pages. The maps are copy-on-write, as torch tensors need writable arrays '''
+    indices = np.load(os.path.join(prior_dir, 'indices.npy'), mmap_mode = 'c')
+    values = np.load(os.path.join(prior_dir, 'values.npy'), mmap_mode = 'c')
+    shape = tuple(int(size) for size in np.load(os.path.join(prior_dir, 'shape.npy')))
+    return torch.sparse_coo_tensor(torch.from_numpy(indices), torch.from_numpy(values), shape, is_coalesced = True)
+
+
+# State of a pool worker, set once by _init_worker
+_worker = {}
+
+def _init_worker(num_threads, datasets, history):
+    torch.set_num_threads(num_threads)
+    _worker['datasets'] = datasets
+    _worker['history'] = history
+
+def _poor_trial(history, trial_id, epoch, best_val_loss, min_trials):
+    ''' Median stopping rule: the trial's best validation loss so far is worse than the median of the best losses of
+    at least min_trials other trials after the same number of epochs '''
+    others = [curve[epoch - 1] for other_id, curve in history.items() if other_id != trial_id and len(curve) >= epoch]
+    return len(others) >= min_trials and best_val_loss > np.median(others)
+
+def run_trial(trial):
+    ''' Train one model (as train_inte.py does) on its shared dataset and return its row of the results table '''
+    trial_id, overrides, settings, seed, early_stop_after, early_stop_min_trials, trial_dir = trial
+    history = _worker['history']
+    result = {'trial': trial_id, 'status': 'completed', 'epochs': 0, 'best_val_loss': np.nan, 'best_epoch': 0,
+              'test_mse_at_best': np.nan, 'min_train_loss': np.nan, 'seconds': 0, 'error': ''}
+    result.update(overrides)
+    start_time = perf_counter()
+    try:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        store_dir, test_store_dir, prior_dir = _worker['datasets'][dataset_key(settings)]
+        test_store = None if test_store_dir is None else TrajectoryStore.load(test_store_dir)
+        data_handler = DataHandler.fromstore(TrajectoryStore.load(store_dir), 'cpu', settings['val_split'], normalize=settings['normalize_data'],
+                                             batch_type=settings['batch_type'], batch_time=settings['batch_time'],
+                                             batch_time_frac=settings['batch_time_frac'], img_save_dir = trial_dir,
+                                             init_bias_y = settings['init_bias_y'], fp_test = test_store_dir, test_store = test_store)
+        if data_handler.n_val == 0:
+            raise ValueError('val_split leaves no validation data to compare trials on')
+        prior_sampler = PriorSampler(load_shared_prior(prior_dir), K = settings['prior_K'], batch_size = settings['prior_batch_size'],
+                                     scale = 2 if settings['prior_scale'] is None else settings['prior_scale'])
+
+        odenet = ODENet('cpu', data_handler.dim, explicit_time=settings['explicit_time'], neurons = settings['neurons_per_layer'],
+                        log_scale = settings['log_scale'], init_bias_y = settings['init_bias_y'], sparse = settings['sparse_weights'])
+        odenet.float()
+        if settings['optimizer'] == 'rmsprop':
+            opt = optim.RMSprop(odenet.parameters(), lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+        elif settings['optimizer'] == 'sgd':
+            opt = optim.SGD(odenet.parameters(), lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+        elif settings['optimizer'] == 'adagrad':
+            opt = optim.Adagrad(odenet.parameters(), lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+        else:
+            opt = optim.Adam([
+                    {'params': odenet.net_sums.parameters()},
+                    {'params': odenet.net_prods.parameters()},
+                    {'params': odenet.net_alpha_combine.parameters()},
+                    {'params': odenet.gene_multipliers,'lr': 5*settings['init_lr']}
+                ],  lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+        scheduler = optim.lr_scheduler.ReduceLROnPlateau(opt, mode='min', factor=0.9, patience=3, threshold=1e-09,
+                                                         threshold_mode='abs', cooldown=0, min_lr=0, eps=1e-09)
+        # The checkpoint adjoint replays adaptive Runge-Kutta steps only; other methods fall back to the continuous adjoint
+        if settings['adjoint_mode'] == 'checkpoint' and not supports_checkpoint_adjoint(settings['method']):
+            print("adjoint_mode = checkpoint does not support method {}, using the continuous adjoint".format(settings['method']))
+            settings['adjoint_mode'] = 'continuous'
+        solver_options = {}
+        if settings['step_cache']:
+            solver_options['step_cache'] = StepSizeCache()
+        if settings['step_size'] is not None:
+            solver_options['step_size'] = settings['step_size']
+
+        if settings['batch_type'] == 'trajectory':
+            iterations_in_epoch = data_handler.train_data_length
+        else:
+            iterations_in_epoch = ceil(data_handler.train_data_length / settings['batch_size'])
+
+        losses = []
+        min_val_loss = np.inf
+        min_train_loss = np.inf
+        best_val_curve = []
+        consec_epochs_failed = 0
+        for epoch in range(1, settings['epochs'] + 1):
+            data_handler.reset_epoch()
+            total_train_loss = 0
+            while not data_handler.epoch_done:
+                loss, _ = training_step(odenet, data_handler, opt, settings['method'], settings['batch_size'], settings['explicit_time'], settings['relative_error'], prior_sampler, settings['loss_lambda'], settings['batched_solve'], None, settings['adjoint_mode'], settings['checkpoint_budget'], solver_options)
+                total_train_loss += loss.item()
+            if settings['sparse_weights'] and settings['sparse_rewire_every'] > 0 and epoch % settings['sparse_rewire_every'] == 0:
+                odenet.rewire(settings['sparse_rewire_fraction'], opt)
+            if settings['dec_lr']:
+                for param_group in opt.param_groups:
+                    param_group['lr'] = param_group['lr'] * settings['dec_lr_factor']
+
+            train_loss = total_train_loss/iterations_in_epoch
+            val_loss = validation(odenet, data_handler, settings['method'], settings['explicit_time'], settings['batched_solve'], solver_options)[0].item()
+            test_mse = get_true_val_set_r2(odenet, data_handler, settings['method'], settings['batch_type'], settings['batched_solve'], solver_options)[1].item()
+            scheduler.step(val_loss)
+            losses.append((train_loss, val_loss, test_mse))
+            result['epochs'] = epoch
+            min_train_loss = min(min_train_loss, train_loss)
+            result['min_train_loss'] = min_train_loss
+            if val_loss < min_val_loss:
+                min_val_loss = val_loss
+                result['best_val_loss'] = val_loss
+                result['best_epoch'] = epoch
+                result['test_mse_at_best'] = test_mse
+                consec_epochs_failed = 0
+            else:
+                consec_epochs_failed += 1
+            best_val_curve.append(min_val_loss)
+            history[trial_id] = best_val_curve
+
+            if consec_epochs_failed == epochs_to_fail_to_terminate:
+                break
+            if early_stop_after > 0 and epoch >= early_stop_after and _poor_trial(history, trial_id, epoch, min_val_loss, early_stop_min_trials):
+                result['status'] = 'stopped'
+                break
+        np.savetxt(os.path.join(trial_dir, 'losses.csv'), np.array(losses), delimiter=',', header='train,val,test', comments='')
+    except Exception as e:
+        traceback.print_exc()
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = round(perf_counter() - start_time, 2)
+    return result
+
+
+parser = argparse.ArgumentParser('Hyperparameter sweep')
+parser.add_argument('--spec', type=str, required=True, help='JSON search spec, see expand_search')
+parser.add_argument('--settings', type=str, default='config_inte.cfg')
+clean_name =  "chalmers_690genes_150samples_earlyT_0bimod_1initvar"
+parser.add_argument('--data', type=str, default='../../ground_truth_simulator/clean_data/{}.csv'.format(clean_name))
+test_data_name = "chalmers_690genes_10samples_for_testing"
+parser.add_argument('--test_data', type=str, default='../../ground_truth_simulator/clean_data/{}.csv'.format(test_data_name))
+parser.add_argument('--prior', type=str, default='../../ground_truth_simulator/clean_data/edge_prior_matrix_chalmers_690_noise_{}.csv',
+                    help='prior matrix file, with {} standing for the noise level')
+parser.add_argument('--workers', type=int, default=os.cpu_count())
+parser.add_argument('--threads_per_trial', type=int, default=None, help='torch threads per trial, default: the cores split between the workers')
+parser.add_argument('--early_stop_after', type=int, default=0, help='from this epoch on, stop trials whose best validation loss is worse than the median of the other trials (0 = off)')
+parser.add_argument('--early_stop_min_trials', type=int, default=3)
+parser.add_argument('--seed', type=int, default=0)
+
+# Main function
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.spec) as f:
+        spec = json.load(f)
+    rng = np.random.default_rng(args.seed)
+    all_overrides = expand_search(spec, rng)
+    all_settings = [trial_settings(args.settings, overrides) for overrides in all_overrides]
+    threads_per_trial = args.threads_per_trial or max(1, (os.cpu_count() or 1) // args.workers)
+    print("Running {} trials on {} workers with {} threads each".format(len(all_overrides), args.workers, threads_per_trial))
+
+    sweep_name = '{}-{}-{}({};{})_sweep_{}'.format(str(datetime.now().year), str(datetime.now().month), str(datetime.now().day),
+        str(datetime.now().hour), str(datetime.now().minute), os.path.splitext(os.path.basename(args.spec))[0])
+    output_root_dir = '{}/{}/'.format(all_settings[0]['output_dir'], sweep_name)
+    os.makedirs(output_root_dir, exist_ok=True)
+    shutil.copy(args.spec, output_root_dir)
+    shutil.copy(args.settings, output_root_dir)
+
+    # The datasets live in RAM-backed files where available, so the trials share their pages
+    shared_dir = tempfile.mkdtemp(prefix = 'sweep_', dir = '/dev/shm' if os.path.isdir('/dev/shm') else None)
+    try:
+        np.random.seed(args.seed)
+        datasets = load_shared_datasets(all_settings, args.data, args.test_data, args.prior, shared_dir)
+        print("Loaded {} distinct dataset(s)".format(len(datasets)))
+
+        trials = []
+        for trial_id, (overrides, settings) in enumerate(zip(all_overrides, all_settings)):
+            trial_dir = '{}trial_{}/'.format(output_root_dir, trial_id)
+            os.makedirs(trial_dir, exist_ok=True)
+            trials.append((trial_id, overrides, settings, args.seed + 1 + trial_id, args.early_stop_after, args.early_stop_min_trials, trial_dir))
+
+        columns = ['trial'] + list(spec['params'].keys()) + ['status', 'epochs', 'best_val_loss', 'best_epoch',
+                                                              'test_mse_at_best', 'min_train_loss', 'seconds', 'error']
+        results = []
+        context = mp.get_context('spawn')
+        with context.Manager() as manager, open('{}sweep_results.csv'.format(output_root_dir), 'w', newline='') as results_file:
+            writer = csv.DictWriter(results_file, fieldnames = columns)
+            writer.writeheader()
+            history = manager.dict()
+            with context.Pool(args.workers, initializer = _init_worker, initargs = (threads_per_trial, datasets, history)) as pool:
+                for result in pool.imap_unordered(run_trial, trials):
+                    results.append(result)
+                    writer.writerow(result)
+                    results_file.flush()
+                    print("Trial {} {} after {} epochs: best validation loss {:.5E} ({}/{} done)".format(
+                        result['trial'], result['status'], result['epochs'], result['best_val_loss'], len(results), len(trials)))
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors = True)
+
+    ranked = sorted((result for result in results if result['status'] != 'failed'), key = lambda result: result['best_val_loss'])
+    if ranked:
+        print("Best trial: {}".format({name: ranked[0][name] for name in columns if name != 'error'}))
+    print("Results written to {}sweep_results.csv".format(output_root_dir))
+    print("DONE!")
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import torch
+
+from odenet import ODENet
+
+
+@pytest.fixture(autouse = True)
+def seed():
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+
+@pytest.fixture
+def odenet():
+    ''' A small double-precision ODENet with dense random weights, so that every parameter affects the output '''
+    odenet = ODENet('cpu', 6, neurons = 8).double()
+    with torch.no_grad():
+        for param in odenet.parameters():
+            param.normal_(0, 0.3)
+        odenet.gene_multipliers.uniform_(0.2, 1)
+    return odenet
+
+
+@pytest.fixture
+def pairs():
+    ''' (y0, t_pairs) of 5 pairs with different start times and interval lengths, as DataHandler batches are shaped '''
+    y0 = torch.rand(5, 1, 6, dtype = torch.float64)
+    t_start = torch.tensor([0., 0.5, 1., 2., 3.5], dtype = torch.float64)
+    t_pairs = torch.stack((t_start, t_start + torch.tensor([0.5, 1., 0.25, 2., 1.], dtype = torch.float64)), dim = 1)
+    return y0, t_pairs
+
+
+@pytest.fixture
+def data_csv(tmp_path):
+    ''' A data CSV of 4 trajectories of 8 time points of 3 genes. Every time point is distinct (trajectory i runs over
+    100*i + 0..7), so a time identifies the row it came from '''
+    from csvreader import writecsv
+    fp = str(tmp_path/'data.csv')
+    data_np = [np.random.rand(8, 1, 3) for _ in range(4)]
+    t_np = [100.*i + np.arange(8) for i in range(4)]
+    writecsv(fp, 3, 4, data_np, t_np)
+    return fp
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+import torch
+
+from artifact_writer import ArtifactWriter, snapshot
+from odenet import ODENet
+
+
+def test_jobs_run_in_order_off_the_calling_thread():
+    writer = ArtifactWriter(max_pending = 2)
+    done = []
+    for i in range(20):
+        writer.submit(lambda i: done.append((i, threading.current_thread())), i)
+    writer.flush()
+    assert [i for i, _ in done] == list(range(20))
+    assert all(thread is not threading.current_thread() for _, thread in done)
+    writer.close()
+
+
+def test_submit_blocks_when_the_queue_is_full():
+    writer = ArtifactWriter(max_pending = 1)
+    release = threading.Event()
+    writer.submit(release.wait)
+    writer.submit(lambda: None)
+    blocked = threading.Thread(target = writer.submit, args = (lambda: None,))
+    blocked.start()
+    blocked.join(timeout = 0.2)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join()
+    writer.close()
+
+
+def fail(message):
+    raise OSError(message)
+
+
+def test_errors_surface_on_the_training_thread():
+    writer = ArtifactWriter()
+    done = []
+    writer.submit(fail, 'first')
+    writer.submit(fail, 'second')
+    writer.submit(done.append, 'after')
+    # Later jobs still run, and only the first error is raised, once
+    with pytest.raises(OSError, match = 'first'):
+        writer.flush()
+    assert done == ['after']
+    writer.flush()
+
+    writer.submit(fail, 'on submit')
+    writer._queue.join()
+    with pytest.raises(OSError, match = 'on submit'):
+        writer.submit(done.append, 'dropped')
+    writer.flush()
+    assert done == ['after']
+
+    writer.submit(fail, 'on close')
+    with pytest.raises(OSError, match = 'on close'):
+        writer.close()
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(done.append, 'closed')
+
+
+def test_saved_model_is_a_snapshot(tmp_path):
+    odenet = ODENet('cpu', 4, neurons = 3)
+    odenet(0, torch.rand(2, 1, 4)).sum().backward()
+    copy = snapshot(odenet)
+    assert all(param.grad is None for param in copy.parameters())
+    assert all(param.grad is not None for param in odenet.parameters())
+
+    writer = ArtifactWriter()
+    release = threading.Event()
+    writer.submit(release.wait)
+    fp = str(tmp_path/'model.pt')
+    writer.save_model(odenet, fp)
+    expected = [param.detach().clone() for param in odenet.parameters()]
+    # Training carries on before the worker gets to the save
+    with torch.no_grad():
+        for param in odenet.parameters():
+            param.add_(1)
+    release.set()
+    writer.close()
+
+    loaded = ODENet('cpu', 4, neurons = 3)
+    loaded.load(fp)
+    for param, saved in zip(expected, loaded.parameters()):
+        assert torch.equal(param, saved)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import torch
+
+from batch_prefetcher import BatchPrefetcher
+from datahandler import DataHandler
+
+
+def make_data_handler(data_csv):
+    ''' The same data handler every time, up to the shuffle of its first epoch '''
+    np.random.seed(0)
+    torch.manual_seed(0)
+    return DataHandler.fromcsv(data_csv, 'cpu', 0, batch_type = 'batch_time', batch_time = 4, batch_time_frac = 0.5)
+
+
+def epoch_times(source, batch_size = 3):
+    source.reset_epoch()
+    times = []
+    while not source.epoch_done:
+        times.append(source.get_batch(batch_size)[1])
+    return torch.cat(times)
+
+
+def test_prefetched_batches_match_direct_ones(data_csv):
+    direct = epoch_times(make_data_handler(data_csv))
+    prefetcher = BatchPrefetcher(make_data_handler(data_csv), 3)
+    torch.manual_seed(123)
+    global_state = torch.get_rng_state()
+    prefetched = epoch_times(prefetcher)
+    # The worker draws from the data handler's own generator, never from the training thread's
+    assert torch.equal(torch.get_rng_state(), global_state)
+    assert torch.equal(prefetched, direct)
+    assert prefetcher.train_data_length == 4*3
+    with pytest.raises(RuntimeError):
+        prefetcher.get_batch()
+
+
+def test_state_dict_restores_the_batch_generator(data_csv):
+    data_handler = make_data_handler(data_csv)
+    epoch_times(data_handler)
+    state = data_handler.state_dict()
+    np.random.seed(5)
+    expected = epoch_times(data_handler)
+    restored = make_data_handler(data_csv)
+    restored.load_state_dict(state)
+    np.random.seed(5)
+    assert torch.equal(epoch_times(restored), expected)
+
+
+def test_worker_errors_reach_the_training_thread(data_csv):
+    data_handler = make_data_handler(data_csv)
+    def failing_get_batch(batch_size):
+        raise ValueError('bad batch')
+    data_handler.get_batch = failing_get_batch
+    prefetcher = BatchPrefetcher(data_handler, 3)
+    prefetcher.reset_epoch()
+    with pytest.raises(ValueError, match = 'bad batch'):
+        prefetcher.get_batch()
+    assert prefetcher._worker is None
+
+
+def test_reset_mid_epoch_restarts_cleanly(data_csv):
+    prefetcher = BatchPrefetcher(make_data_handler(data_csv), 1, n_batches = 1)
+    prefetcher.reset_epoch()
+    prefetcher.get_batch()
+    assert len(epoch_times(prefetcher, 1)) == 4*3
+    prefetcher.close()
+    assert prefetcher._worker is None
@@ -0,0 +1,56 @@
+import torch
+
+from datahandler import DataHandler
+
+
+def epoch_batches(data_handler, batch_size):
+    data_handler.reset_epoch()
+    batches = []
+    while not data_handler.epoch_done:
+        batches.append(data_handler.get_batch(batch_size))
+    return batches
+
+
+def row_of_time(data_handler):
+    _, _, times_pt = data_handler.store.tensors('cpu')
+    return {time: row for row, time in enumerate(times_pt.tolist())}
+
+
+def test_single_batches_cover_the_training_pairs_once(data_csv):
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0.25, batch_type = 'single')
+    values_pt, _, _ = data_handler.store.tensors('cpu')
+    rows = row_of_time(data_handler)
+    visited = []
+    for data, t, target in epoch_batches(data_handler, 4):
+        assert data.shape[1:] == (1, 3) and t.shape[1:] == (2,)
+        for data_row, t_row, target_row in zip(data, t, target):
+            row = rows[t_row[0].item()]
+            assert rows[t_row[1].item()] == row + 1
+            assert torch.equal(data_row[0], values_pt[row]) and torch.equal(target_row[0], values_pt[row + 1])
+            visited.append(row)
+    expected = data_handler.store.flat_rows(data_handler.train_set_original)
+    assert sorted(visited) == sorted(expected.tolist())
+
+
+def test_trajectory_batches_hold_every_pair_of_one_trajectory(data_csv):
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0.25, batch_type = 'trajectory')
+    trajectories = []
+    for data, t, target in epoch_batches(data_handler, 1):
+        assert data.shape == (7, 1, 3)
+        assert torch.equal(t[:, 1] - t[:, 0], torch.ones(7)) and torch.equal(data[1:], target[:-1])
+        trajectories.append(int(t[0, 0].item()) // 100)
+    assert sorted(trajectories) == sorted(data_handler.train_set_original.tolist())
+
+
+def test_batch_time_windows(data_csv):
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0, batch_type = 'batch_time', batch_time = 4, batch_time_frac = 0.5)
+    values_pt, _, _ = data_handler.store.tensors('cpu')
+    rows = row_of_time(data_handler)
+    for batch, t, target in epoch_batches(data_handler, 3):
+        assert t.shape[1] == data_handler.batch_npoints + 1
+        for batch_row, t_row in zip(batch, t):
+            window = [rows[time] for time in t_row.tolist()]
+            # Sorted distinct points from one window of batch_time points, and the point after the last of them
+            assert window == sorted(set(window)) and window[-1] == window[-2] + 1
+            assert window[-2] - window[0] < data_handler.batch_time
+            assert torch.equal(batch_row, values_pt[window[:-1]])
@@ -0,0 +1,50 @@
+import torch
+import torch.nn as nn
+
+from torchdiffeq import odeint, SolverStats
+
+
+class LinearDecay(nn.Module):
+    ''' dy/dt = -rate*y with one rate per batch row '''
+
+    def __init__(self, rates):
+        super(LinearDecay, self).__init__()
+        self.rates = rates
+
+    def select_rows(self, index):
+        return LinearDecay(self.rates[index])
+
+    def forward(self, t, y):
+        return -self.rates.view(-1, 1, 1)*y
+
+
+RATES = torch.tensor([0.1, 1., 50., 2.], dtype = torch.float64)
+T = torch.tensor([0., 1.], dtype = torch.float64)
+
+
+def test_matches_analytic_solution():
+    y0 = torch.rand(len(RATES), 1, 3, dtype = torch.float64)
+    solution = odeint(LinearDecay(RATES), y0, T, method = 'batched_dopri5', rtol = 1e-9, atol = 1e-12)[1]
+    torch.testing.assert_close(solution, y0*torch.exp(-RATES).view(-1, 1, 1), rtol = 1e-7, atol = 1e-12)
+
+
+def test_rows_are_solved_independently():
+    # Every row keeps its own steps, so solving it in a batch gives what solving it alone does, and a stiff row does
+    # not add steps to the others
+    y0 = torch.rand(len(RATES), 1, 3, dtype = torch.float64)
+    batch_stats = SolverStats(timing = False)
+    batched = odeint(LinearDecay(RATES), y0, T, method = 'batched_dopri5', rtol = 1e-7, atol = 1e-9, stats = batch_stats)[1]
+    accepted_alone = 0
+    for row in range(len(RATES)):
+        row_stats = SolverStats(timing = False)
+        alone = odeint(LinearDecay(RATES[row:row + 1]), y0[row:row + 1], T, method = 'batched_dopri5',
+                       rtol = 1e-7, atol = 1e-9, stats = row_stats)[1]
+        torch.testing.assert_close(batched[row:row + 1], alone, rtol = 1e-13, atol = 0)
+        accepted_alone += row_stats.accepted_steps['forward']
+    assert batch_stats.accepted_steps['forward'] == accepted_alone
+
+
+def test_flat_state_is_one_row():
+    y0 = torch.rand(3, dtype = torch.float64)
+    solution = odeint(lambda t, y: -2*y, y0, T, method = 'batched_dopri5', rtol = 1e-9, atol = 1e-12)[1]
+    torch.testing.assert_close(solution, y0*torch.exp(torch.tensor(-2., dtype = torch.float64)), rtol = 1e-7, atol = 1e-12)
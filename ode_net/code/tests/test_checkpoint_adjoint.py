@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+from pairwise_solve import solve_pairs
+from torchdiffeq import odeint, odeint_adjoint, supports_checkpoint_adjoint
+
+
+def gradients(odenet, y0, t_pairs, odeint_fn, method, **odeint_kwargs):
+    ''' Gradients of the squared end states with respect to the parameters and y0, flattened into one vector '''
+    odenet.zero_grad()
+    y0 = y0.clone().requires_grad_()
+    predictions = solve_pairs(odeint_fn, odenet, y0, t_pairs, method, batched = True, rtol = 1e-7, atol = 1e-9, **odeint_kwargs)
+    predictions.pow(2).sum().backward()
+    return torch.cat([param.grad.flatten() for param in odenet.parameters()] + [y0.grad.flatten()])
+
+
+@pytest.mark.parametrize('method', ['dopri5', 'batched_dopri5'])
+def test_matches_direct_backpropagation(odenet, pairs, method):
+    # The checkpoint adjoint replays the accepted steps, so it only differs from backpropagating through the solver
+    # in not differentiating the step size selection
+    direct = gradients(odenet, *pairs, odeint, method)
+    checkpoint = gradients(odenet, *pairs, odeint_adjoint, method, adjoint_mode = 'checkpoint')
+    torch.testing.assert_close(checkpoint, direct, rtol = 0, atol = 1e-5*direct.abs().max().item())
+
+
+def test_budget_does_not_change_gradients(odenet, pairs):
+    every_step = gradients(odenet, *pairs, odeint_adjoint, 'dopri5', adjoint_mode = 'checkpoint')
+    budget = gradients(odenet, *pairs, odeint_adjoint, 'dopri5', adjoint_mode = 'checkpoint', checkpoint_budget = 2)
+    torch.testing.assert_close(budget, every_step, rtol = 1e-10, atol = 1e-12)
+
+
+def test_supported_methods():
+    assert supports_checkpoint_adjoint('dopri5') and supports_checkpoint_adjoint('batched_dopri5')
+    assert not supports_checkpoint_adjoint('rosenbrock23') and not supports_checkpoint_adjoint('etdrk4')
+    assert not supports_checkpoint_adjoint('rk4') and not supports_checkpoint_adjoint('no_such_method')
@@ -0,0 +1,93 @@
+import os
+import random
+
+import numpy as np
+import pytest
+import torch
+import torch.optim as optim
+
+from artifact_writer import snapshot
+from checkpointing import (load_checkpoint, restore_training_checkpoint, rng_state, save_checkpoint, set_rng_state,
+                           training_checkpoint)
+from datahandler import DataHandler
+from odenet import ODENet
+from prior_loss import PriorSampler
+from torchdiffeq import StepSizeCache
+from train_inte import training_step
+
+
+def build_run(data_csv):
+    ''' The objects of a small training run, drawn from the global random state as train_inte.py draws them '''
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0.25, batch_type = 'single')
+    odenet = ODENet('cpu', 3, neurons = 4)
+    prior_sampler = PriorSampler(torch.eye(3).to_sparse(), K = 20, batch_size = 5)
+    opt = optim.Adam(odenet.parameters(), lr = 1e-2)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(opt, patience = 0)
+    return odenet, opt, scheduler, data_handler, prior_sampler, {'step_cache': StepSizeCache()}
+
+
+def train_epoch(odenet, opt, scheduler, data_handler, prior_sampler, solver_options):
+    data_handler.reset_epoch()
+    losses = []
+    while not data_handler.epoch_done:
+        loss_data, loss_prior = training_step(odenet, data_handler, opt, 'dopri5', 4, False, False, prior_sampler, 0.5,
+                                              solver_options = solver_options)
+        losses.append((loss_data.item(), loss_prior.item()))
+    scheduler.step(sum(loss for loss, _ in losses))
+    return losses
+
+
+def test_resumed_run_is_bit_identical(data_csv, tmp_path):
+    initial_rng_state = [rng_state()]
+    run = build_run(data_csv)
+    uninterrupted = [train_epoch(*run) for _ in range(2)]
+    expected_params = [param.detach().clone() for param in run[0].parameters()]
+    expected_draws = (torch.rand(3), np.random.rand(3), random.random())
+
+    fp = str(tmp_path/'checkpoint.pt')
+    set_rng_state(initial_rng_state[0])
+    run = build_run(data_csv)
+    first = train_epoch(*run)
+    odenet, opt, scheduler, data_handler, prior_sampler, solver_options = run
+    checkpoint = training_checkpoint(odenet, opt, scheduler, data_handler, {'epoch': 1, 'training_loss': first},
+                                     solver_options, initial_rng_state = initial_rng_state)
+    save_checkpoint(fp, snapshot(checkpoint))
+    # The interrupted run carries on for a while
+    train_epoch(*run)
+
+    checkpoint = load_checkpoint(str(tmp_path))
+    set_rng_state(checkpoint['initial_rng_state'][0])
+    odenet, opt, scheduler, data_handler, prior_sampler, solver_options = build_run(data_csv)
+    progress = restore_training_checkpoint(checkpoint, odenet, opt, scheduler, data_handler, solver_options)
+    assert progress['epoch'] == 1
+    resumed = [progress['training_loss'], train_epoch(odenet, opt, scheduler, data_handler, prior_sampler, solver_options)]
+
+    assert resumed == uninterrupted
+    for param, expected in zip(odenet.parameters(), expected_params):
+        assert torch.equal(param, expected)
+    draws = (torch.rand(3), np.random.rand(3), random.random())
+    assert torch.equal(draws[0], expected_draws[0])
+    np.testing.assert_array_equal(draws[1], expected_draws[1])
+    assert draws[2] == expected_draws[2]
+
+
+def test_checkpoint_of_other_world_size_is_rejected(data_csv):
+    odenet, opt, scheduler, data_handler, prior_sampler, solver_options = build_run(data_csv)
+    checkpoint = training_checkpoint(odenet, opt, scheduler, data_handler, {}, solver_options)
+    with pytest.raises(ValueError):
+        restore_training_checkpoint(checkpoint, odenet, opt, scheduler, data_handler, solver_options, rank = 0, world_size = 2)
+
+
+def test_failed_save_keeps_the_previous_checkpoint(tmp_path, monkeypatch):
+    fp = str(tmp_path/'checkpoint.pt')
+    save_checkpoint(fp, {'epoch': 1})
+    save_checkpoint(fp, {'epoch': 2})
+    assert os.listdir(str(tmp_path)) == ['checkpoint.pt']
+
+    def interrupted_save(obj, f):
+        f.write(b'partial')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(torch, 'save', interrupted_save)
+    with pytest.raises(KeyboardInterrupt):
+        save_checkpoint(fp, {'epoch': 3})
+    assert load_checkpoint(fp) == {'epoch': 2}
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+from csvreader import _parse_csv_values, readcsv, writecsv
+
+
+def write_trajectories(fp, dim = 3, lengths = (4, 6)):
+    data_np = [np.random.rand(length, 1, dim) for length in lengths]
+    t_np = [np.sort(np.random.rand(length))*10 for length in lengths]
+    writecsv(str(fp), dim, len(lengths), data_np, t_np)
+    return data_np, t_np
+
+
+def test_roundtrip(tmp_path):
+    fp = tmp_path/'data.csv'
+    data_np, t_np = write_trajectories(fp)
+    read_data, _, read_t, _, dim, ntraj, read_0noise, _ = readcsv(str(fp), 'cpu', 0, 1, 'linear', use_cache = False)
+    assert (dim, ntraj) == (3, 2)
+    for expected, data, data_0noise in zip(data_np, read_data, read_0noise):
+        np.testing.assert_allclose(data.reshape(expected.shape), expected)
+        np.testing.assert_allclose(data_0noise.reshape(expected.shape), expected)
+    for expected, t in zip(t_np, read_t):
+        np.testing.assert_allclose(np.asarray(t).reshape(-1), expected)
+    assert not os.path.exists(str(fp) + '.cache.npz')
+
+
+def test_parse_empty_fields_and_line_endings(tmp_path):
+    fp = tmp_path/'values.csv'
+    fp.write_bytes(b'2,1\n1,,3\r\n,,\n\n4,5e-3,nan,\n1,2\n\n')
+    values, row_offsets = _parse_csv_values(str(fp))
+    np.testing.assert_array_equal(row_offsets, [0, 2, 5, 8, 9, 13, 15])
+    np.testing.assert_array_equal(values, [2, 1, 1, np.nan, 3, np.nan, np.nan, np.nan, np.nan, 4, 5e-3, np.nan, np.nan, 1, 2])
+    assert values.dtype == np.float64
+
+
+def test_parse_rejects_non_numbers(tmp_path):
+    fp = tmp_path/'values.csv'
+    fp.write_text('1,x,3\n')
+    with pytest.raises(ValueError):
+        _parse_csv_values(str(fp))
+
+
+def test_cache_is_used_until_the_file_changes(tmp_path, capsys):
+    fp = tmp_path/'data.csv'
+    write_trajectories(fp)
+    first = readcsv(str(fp), 'cpu', 0, 1, 'linear')[0]
+    assert os.path.exists(str(fp) + '.cache.npz')
+    assert 'from cache' not in capsys.readouterr().out
+
+    cached = readcsv(str(fp), 'cpu', 0, 1, 'linear')[0]
+    assert 'from cache' in capsys.readouterr().out
+    for a, b in zip(first, cached):
+        np.testing.assert_array_equal(a, b)
+
+    # Rewritten with other values, with the modification time moved on in case the filesystem clock is coarse
+    data_np, _ = write_trajectories(fp)
+    stat = os.stat(fp)
+    os.utime(fp, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    reread = readcsv(str(fp), 'cpu', 0, 1, 'linear')[0]
+    assert 'from cache' not in capsys.readouterr().out
+    np.testing.assert_allclose(reread[0].reshape(data_np[0].shape), data_np[0])
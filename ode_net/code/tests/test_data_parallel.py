@@ -0,0 +1,109 @@
+import os
+import socket
+
+import numpy as np
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+import data_parallel
+from datahandler import DataHandler
+from odenet import ODENet
+
+WORLD_SIZE = 2
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def loss_of(odenet, y):
+    return odenet(0, y).pow(2).mean()
+
+
+def run_rank(rank, port, results_fp):
+    ''' One rank of a gloo group: broadcast rank 0's model, backpropagate on this rank's data and average '''
+    os.environ.update(MASTER_ADDR = '127.0.0.1', MASTER_PORT = str(port), RANK = str(rank), WORLD_SIZE = str(WORLD_SIZE),
+                      LOCAL_WORLD_SIZE = str(WORLD_SIZE))
+    assert data_parallel.init_data_parallel(num_threads = 1) == (rank, WORLD_SIZE)
+    try:
+        assert data_parallel.is_data_parallel()
+        torch.manual_seed(rank)
+        odenet = ODENet('cpu', 6, neurons = 8).double()
+        data_parallel.broadcast_module(odenet)
+
+        y = torch.rand(4, 1, 6, dtype = torch.float64, generator = torch.Generator().manual_seed(100 + rank))
+        loss_of(odenet, y).backward()
+        data_parallel.average_gradients(odenet)
+        results = {'params': [param.detach() for param in odenet.parameters()],
+                   'grads': [param.grad for param in odenet.parameters()],
+                   'mean': data_parallel.mean_across_ranks(rank + 1.),
+                   'seed': data_parallel.shared_seed(),
+                   'gathered': data_parallel.gather_objects(('rank', rank))}
+        torch.save(results, '{}.{}'.format(results_fp, rank))
+    finally:
+        dist.destroy_process_group()
+
+
+def test_single_process_is_a_no_op(odenet, monkeypatch):
+    monkeypatch.delenv('WORLD_SIZE', raising = False)
+    assert data_parallel.init_data_parallel() == (0, 1)
+    assert not data_parallel.is_data_parallel()
+    loss_of(odenet, torch.rand(3, 1, 6, dtype = torch.float64)).backward()
+    grads = [param.grad.clone() for param in odenet.parameters()]
+    data_parallel.average_gradients(odenet)
+    for grad, param in zip(grads, odenet.parameters()):
+        assert torch.equal(param.grad, grad)
+    assert data_parallel.mean_across_ranks(2.5) == 2.5
+    assert data_parallel.gather_objects('x') == ['x']
+
+
+def test_gloo_group_averages_gradients(tmp_path):
+    results_fp = str(tmp_path/'results')
+    mp.spawn(run_rank, args = (free_port(), results_fp), nprocs = WORLD_SIZE)
+    results = [torch.load('{}.{}'.format(results_fp, rank)) for rank in range(WORLD_SIZE)]
+
+    # The gradients of rank 0's model on the data of all ranks, in one process
+    torch.manual_seed(0)
+    odenet = ODENet('cpu', 6, neurons = 8).double()
+    for rank in range(WORLD_SIZE):
+        y = torch.rand(4, 1, 6, dtype = torch.float64, generator = torch.Generator().manual_seed(100 + rank))
+        (loss_of(odenet, y)/WORLD_SIZE).backward()
+
+    for result in results:
+        for param, expected in zip(result['params'], odenet.parameters()):
+            assert torch.equal(param, expected.detach())
+        for grad, param in zip(result['grads'], odenet.parameters()):
+            torch.testing.assert_close(grad, param.grad, rtol = 1e-12, atol = 1e-15)
+        assert result['mean'] == 1.5
+        assert result['seed'] == results[0]['seed']
+        assert result['gathered'] == [('rank', rank) for rank in range(WORLD_SIZE)]
+
+
+@pytest.mark.parametrize('world_size', [1, 3, 5])
+def test_shards_cover_the_epoch(data_csv, world_size):
+    shards = []
+    for rank in range(world_size):
+        data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0, batch_type = 'single')
+        data_handler.shard(rank, world_size, seed = 7)
+        epochs = []
+        for epoch in range(2):
+            np.random.seed(rank)
+            data_handler.reset_epoch()
+            times = []
+            while not data_handler.epoch_done:
+                times.append(data_handler.get_batch(2)[1][:, 0])
+            epochs.append(torch.cat(times))
+        assert len(epochs[0]) == data_handler.shard_length
+        assert not torch.equal(epochs[0], epochs[1])
+        shards.append(epochs[0])
+
+    # Every rank takes the same number of samples; together they visit every pair, repeating only the padding
+    n_pairs = 4*7
+    assert len(set(len(shard) for shard in shards)) == 1
+    visited = torch.cat(shards)
+    assert len(visited) == int(np.ceil(n_pairs/world_size))*world_size
+    assert len(set(visited.tolist())) == n_pairs
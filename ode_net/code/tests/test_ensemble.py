@@ -0,0 +1,74 @@
+import pytest
+import torch
+
+from odenet import EnsembleODENet, ODENet
+from pairwise_solve import solve_pairs
+from torchdiffeq import odeint
+
+N_REPLICATES = 3
+
+
+@pytest.fixture
+def replicates():
+    replicates = []
+    for _ in range(N_REPLICATES):
+        odenet = ODENet('cpu', 6, neurons = 8).double()
+        with torch.no_grad():
+            for param in odenet.parameters():
+                param.normal_(0, 0.3)
+            odenet.gene_multipliers.uniform_(0.2, 1)
+        replicates.append(odenet)
+    return replicates
+
+
+def test_forward_matches_every_replicate(replicates):
+    ensemble = EnsembleODENet(replicates)
+    y = torch.rand(4, 1, 6, dtype = torch.float64)
+    expanded = ensemble.expand_states(y)
+    assert expanded.shape == (4, N_REPLICATES, 6)
+    rates = ensemble(0, expanded)
+    prior_rates = ensemble.prior_only_forward(0, expanded)
+    for r, odenet in enumerate(replicates):
+        torch.testing.assert_close(rates[:, r:r + 1], odenet(0, y), rtol = 1e-12, atol = 1e-14)
+        torch.testing.assert_close(prior_rates[:, r:r + 1], odenet.prior_only_forward(0, y), rtol = 1e-12, atol = 1e-14)
+    torch.testing.assert_close(ensemble.diagonal_decay(), torch.relu(torch.cat([odenet.gene_multipliers for odenet in replicates])))
+
+
+def test_solves_and_gradients_match_every_replicate(replicates, pairs):
+    ensemble = EnsembleODENet(replicates)
+    y0, t_pairs = pairs
+    target = torch.rand_like(y0)
+    options = {'step_size': 0.05}
+    predictions = solve_pairs(odeint, ensemble, ensemble.expand_states(y0), t_pairs, 'rk4', batched = True, options = options)
+    losses = ensemble.replicate_mse(predictions, target)
+    losses.sum().backward()
+
+    for r, odenet in enumerate(replicates):
+        prediction = solve_pairs(odeint, odenet, y0, t_pairs, 'rk4', batched = True, options = options)
+        loss = ((prediction - target)**2).mean()
+        torch.testing.assert_close(losses[r], loss, rtol = 1e-12, atol = 0)
+        loss.backward()
+        grads = [(ensemble.sums_weight, odenet.net_sums.linear_out.weight), (ensemble.sums_bias, odenet.net_sums.linear_out.bias),
+                 (ensemble.prods_weight, odenet.net_prods.linear_out.weight), (ensemble.prods_bias, odenet.net_prods.linear_out.bias),
+                 (ensemble.alpha_weight, odenet.net_alpha_combine.linear_out.weight)]
+        for stacked, param in grads:
+            torch.testing.assert_close(stacked.grad[r], param.grad, rtol = 1e-10, atol = 1e-14)
+        torch.testing.assert_close(ensemble.gene_multipliers.grad[r], odenet.gene_multipliers.grad.reshape(6), rtol = 1e-10, atol = 1e-14)
+
+
+def test_replicates_are_standalone_copies(replicates, tmp_path):
+    ensemble = EnsembleODENet(replicates)
+    with torch.no_grad():
+        ensemble.alpha_weight[1] += 0.1
+    y = torch.rand(4, 1, 6, dtype = torch.float64)
+    # ODENets are built in single precision, like the models training saves
+    replicate = ensemble.replicate(1).double()
+    torch.testing.assert_close(replicate(0, y), ensemble(0, ensemble.expand_states(y))[:, 1:2], rtol = 1e-5, atol = 1e-6)
+    # The ensemble copied the weights, so training it leaves the ODENets it was built from alone
+    assert not torch.allclose(replicates[1](0, y), replicate(0, y))
+
+    fp = str(tmp_path/'rep.pt')
+    ensemble.save_replicate(1, fp)
+    loaded = ODENet('cpu', 6, neurons = 8)
+    loaded.load(fp)
+    torch.testing.assert_close(loaded.double()(0, y), replicate(0, y))
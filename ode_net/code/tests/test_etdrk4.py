@@ -0,0 +1,81 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from torchdiffeq import odeint
+from torchdiffeq._impl.etd import _etdrk4_coefficients
+
+
+class ForcedDecay(nn.Module):
+    ''' dy/dt = -rate*(y - target), whose linear part ETDRK4 integrates exactly '''
+
+    def __init__(self, rate, target):
+        super(ForcedDecay, self).__init__()
+        self.rate = rate
+        self.target = target
+
+    def diagonal_decay(self):
+        return self.rate
+
+    def forward(self, t, y):
+        return -self.rate*(y - self.target)
+
+
+T = torch.tensor([0., 1.], dtype = torch.float64)
+
+
+def test_exact_for_linear_dynamics_with_large_steps():
+    rate = torch.tensor([1e-3, 0.5, 20., 1e3], dtype = torch.float64)
+    target = torch.tensor([0.3, -1., 2., 0.5], dtype = torch.float64)
+    y0 = torch.ones(4, dtype = torch.float64)
+    solution = odeint(ForcedDecay(rate, target), y0, T, method = 'etdrk4', options = {'step_size': 0.25})[1]
+    torch.testing.assert_close(solution, target + (y0 - target)*torch.exp(-rate), rtol = 1e-12, atol = 1e-14)
+
+
+def test_fourth_order_on_odenet(odenet):
+    with torch.no_grad():
+        odenet.gene_multipliers.mul_(10)
+    y0 = torch.rand(3, 1, 6, dtype = torch.float64)
+    with torch.no_grad():
+        reference = odeint(odenet, y0, T, method = 'dopri5', rtol = 1e-12, atol = 1e-14)[1]
+        errors = [(odeint(odenet, y0, T, method = 'etdrk4', options = {'step_size': step_size})[1] - reference).abs().max()
+                  for step_size in (0.1, 0.05)]
+    assert 10 < errors[0]/errors[1] < 24
+
+
+def classical_rk4(func, y, t0, t1, n_steps):
+    dt = (t1 - t0)/n_steps
+    for step in range(n_steps):
+        t = t0 + step*dt
+        k1 = func(t, y)
+        k2 = func(t + dt/2, y + dt/2*k1)
+        k3 = func(t + dt/2, y + dt/2*k2)
+        k4 = func(t + dt, y + dt*k3)
+        y = y + dt/6*(k1 + 2*k2 + 2*k3 + k4)
+    return y
+
+
+def test_without_decay_reduces_to_classical_rk4(odenet):
+    y0 = torch.rand(3, 1, 6, dtype = torch.float64)
+    func = lambda t, y: odenet(t, y)
+    with torch.no_grad():
+        etd = odeint(func, y0, T, method = 'etdrk4', options = {'step_size': 0.1})[1]
+        rk4 = classical_rk4(func, y0, 0., 1., 10)
+    torch.testing.assert_close(etd, rk4, rtol = 1e-13, atol = 1e-15)
+
+
+def test_coefficients_match_high_precision():
+    mpmath = pytest.importorskip('mpmath')
+    mpmath.mp.dps = 50
+    z_values = [-200., -2.5, -2.0001, -1.9999, -0.5, -1e-3, -1e-9, 0., 1e-6, 1.5]
+    computed = _etdrk4_coefficients(torch.tensor(z_values, dtype = torch.float64))
+    for i, z in enumerate(z_values):
+        z = mpmath.mpf(z)
+        if z == 0:
+            exact = (mpmath.mpf(1), mpmath.mpf(1)/6, mpmath.mpf(1)/6, mpmath.mpf(1)/6)
+        else:
+            e = mpmath.exp(z)
+            exact = ((mpmath.exp(z/2) - 1)/(z/2), (-4 - z + e*(4 - 3*z + z**2))/z**3, (2 + z + e*(z - 2))/z**3,
+                     (-4 - 3*z - z**2 + e*(4 - z))/z**3)
+        for coefficient, value in zip(computed, exact):
+            assert abs(coefficient[i].item() - float(value)) <= 1e-14*max(1., abs(float(value)))
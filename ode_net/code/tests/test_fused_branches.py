@@ -0,0 +1,44 @@
+import torch
+
+from odenet import ODENet, _SumsProdsFunction
+
+
+def unfused_forward(odenet, y):
+    sums = odenet.net_sums(y)
+    prods = torch.exp(odenet.net_prods(y))
+    joint = odenet.net_alpha_combine(torch.cat((sums, prods), dim = -1))
+    return torch.relu(odenet.gene_multipliers)*(joint - y)
+
+
+def test_forward_and_gradients_match_the_sequentials(odenet):
+    assert odenet.fused_branches
+    y = torch.rand(4, 1, 6, dtype = torch.float64, requires_grad = True)
+    weights = torch.randn(4, 1, 6, dtype = torch.float64)
+    results = []
+    for forward in (odenet, lambda t, y: unfused_forward(odenet, y)):
+        final = forward(0., y)
+        results.append((final,) + torch.autograd.grad((final*weights).sum(), (y,) + tuple(odenet.parameters())))
+    for fused, unfused in zip(*results):
+        torch.testing.assert_close(fused, unfused, rtol = 1e-12, atol = 1e-14)
+
+
+def test_gradcheck(odenet):
+    lin_sums = odenet.net_sums.linear_out
+    lin_prods = odenet.net_prods.linear_out
+    inputs = (torch.rand(3, 1, 6, dtype = torch.float64, requires_grad = True), lin_sums.weight, lin_sums.bias,
+              lin_prods.weight, lin_prods.bias)
+    assert torch.autograd.gradcheck(_SumsProdsFunction.apply, inputs)
+
+
+def test_prior_only_forward(odenet):
+    y = torch.rand(4, 1, 6, dtype = torch.float64)
+    sums = odenet.net_sums(y)
+    prods = torch.exp(odenet.net_prods(y))
+    torch.testing.assert_close(odenet.prior_only_forward(0., y), odenet.net_alpha_combine(torch.cat((sums, prods), dim = -1)))
+
+
+def test_other_branches_run_through_the_sequentials():
+    odenet = ODENet('cpu', 6, neurons = 8, sparse = True).double()
+    assert not odenet.fused_branches
+    y = torch.rand(4, 1, 6, dtype = torch.float64)
+    torch.testing.assert_close(odenet(0., y), unfused_forward(odenet, y))
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import torch
+
+from datahandler import DataHandler
+from grn_extraction import extract_grn, sample_states, write_edge_list
+from prior_loss import read_prior_matrix
+
+
+def mean_autograd_jacobian(odenet, states):
+    ''' Mean of d forward_i / d y_j over the states, from one autograd Jacobian per state '''
+    return torch.stack([torch.autograd.functional.jacobian(lambda y: odenet(0, y).reshape(-1), state) for state in states]).mean(0)
+
+
+@pytest.fixture
+def states():
+    return torch.rand(9, 6, dtype = torch.float64)
+
+
+def test_effects_are_the_mean_jacobian(odenet, states):
+    jacobian = mean_autograd_jacobian(odenet, states)
+    decay = torch.diag(torch.relu(odenet.gene_multipliers).reshape(-1))
+    torch.testing.assert_close(extract_grn(odenet, states, include_decay = True), jacobian.t(), rtol = 1e-10, atol = 1e-12)
+    torch.testing.assert_close(extract_grn(odenet, states), (jacobian + decay).t(), rtol = 1e-10, atol = 1e-12)
+
+
+def test_chunking_does_not_change_effects(odenet, states):
+    expected = extract_grn(odenet, states, include_decay = True)
+    chunked = extract_grn(odenet, states.reshape(3, 3, 6), target_chunk = 4, state_chunk = 2, include_decay = True)
+    torch.testing.assert_close(chunked, expected, rtol = 1e-12, atol = 1e-14)
+
+
+def test_top_k_keeps_the_largest_effects_per_target(odenet, states):
+    dense = extract_grn(odenet, states)
+    sparse = extract_grn(odenet, states, top_k = 2, target_chunk = 4)
+    assert sparse.is_sparse
+    kept = sparse.to_dense()
+    for target in range(6):
+        top = dense[:, target].abs().topk(2).indices
+        assert set(kept[:, target].nonzero().reshape(-1).tolist()) == set(top.tolist())
+        torch.testing.assert_close(kept[top, target], dense[top, target])
+
+
+def test_edge_list_reads_back_as_prior(odenet, states, tmp_path):
+    effects = extract_grn(odenet, states, top_k = 3)
+    fp = str(tmp_path/'edges.csv')
+    write_edge_list(fp, effects)
+    prior = read_prior_matrix(fp, sparse = True, num_genes = 6, use_cache = False)
+    torch.testing.assert_close(prior.to_dense(), effects.to_dense().float(), rtol = 1e-7, atol = 0)
+
+
+def test_sample_states(data_csv):
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', val_split = 0)
+    values = np.asarray(data_handler.store.values)
+    states = sample_states(data_handler, n_states = 10, seed = 1)
+    assert states.shape == (10, 3)
+    rows = [np.flatnonzero((values == state).all(axis = 1)) for state in states.numpy()]
+    assert all(len(row) == 1 for row in rows)
+    assert len(set(int(row[0]) for row in rows)) == 10
+    torch.testing.assert_close(sample_states(data_handler, n_states = 10, seed = 1), states)
+    assert sample_states(data_handler, n_states = 1000).shape == (values.shape[0], 3)
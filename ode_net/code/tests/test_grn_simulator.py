@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import torch
+
+from csvreader import _load_csv_values, _parse_csv_values, readcsv
+from grn_simulator import GRNSystem, read_ode_system, write_dataset
+
+try:
+    from torchdiffeq.__init__ import odeint
+except ImportError:
+    from torchdiffeq import odeint
+
+ODE_SYSTEM = os.path.join(os.path.dirname(__file__), '../../../ground_truth_simulator/clean_data/ode_system_functions.csv')
+
+SMALL_SYSTEM = [('B', '((1 * fAct(A, 0.52, 1.41)) * 1 - 1 * B) / 1'),
+                ('A', 'input gene'),
+                ('C', '((fInh(B, 0.4, 3) * fAct(A, 0.52, 1.41) + 0.5 * fAct(B, 0.6, 2)) * 0.8 - 2 * 0.5 * C) / 1.5'),
+                ('D', 'input gene')]
+
+
+def f_act(tf, ec50, n):
+    ''' The activation function of GraphGRN_core.R '''
+    b = (ec50**n - 1) / (2*ec50**n - 1)
+    return b * max(tf, 0)**n / (b - 1 + max(tf, 0)**n)
+
+
+def reference_rates(ode_system, gene_names, state):
+    ''' dy/dt of every gene, by evaluating the equations of ode_system one by one '''
+    values = dict(zip(gene_names, state))
+    namespace = dict(values, fAct = f_act, fInh = lambda tf, ec50, n: 1 - f_act(tf, ec50, n))
+    rates = {node: 0. if eqn == 'input gene' else eval(eqn, {}, namespace) for node, eqn in ode_system}
+    return np.array([rates[name] for name in gene_names])
+
+
+def test_small_system_matches_the_equations():
+    system = GRNSystem(SMALL_SYSTEM)
+    assert system.gene_names == ['A', 'D', 'B', 'C']
+    assert system.n_inputs == 2
+    # fAct(A, 0.52, 1.41) is shared by B and C
+    assert system.n_hill_terms == 3
+
+    y = torch.rand(4, 3, system.dim, dtype = torch.float64)
+    rates = system(0, y)
+    assert rates.shape == y.shape
+    expected = np.array([reference_rates(SMALL_SYSTEM, system.gene_names, state) for state in y.reshape(-1, system.dim).numpy()])
+    np.testing.assert_allclose(rates.reshape(-1, system.dim).numpy(), expected, rtol = 1e-12)
+    assert (rates[..., :system.n_inputs] == 0).all()
+
+
+def test_full_system_matches_the_equations():
+    ode_system = read_ode_system(ODE_SYSTEM)
+    system = GRNSystem(ode_system)
+    y = torch.rand(3, system.dim, dtype = torch.float64)
+    rates = system(0, y)
+    for state, state_rates in zip(y.numpy(), rates.numpy()):
+        np.testing.assert_allclose(state_rates, reference_rates(ode_system, system.gene_names, state), rtol = 1e-10, atol = 1e-12)
+
+
+def test_initial_conditions():
+    system = GRNSystem(SMALL_SYSTEM)
+    y0 = system.sample_initial_conditions(50, seed = 3)
+    assert y0.shape == (50, system.dim)
+    assert ((y0 >= 0) & (y0 <= 1)).all()
+    np.testing.assert_array_equal(y0, system.sample_initial_conditions(50, seed = 3))
+    assert not np.array_equal(y0, system.sample_initial_conditions(50, seed = 4))
+
+
+def test_simulate_batches_match_odeint():
+    system = GRNSystem(SMALL_SYSTEM)
+    y0 = system.sample_initial_conditions(7, seed = 0)
+    times = [0, 0.5, 2, 3]
+    trajectories = system.simulate(y0, times, batch_size = 3, rtol = 1e-9, atol = 1e-11)
+    assert trajectories.shape == (7, len(times), system.dim)
+    np.testing.assert_array_equal(trajectories[:, 0], y0)
+    np.testing.assert_allclose(trajectories[:, :, :system.n_inputs], np.repeat(y0[:, None, :system.n_inputs], len(times), 1), rtol = 1e-12)
+    for sample in range(7):
+        expected = odeint(system, torch.from_numpy(y0[sample]), torch.tensor(times, dtype = torch.float64), rtol = 1e-9, atol = 1e-11)
+        np.testing.assert_allclose(trajectories[sample], expected.numpy(), rtol = 1e-6, atol = 1e-8)
+
+
+def test_written_dataset_reads_back(tmp_path):
+    system = GRNSystem(SMALL_SYSTEM)
+    times = np.array([0, 2, 3, 7, 9.])
+    trajectories = system.simulate(system.sample_initial_conditions(4, seed = 1), times)
+    fp = str(tmp_path/'simulated.csv')
+    write_dataset(fp, trajectories, times, noise = 0.01, seed = 2)
+
+    # The sidecar written with the CSV holds exactly what parsing the CSV gives
+    parsed_values, parsed_offsets = _parse_csv_values(fp)
+    cached_values, cached_offsets = _load_csv_values(fp)
+    np.testing.assert_array_equal(cached_values, parsed_values)
+    np.testing.assert_array_equal(cached_offsets, parsed_offsets)
+
+    data, _, t, _, dim, ntraj, _, _ = readcsv(fp, 'cpu', 0, 1, 'linear')
+    assert (dim, ntraj) == (system.dim, 4)
+    noise = np.stack([np.asarray(d).reshape(len(times), dim) for d in data]) - trajectories
+    assert 0 < np.abs(noise).max() < 0.1
+    for sample_t in t:
+        np.testing.assert_array_equal(np.asarray(sample_t).reshape(-1), times)
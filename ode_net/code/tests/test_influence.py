@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import torch
+
+from influence import InfluenceScorer
+from torchdiffeq import odeint
+
+T = torch.tensor([0., 0.5, 1., 2.], dtype = torch.float64)
+RK4 = {'method': 'rk4', 'options': {'step_size': 0.1}}
+
+
+def reference_score(scorer, gene):
+    ''' Influence of one gene, from its own unbatched solve, as the original per-gene loop computed it '''
+    generator = torch.Generator().manual_seed(scorer.seed + 1 + gene)
+    perturbed = scorer.init_states.clone()
+    perturbed[:, 0, gene] = (torch.rand(scorer.n_inputs, generator = generator, dtype = scorer.dtype) - 0.5)*scorer.scale
+    with torch.no_grad():
+        out = odeint(scorer.odenet, perturbed, scorer.t, **RK4)
+    change = (out[1:] - scorer.baseline[1:]).abs()
+    others = [g for g in range(scorer.dim) if g != gene]
+    return change[..., others].mean().item()
+
+
+def test_stacked_scores_match_per_gene_loop(odenet):
+    scorer = InfluenceScorer(odenet, 6, T, n_inputs = 10, seed = 5, **RK4)
+    assert scorer.genes_per_chunk >= 6
+    scores = scorer.score(verbose = False)
+    np.testing.assert_allclose(scores, [reference_score(scorer, gene) for gene in range(6)], rtol = 1e-10)
+
+
+def test_scores_do_not_depend_on_chunking(odenet):
+    all_at_once = InfluenceScorer(odenet, 6, T, n_inputs = 10, seed = 5, **RK4)
+    one_by_one = InfluenceScorer(odenet, 6, T, n_inputs = 10, seed = 5, memory_budget_mb = 0, **RK4)
+    assert one_by_one.genes_per_chunk == 1
+    np.testing.assert_allclose(one_by_one.score(verbose = False), all_at_once.score(verbose = False), rtol = 1e-10)
+    np.testing.assert_allclose(all_at_once.score([4, 1], verbose = False), all_at_once.score(verbose = False)[[4, 1]], rtol = 1e-10)
+
+
+def test_scoring_resumes_from_the_output_file(odenet, tmp_path):
+    out_fp = str(tmp_path/'influences.csv')
+    scorer = InfluenceScorer(odenet, 6, T, n_inputs = 10, seed = 5, memory_budget_mb = 0, **RK4)
+    expected = scorer.score(out_fp = out_fp, verbose = False, model_fp = 'model.pt')
+    np.testing.assert_allclose(np.loadtxt(out_fp, delimiter = ','), expected)
+
+    # A run interrupted after 4 genes, continued by another one
+    np.savetxt(out_fp, expected[:4], delimiter = ',')
+    scored = []
+    score_chunk = scorer.score_chunk
+    def recording_score_chunk(genes):
+        scored.extend(genes)
+        return score_chunk(genes)
+    scorer.score_chunk = recording_score_chunk
+    np.testing.assert_allclose(scorer.score(out_fp = out_fp, verbose = False, resume = True, model_fp = 'model.pt'), expected)
+    assert scored == [4, 5]
+    np.testing.assert_allclose(np.loadtxt(out_fp, delimiter = ','), expected)
+
+
+def test_stale_output_file_is_not_reused(odenet, tmp_path):
+    out_fp = str(tmp_path/'influences.csv')
+    scorer = InfluenceScorer(odenet, 6, T, n_inputs = 10, seed = 5, **RK4)
+    expected = scorer.score(verbose = False)
+
+    # Left over from another model, without a sidecar: overwritten by default, refused when resuming
+    np.savetxt(out_fp, np.full(4, 99.), delimiter = ',')
+    with pytest.raises(ValueError):
+        scorer.score(out_fp = out_fp, verbose = False, resume = True)
+    np.testing.assert_allclose(scorer.score(out_fp = out_fp, verbose = False), expected)
+    np.testing.assert_allclose(np.loadtxt(out_fp, delimiter = ','), expected)
+
+    # Written for another seed, model or list of genes
+    other_seed = InfluenceScorer(odenet, 6, T, n_inputs = 10, seed = 6, **RK4)
+    with pytest.raises(ValueError):
+        other_seed.score(out_fp = out_fp, verbose = False, resume = True)
+    with pytest.raises(ValueError):
+        scorer.score(out_fp = out_fp, verbose = False, resume = True, model_fp = 'other.pt')
+    with pytest.raises(ValueError):
+        scorer.score([4, 1], out_fp = out_fp, verbose = False, resume = True)
+    np.testing.assert_allclose(scorer.score([4, 1], out_fp = out_fp, verbose = False), expected[[4, 1]])
+    np.testing.assert_allclose(scorer.score([4, 1], out_fp = out_fp, verbose = False, resume = True), expected[[4, 1]])
@@ -0,0 +1,53 @@
+import pytest
+import torch
+
+from datahandler import DataHandler
+
+
+def looped_true_mu_set(data_handler, val_only, batch_type):
+    ''' The noiseless pairs gathered one at a time, as get_true_mu_set_pairwise used to '''
+    if batch_type == 'trajectory' and val_only:
+        pairs = [pair for traj in data_handler.val_set_indx for pair in data_handler.indx if pair[0] == traj]
+    elif batch_type == 'single' and val_only:
+        pairs = data_handler.val_set_indx
+    else:
+        pairs = data_handler.indx
+    data = torch.stack([data_handler.data_pt_0noise[traj][index] for traj, index in pairs])
+    target = torch.stack([data_handler.data_pt_0noise[traj][index + 1] for traj, index in pairs])
+    t = torch.stack([data_handler.time_pt[traj][index:index + 2] for traj, index in pairs])
+    return data, t, target
+
+
+@pytest.mark.parametrize('batch_type', ['trajectory', 'single'])
+@pytest.mark.parametrize('val_only', [False, True])
+def test_true_mu_set_matches_the_per_pair_loop(data_csv, batch_type, val_only):
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0.5, batch_type = batch_type, noise = 0.1)
+    pairwise = data_handler.get_true_mu_set_pairwise(val_only = val_only, batch_type = batch_type)
+    for tensor, expected in zip(pairwise, looped_true_mu_set(data_handler, val_only, batch_type)):
+        assert torch.equal(tensor, expected)
+    assert data_handler.get_true_mu_set_pairwise(val_only = val_only, batch_type = batch_type) is pairwise
+
+
+def test_trajectory_validation_set(data_csv):
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0.5, batch_type = 'trajectory', noise = 0.1)
+    data, t, target, n_val = data_handler.get_validation_set()
+    assert n_val == 2
+    for i, traj in enumerate(data_handler.val_set_indx):
+        rows = slice(7*i, 7*(i + 1))
+        assert torch.equal(data[rows], data_handler.data_pt[traj][:-1])
+        assert torch.equal(target[rows], data_handler.data_pt[traj][1:])
+        assert torch.equal(t[rows], torch.stack((data_handler.time_pt[traj][:-1], data_handler.time_pt[traj][1:]), dim = 1))
+
+
+def test_pairs_with_missing_times_are_dropped(data_csv):
+    with open(data_csv) as f:
+        lines = f.read().splitlines()
+    # Line 4 holds the time points of the first trajectory, after the header and its 3 gene rows
+    times = lines[4].split(',')
+    times[3] = ''
+    lines[4] = ','.join(times)
+    with open(data_csv, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    data_handler = DataHandler.fromcsv(data_csv, 'cpu', 0, batch_type = 'trajectory')
+    data, t, target = data_handler.get_true_mu_set_pairwise()
+    assert len(t) == 4*7 - 2 and not torch.isnan(t).any()
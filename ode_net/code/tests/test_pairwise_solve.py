@@ -0,0 +1,37 @@
+import pytest
+import torch
+
+from pairwise_solve import solve_pairs, pair_options
+from torchdiffeq import odeint
+
+
+@pytest.mark.parametrize('method', ['dopri5', 'rk4'])
+def test_batched_matches_per_sample(odenet, pairs, method):
+    y0, t_pairs = pairs
+    options = {'step_size': 0.01} if method == 'rk4' else None
+    with torch.no_grad():
+        per_sample = solve_pairs(odeint, odenet, y0, t_pairs, method, batched = False, options = options, rtol = 1e-10, atol = 1e-12)
+        batched = solve_pairs(odeint, odenet, y0, t_pairs, method, batched = True, options = options, rtol = 1e-10, atol = 1e-12)
+    assert batched.shape == y0.shape
+    torch.testing.assert_close(batched, per_sample, rtol = 0, atol = 1e-8)
+
+
+def test_batched_gradients_match_per_sample(odenet, pairs):
+    # On a fixed grid the steps of every pair are the same either way (adaptive steps differ, and backpropagating
+    # through their selection shifts the gradients by more than the solver tolerance)
+    y0, t_pairs = pairs
+    grads = []
+    for batched in (False, True):
+        odenet.zero_grad()
+        predictions = solve_pairs(odeint, odenet, y0, t_pairs, 'rk4', batched = batched, options = {'step_size': 0.05})
+        predictions.pow(2).sum().backward()
+        grads.append([param.grad.clone() for param in odenet.parameters()])
+    for per_sample, batched in zip(*grads):
+        torch.testing.assert_close(batched, per_sample, rtol = 1e-10, atol = 1e-12)
+
+
+def test_pair_options_scale_step_size():
+    time = torch.tensor([1., 3.])
+    assert pair_options({'step_size': 0.1}, time) == {'step_size': pytest.approx(0.2)}
+    assert pair_options(None, time) is None
+    assert pair_options({'step_size': None}, time) == {'step_size': None}
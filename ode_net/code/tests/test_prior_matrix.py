@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import torch
+
+from prior_loss import read_prior_matrix, flip_prior_signs
+
+
+def write_dense(fp, mat):
+    np.savetxt(fp, mat, delimiter = ',')
+
+
+def test_dense_csv_matches_genfromtxt(tmp_path):
+    fp = str(tmp_path/'prior.csv')
+    with open(fp, 'w') as f:
+        f.write('0,1,\n,0,-2.5\n3,0,0\n')
+    prior_mat = read_prior_matrix(fp, use_cache = False)
+    assert prior_mat.is_sparse and prior_mat.shape == (3, 3)
+    np.testing.assert_array_equal(prior_mat.to_dense().numpy(), np.genfromtxt(fp, delimiter = ',').astype(np.float32))
+
+
+def test_edge_list_matches_dense_csv(tmp_path):
+    mat = np.random.randn(5, 5)*(np.random.rand(5, 5) < 0.4)
+    dense_fp = str(tmp_path/'dense.csv')
+    write_dense(dense_fp, mat)
+    rows, cols = mat.nonzero()
+    edges_fp = str(tmp_path/'edges.csv')
+    np.savetxt(edges_fp, np.c_[rows + 1, cols + 1, mat[rows, cols]], delimiter = ',')
+    dense = read_prior_matrix(dense_fp, use_cache = False)
+    edges = read_prior_matrix(edges_fp, sparse = True, num_genes = 5, use_cache = False)
+    assert dense.shape == edges.shape == (5, 5)
+    torch.testing.assert_close(edges.to_dense(), dense.to_dense())
+    assert edges._nnz() == dense._nnz() == len(rows)
+
+
+def test_cache_is_used_until_the_file_changes(tmp_path, capsys):
+    fp = str(tmp_path/'prior.csv')
+    write_dense(fp, np.eye(4))
+    first = read_prior_matrix(fp)
+    assert os.path.exists(fp + '.cache.npz')
+    assert 'cache' not in capsys.readouterr().out
+    torch.testing.assert_close(read_prior_matrix(fp).to_dense(), first.to_dense())
+    assert 'cache' in capsys.readouterr().out
+
+    write_dense(fp, 2*np.eye(4))
+    stat = os.stat(fp)
+    os.utime(fp, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    torch.testing.assert_close(read_prior_matrix(fp).to_dense(), 2*torch.eye(4))
+    assert 'cache' not in capsys.readouterr().out
+
+
+def test_flip_prior_signs_keeps_magnitudes_and_support():
+    prior_mat = (torch.randn(6, 6)*(torch.rand(6, 6) < 0.5)).to_sparse()
+    flipped = flip_prior_signs(prior_mat)
+    assert torch.equal(flipped.indices(), prior_mat.coalesce().indices())
+    assert torch.equal(flipped.values().abs(), prior_mat.coalesce().values().abs())
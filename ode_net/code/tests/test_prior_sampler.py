@@ -0,0 +1,42 @@
+import torch
+
+from prior_loss import PriorSampler
+
+
+def random_prior(ndim = 6):
+    return torch.randn(ndim, ndim)*(torch.rand(ndim, ndim) < 0.3)
+
+
+def test_target_is_states_times_prior():
+    prior_mat = random_prior()
+    states = torch.rand(5, 1, 6)
+    for prior in (prior_mat, prior_mat.to_sparse()):
+        torch.testing.assert_close(PriorSampler(prior, K = 10).target(states), states.matmul(prior_mat))
+
+
+def test_chunks_are_regenerated_from_their_seeds():
+    sampler = PriorSampler(random_prior(), K = 25, batch_size = 10, scale = 4, seed = 7)
+    assert sampler.n_chunks == 3
+    chunks = [sampler.sample(chunk) for chunk in range(3)]
+    assert [len(states) for states, _ in chunks] == [10, 10, 5]
+    for chunk, (states, target) in enumerate(chunks):
+        assert states.shape[1:] == (1, 6) and states.abs().max() <= 2
+        again_states, again_target = sampler.sample(chunk)
+        assert torch.equal(again_states, states) and torch.equal(again_target, target)
+    assert not torch.equal(chunks[0][0], chunks[1][0])
+    # Another sampler with the same seed draws the same states
+    assert torch.equal(PriorSampler(random_prior(), K = 25, batch_size = 10, scale = 4, seed = 7).sample(1)[0], chunks[1][0])
+
+
+def test_full_batch_by_default():
+    sampler = PriorSampler(random_prior(), K = 40)
+    assert (sampler.batch_size, sampler.n_chunks) == (40, 1)
+    assert len(sampler.sample()[0]) == 40
+    assert PriorSampler(random_prior(), K = 40, batch_size = 100).batch_size == 40
+
+
+def test_seed_comes_from_the_global_rng():
+    torch.manual_seed(3)
+    first = PriorSampler(random_prior(), K = 10).seed
+    torch.manual_seed(3)
+    assert PriorSampler(random_prior(), K = 10).seed == first
@@ -0,0 +1,53 @@
+import torch
+
+from pairwise_solve import PairwiseRescaledODE, solve_pairs
+from torchdiffeq import odeint, SolverStats
+from torchdiffeq._impl.rosenbrock import _structured_linear_solver
+
+
+def dense_jacobian(diag, u, v):
+    ''' diag(diag) + u v^T of one state vector '''
+    return torch.diag(diag) + u.matmul(v.t())
+
+
+def test_jacobian_structure_matches_autograd(odenet):
+    y = torch.rand(6, dtype = torch.float64)
+    diag, u, v = odenet.jacobian_structure(0., y.view(1, 1, 6))
+    expected = torch.autograd.functional.jacobian(lambda y: odenet(0., y.view(1, 1, 6)).view(6), y)
+    torch.testing.assert_close(dense_jacobian(diag.view(6), u.view(6, -1), v.view(6, -1)), expected, rtol = 1e-10, atol = 1e-12)
+
+
+def test_rescaled_jacobian_structure(odenet, pairs):
+    y0, t_pairs = pairs
+    rescaled = PairwiseRescaledODE.from_pairs(odenet, t_pairs, y0.dim())
+    diag, u, v = rescaled.jacobian_structure(torch.tensor(0.5, dtype = torch.float64), y0)
+    for row in range(y0.shape[0]):
+        expected = torch.autograd.functional.jacobian(lambda y: rescaled(0.5, y.view(1, 1, 6).expand(y0.shape))[row].view(6),
+                                                      y0[row].view(6))
+        torch.testing.assert_close(dense_jacobian(diag[row, 0], u[row, 0], v[row, 0]), expected, rtol = 1e-10, atol = 1e-12)
+
+
+def test_structured_linear_solve():
+    diag = -torch.rand(3, 1, 5, dtype = torch.float64)
+    u = torch.randn(3, 1, 5, 2, dtype = torch.float64)
+    v = torch.randn(3, 1, 5, 2, dtype = torch.float64)
+    b = torch.randn(3, 1, 5, dtype = torch.float64)
+    x = _structured_linear_solver(diag, u, v, 0.1)(b)
+    for row in range(3):
+        system = torch.eye(5, dtype = torch.float64) - 0.1*dense_jacobian(diag[row, 0], u[row, 0], v[row, 0])
+        torch.testing.assert_close(system.matmul(x[row, 0]), b[row, 0], rtol = 1e-10, atol = 1e-12)
+
+
+def test_accuracy_and_steps_on_a_stiff_odenet(odenet, pairs):
+    y0, t_pairs = pairs
+    with torch.no_grad():
+        odenet.gene_multipliers.mul_(1000)
+        reference = solve_pairs(odeint, odenet, y0, t_pairs, 'dopri5', rtol = 1e-9, atol = 1e-11)
+        steps = {}
+        for method in ('rosenbrock23', 'dopri5'):
+            stats = SolverStats(timing = False)
+            predictions = solve_pairs(odeint, odenet, y0, t_pairs, method, rtol = 1e-5, atol = 1e-7, stats = stats)
+            torch.testing.assert_close(predictions, reference, rtol = 0, atol = 1e-4)
+            steps[method] = stats.accepted_steps['forward'] + stats.rejected_steps['forward']
+    # Once the fast decay has settled, the explicit method is held to its stability limit and the implicit one is not
+    assert steps['rosenbrock23']*3 < steps['dopri5']
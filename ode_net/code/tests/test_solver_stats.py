@@ -0,0 +1,58 @@
+import math
+
+import torch
+import torch.nn as nn
+
+from torchdiffeq import odeint, odeint_adjoint, SolverStats
+
+
+class CountingDecay(nn.Module):
+    def __init__(self):
+        super(CountingDecay, self).__init__()
+        self.rate = nn.Parameter(torch.tensor(1.5, dtype = torch.float64))
+        self.calls = 0
+
+    def forward(self, t, y):
+        self.calls += 1
+        return -self.rate*y
+
+
+T = torch.tensor([0., 1.], dtype = torch.float64)
+
+
+def test_counts_every_evaluation_and_step():
+    func = CountingDecay()
+    stats = SolverStats()
+    odeint(func, torch.ones(3, dtype = torch.float64), T, method = 'dopri5', stats = stats)
+    assert stats.nfe['forward'] == func.calls > 0
+    assert stats.nfe['backward'] == 0
+    assert stats.accepted_steps['forward'] > 0
+    assert stats.n_solves == 1
+    assert 0 < stats.min_dt <= stats.max_dt <= 1
+    assert stats.solve_time['forward'] >= stats.func_time['forward'] > 0
+
+
+def test_adjoint_evaluations_count_as_backward():
+    func = CountingDecay()
+    stats = SolverStats()
+    odeint_adjoint(func, torch.ones(3, dtype = torch.float64), T, method = 'dopri5', stats = stats)[1].sum().backward()
+    assert stats.nfe['forward'] > 0 and stats.nfe['backward'] > 0
+    assert stats.nfe['forward'] + stats.nfe['backward'] == func.calls
+    assert stats.phase == 'forward'
+
+
+def test_without_timing_only_counts():
+    stats = SolverStats(timing = False)
+    odeint(CountingDecay(), torch.ones(3, dtype = torch.float64), T, method = 'dopri5', stats = stats)
+    summary = stats.as_dict()
+    assert summary['nfe_forward'] > 0
+    assert math.isnan(summary['func_time_forward']) and math.isnan(summary['overhead_time_forward'])
+
+
+def test_reset_and_empty_summary():
+    stats = SolverStats()
+    odeint(CountingDecay(), torch.ones(3, dtype = torch.float64), T, method = 'dopri5', stats = stats)
+    stats.reset()
+    summary = stats.as_dict()
+    assert summary['n_solves'] == 0 and summary['nfe_forward'] == 0
+    assert math.isnan(summary['min_dt']) and math.isnan(summary['max_dt'])
@@ -0,0 +1,60 @@
+import torch
+import torch.nn as nn
+
+from odenet import ODENet, SparseLinear
+
+
+def sparse_copy_of_random_linear():
+    linear = nn.Linear(7, 5).double()
+    with torch.no_grad():
+        linear.weight.mul_(torch.rand(5, 7, dtype = torch.float64) < 0.4)
+    return linear, SparseLinear.from_linear(linear)
+
+
+def test_matches_dense_linear():
+    linear, sparse = sparse_copy_of_random_linear()
+    assert sparse.values.numel() == int((linear.weight != 0).sum())
+    torch.testing.assert_close(sparse.weight, linear.weight)
+    input = torch.randn(3, 1, 7, dtype = torch.float64, requires_grad = True)
+    weights = torch.randn(3, 1, 5, dtype = torch.float64)
+    dense_output = linear(input)
+    sparse_output = sparse(input)
+    torch.testing.assert_close(sparse_output, dense_output)
+
+    grad_input, grad_weight, grad_bias = torch.autograd.grad((dense_output*weights).sum(), (input, linear.weight, linear.bias))
+    sparse_grad_input, grad_values, sparse_grad_bias = torch.autograd.grad((sparse_output*weights).sum(), (input, sparse.values, sparse.bias))
+    torch.testing.assert_close(sparse_grad_input, grad_input)
+    torch.testing.assert_close(sparse_grad_bias, grad_bias)
+    # Only the stored values get gradients, those of the dense weight on its support
+    torch.testing.assert_close(grad_values, grad_weight[sparse.row_indices, sparse.col_indices])
+
+
+def test_rewire_moves_weights_and_resets_their_optimizer_state():
+    _, sparse = sparse_copy_of_random_linear()
+    opt = torch.optim.Adam(sparse.parameters())
+    sparse(torch.randn(4, 7, dtype = torch.float64)).sum().backward()
+    opt.step()
+    nnz = sparse.values.numel()
+    smallest = sparse.values.abs().min().item()
+    support_before = set(zip(sparse.row_indices.tolist(), sparse.col_indices.tolist()))
+
+    n_moved = sparse.rewire(0.25, opt, torch.Generator().manual_seed(0))
+    support_after = set(zip(sparse.row_indices.tolist(), sparse.col_indices.tolist()))
+    assert n_moved == int(0.25*nnz) and sparse.values.numel() == nnz
+    assert len(support_after - support_before) == n_moved
+    assert (sparse.values == 0).sum() >= n_moved
+    assert (sparse.values.abs() >= smallest).sum() >= nnz - n_moved
+    # The regrown weights start from scratch in Adam, and the layer stays consistent with its CSR layout
+    assert (opt.state[sparse.values]['exp_avg'][sparse.values == 0] == 0).all()
+    torch.testing.assert_close(sparse(torch.eye(7, dtype = torch.float64)) - sparse.bias, sparse.weight.t())
+
+
+def test_sparse_odenet_matches_its_dense_weights():
+    torch.manual_seed(1)
+    dense = ODENet('cpu', 6, neurons = 8).double()
+    torch.manual_seed(1)
+    sparse = ODENet('cpu', 6, neurons = 8, sparse = True).double()
+    assert sparse.sparse and not dense.sparse
+    y = torch.rand(4, 1, 6, dtype = torch.float64)
+    torch.testing.assert_close(sparse(0., y), dense(0., y))
+    assert sum(param.numel() for param in sparse.parameters()) < sum(param.numel() for param in dense.parameters())/5
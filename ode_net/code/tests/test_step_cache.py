@@ -0,0 +1,49 @@
+import pytest
+import torch
+
+from torchdiffeq import odeint, odeint_adjoint, SolverStats, StepSizeCache
+
+
+def decay(t, y):
+    return -1.5*y
+
+
+def solve(y0, t, method, step_cache):
+    stats = SolverStats(timing = False)
+    solution = odeint(decay, y0, t, method = method, rtol = 1e-8, atol = 1e-10, stats = stats,
+                      options = {'step_cache': step_cache})
+    return solution[1], stats.nfe['forward']
+
+
+@pytest.mark.parametrize('method', ['dopri5', 'batched_dopri5'])
+def test_repeated_solve_skips_initial_step_selection(method):
+    y0 = torch.rand(2, 1, 3, dtype = torch.float64)
+    t = torch.tensor([0., 1.], dtype = torch.float64)
+    step_cache = StepSizeCache()
+    first, first_nfe = solve(y0, t, method, step_cache)
+    second, second_nfe = solve(y0, t, method, step_cache)
+    assert (step_cache.misses, step_cache.hits) == (1, 1)
+    assert second_nfe < first_nfe
+    torch.testing.assert_close(second, first, rtol = 1e-6, atol = 1e-9)
+    torch.testing.assert_close(second, y0*torch.exp(torch.tensor(-1.5, dtype = torch.float64)), rtol = 1e-6, atol = 1e-9)
+
+
+def test_intervals_are_bucketed_by_length():
+    step_cache = StepSizeCache(resolution = 0.1)
+    step_cache.update(0., 1., 0.05)
+    assert step_cache.lookup(3., 4.02) == 0.05
+    assert step_cache.lookup(0., 2.) is None
+    assert step_cache.lookup(1., 1.) is None
+    assert (step_cache.hits, step_cache.misses) == (1, 2)
+    step_cache.clear()
+    assert step_cache.lookup(0., 1.) is None and step_cache.hits == 0
+
+
+def test_adjoint_pass_does_not_share_the_cache():
+    step_cache = StepSizeCache()
+    rate = torch.tensor(1.5, dtype = torch.float64, requires_grad = True)
+    func = lambda t, y: -rate*y
+    t = torch.tensor([0., 1.], dtype = torch.float64)
+    odeint_adjoint(func, torch.ones(3, dtype = torch.float64), t, method = 'dopri5', adjoint_params = (rate,),
+                   options = {'step_cache': step_cache})[1].sum().backward()
+    assert step_cache.hits + step_cache.misses == 1
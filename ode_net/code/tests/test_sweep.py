@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+import sweep_inte
+from sweep_inte import (_init_worker, _poor_trial, dataset_key, expand_search, load_shared_datasets, load_shared_prior,
+                        run_trial, trial_settings)
+
+CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config_inte.cfg')
+# A trial small enough to train in a test
+TINY = {'neurons_per_layer': 4, 'epochs': 2, 'prior_K': 10, 'prior_batch_size': 10, 'batch_type': 'single', 'batch_size': 8,
+        'val_split': 0.25, 'noise': 0, 'viz': False}
+
+
+def test_grid_search():
+    trials = expand_search({'search': 'grid', 'params': {'init_lr': [1e-3, 1e-2], 'neurons_per_layer': [10, 20, 30]}}, None)
+    assert len(trials) == 6
+    assert {'init_lr': 1e-2, 'neurons_per_layer': 20} in trials
+    assert expand_search({'params': {'init_lr': [1e-3]}}, None) == [{'init_lr': 1e-3}]
+    with pytest.raises(ValueError):
+        expand_search({'search': 'grid', 'params': {'init_lr': {'uniform': [0, 1]}}}, None)
+    with pytest.raises(ValueError):
+        expand_search({'search': 'bayesian', 'params': {}}, None)
+
+
+def test_random_search():
+    spec = {'search': 'random', 'n_trials': 50,
+            'params': {'init_lr': {'loguniform': [1e-4, 1e-1]}, 'loss_lambda': {'uniform': [0.5, 1]},
+                       'neurons_per_layer': {'randint': [10, 12]}, 'optimizer': ['adam', 'sgd']}}
+    trials = expand_search(spec, np.random.default_rng(0))
+    assert trials == expand_search(spec, np.random.default_rng(0))
+    assert len(trials) == 50
+    assert all(1e-4 <= trial['init_lr'] <= 1e-1 and 0.5 <= trial['loss_lambda'] <= 1 for trial in trials)
+    assert {trial['neurons_per_layer'] for trial in trials} == {10, 11, 12}
+    assert {trial['optimizer'] for trial in trials} == {'adam', 'sgd'}
+    with pytest.raises(ValueError):
+        expand_search({'search': 'random', 'n_trials': 1, 'params': {'init_lr': {'normal': [0, 1]}}}, np.random.default_rng(0))
+
+
+def test_trial_settings():
+    settings = trial_settings(CONFIG, {'init_lr': 0.05, 'neurons_per_layer': 7, 'loss_lambda': 0.5})
+    assert (settings['init_lr'], settings['neurons_per_layer'], settings['loss_lambda']) == (0.05, 7, 0.5)
+    assert trial_settings(CONFIG, {})['loss_lambda'] == 1
+    with pytest.raises(ValueError):
+        trial_settings(CONFIG, {'learning_rate': 0.05})
+
+
+def test_poor_trial():
+    history = {0: [1., 0.5], 1: [2., 0.9], 2: [3., 0.8], 3: [0.1]}
+    assert _poor_trial(history, 3, 2, 1., min_trials = 3)
+    assert not _poor_trial(history, 3, 2, 0.7, min_trials = 3)
+    # Trial 3 has not reached epoch 2, so only two others have
+    assert not _poor_trial(history, 0, 2, 10., min_trials = 3)
+
+
+@pytest.fixture
+def datasets(data_csv, tmp_path):
+    ''' The shared datasets of two trials that differ only in their learning rate, with a 3 gene prior matrix '''
+    np.savetxt(str(tmp_path/'prior_0.0.csv'), np.array([[0, 1, 0], [-0.5, 0, 0], [0, 0, 2]]), delimiter = ',')
+    all_settings = [trial_settings(CONFIG, dict(TINY, init_lr = lr)) for lr in (1e-3, 1e-2)]
+    datasets = load_shared_datasets(all_settings, data_csv, None, str(tmp_path/'prior_{}.csv'), str(tmp_path/'shared'))
+    return all_settings, datasets
+
+
+def test_datasets_are_loaded_once(datasets, tmp_path):
+    all_settings, datasets = datasets
+    assert list(datasets) == [dataset_key(all_settings[0])]
+    store_dir, test_store_dir, prior_dir = datasets[dataset_key(all_settings[0])]
+    assert os.path.isdir(store_dir)
+    assert test_store_dir is None
+    # The workers map the prior from the shared directory instead of receiving a copy
+    assert prior_dir.startswith(str(tmp_path/'shared'))
+    prior_mat = load_shared_prior(prior_dir)
+    assert prior_mat.is_sparse and prior_mat.dtype == torch.float32
+    torch.testing.assert_close(prior_mat.to_dense(), torch.tensor([[0, 1, 0], [-0.5, 0, 0], [0, 0, 2]]))
+
+
+def test_trials_run_in_a_worker(datasets, tmp_path, monkeypatch, request):
+    all_settings, datasets = datasets
+    monkeypatch.setattr(sweep_inte, '_worker', {})
+    request.addfinalizer(lambda threads = torch.get_num_threads(): torch.set_num_threads(threads))
+    _init_worker(1, datasets, {})
+    trial_dir = str(tmp_path/'trial_0')
+    os.makedirs(trial_dir)
+    result = run_trial((0, {'init_lr': 1e-3}, all_settings[0], 1, 0, 3, trial_dir))
+    assert result['status'] == 'completed', result['error']
+    assert result['epochs'] == 2 and result['init_lr'] == 1e-3
+    assert 1 <= result['best_epoch'] <= 2
+    assert np.isfinite(result['best_val_loss']) and np.isfinite(result['min_train_loss'])
+    assert len(sweep_inte._worker['history'][0]) == 2
+    losses = np.loadtxt(os.path.join(trial_dir, 'losses.csv'), delimiter = ',', skiprows = 1)
+    assert losses.shape == (2, 3)
+    assert result['best_val_loss'] == losses[:, 1].min()
+
+    # A trial that cannot train is reported, not raised
+    failed = run_trial((1, {}, dict(all_settings[1], val_split = 0), 1, 0, 3, trial_dir))
+    assert failed['status'] == 'failed'
+    assert 'ValueError' in failed['error']
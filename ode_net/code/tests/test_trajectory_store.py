@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+
+from csvreader import readcsv_store, writecsv
+from trajectory_store import TrajectoryStore
+
+
+def random_lists(lengths = (3, 5, 2), dim = 4):
+    data_np = [np.random.rand(length, 1, dim).astype(np.float32) for length in lengths]
+    data_np_0noise = [np.random.rand(length, 1, dim).astype(np.float32) for length in lengths]
+    time_np = [np.arange(length, dtype = np.float64) for length in lengths]
+    return data_np, data_np_0noise, time_np
+
+
+def test_lists_are_views_onto_one_array():
+    data_np, data_np_0noise, time_np = random_lists()
+    store = TrajectoryStore.from_lists(data_np, data_np_0noise, time_np)
+    assert store.values.shape == (10, 4) and store.ntraj == 3
+    read_data, data_pt, read_t, t_pt, read_0noise, _ = store.as_lists('cpu')
+    for i in range(3):
+        np.testing.assert_array_equal(read_data[i], data_np[i])
+        np.testing.assert_array_equal(read_0noise[i], data_np_0noise[i])
+        np.testing.assert_array_equal(read_t[i], time_np[i])
+        assert data_pt[i].dtype == torch.float32 and t_pt[i].dtype == torch.float32
+    store.values[3, 0] = -1
+    assert read_data[1][0, 0, 0] == -1 and data_pt[1][0, 0, 0] == -1
+    np.testing.assert_array_equal(store.flat_rows([[1, 2], [2, 0]]), [5, 8])
+
+
+def test_memory_mapped_store_is_read_back_copy_on_write(tmp_path):
+    data_np, data_np_0noise, time_np = random_lists()
+    lengths = [len(traj) for traj in data_np]
+    store = TrajectoryStore.allocate(4, lengths, str(tmp_path))
+    reference = TrajectoryStore.from_lists(data_np, data_np_0noise, time_np)
+    store.values[:] = reference.values
+    store.values_0noise[:] = reference.values_0noise
+    store.times[:] = reference.times
+    store.flush()
+
+    loaded = TrajectoryStore.load(str(tmp_path))
+    assert isinstance(loaded.values, np.memmap)
+    for name in ('values', 'values_0noise', 'times', 'offsets'):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(reference, name))
+    loaded.values[0, 0] = 123
+    np.testing.assert_array_equal(TrajectoryStore.load(str(tmp_path)).values, reference.values)
+
+
+def test_shared_noiseless_values_split_on_normalization():
+    data_np, _, time_np = random_lists()
+    store = TrajectoryStore.from_lists(data_np, None, time_np)
+    assert store.values is store.values_0noise
+    noiseless = store.values.copy()
+    store.divide_values(2)
+    np.testing.assert_array_equal(store.values_0noise, noiseless)
+    np.testing.assert_allclose(store.values, noiseless/2)
+
+
+def test_csv_store_on_disk_matches_in_memory(tmp_path):
+    fp = str(tmp_path/'data.csv')
+    data_np, _, time_np = random_lists()
+    writecsv(fp, 4, 3, data_np, time_np)
+    in_memory = readcsv_store(fp, 0, 1, 'linear', use_cache = False)
+    on_disk = readcsv_store(fp, 0, 1, 'linear', use_cache = False, store_dir = str(tmp_path/'store'))
+    assert isinstance(on_disk.values, np.memmap)
+    np.testing.assert_array_equal(on_disk.values, in_memory.values)
+    np.testing.assert_array_equal(on_disk.times, in_memory.times)
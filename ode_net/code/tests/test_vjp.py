@@ -0,0 +1,58 @@
+import torch
+
+from odenet import ODENet
+from pairwise_solve import PairwiseRescaledODE, solve_pairs
+from torchdiffeq import odeint_adjoint
+
+
+def autograd_vjp(func, t, y, v):
+    y = y.clone().requires_grad_()
+    final = func(t, y)
+    grads = torch.autograd.grad(final, (y,) + tuple(func.parameters()), v)
+    return final, grads[0], grads[1:]
+
+
+def assert_vjp_matches_autograd(func, t, y, v):
+    final, v_y, v_params = func.vjp(t, y, v)
+    expected_final, expected_v_y, expected_v_params = autograd_vjp(func, t, y, v)
+    torch.testing.assert_close(final, expected_final, rtol = 1e-12, atol = 1e-12)
+    torch.testing.assert_close(v_y, expected_v_y, rtol = 1e-10, atol = 1e-12)
+    assert len(v_params) == len(expected_v_params)
+    for v_param, expected in zip(v_params, expected_v_params):
+        torch.testing.assert_close(v_param, expected, rtol = 1e-10, atol = 1e-12)
+
+
+def test_odenet_vjp_matches_autograd(odenet):
+    with torch.no_grad():
+        # Some decay rates below zero, where relu cuts their gradient
+        odenet.gene_multipliers[0, :2] = -0.5
+    y = torch.rand(4, 1, 6, dtype = torch.float64)
+    assert_vjp_matches_autograd(odenet, 0., y, torch.randn_like(y))
+
+
+def test_rescaled_vjp_matches_autograd(odenet, pairs):
+    y0, t_pairs = pairs
+    rescaled = PairwiseRescaledODE.from_pairs(odenet, t_pairs, y0.dim())
+    assert rescaled.has_analytic_vjp
+    assert_vjp_matches_autograd(rescaled, torch.tensor(0.3, dtype = torch.float64), y0, torch.randn_like(y0))
+
+
+def test_adjoint_gradients_unchanged(odenet, pairs, monkeypatch):
+    y0, t_pairs = pairs
+    vjp_calls = []
+    vjp = ODENet.vjp
+    monkeypatch.setattr(ODENet, 'vjp', lambda self, t, y, v: vjp_calls.append(1) or vjp(self, t, y, v))
+    grads = []
+    for analytic in (True, False):
+        monkeypatch.setattr(ODENet, 'has_analytic_vjp', property(lambda self: analytic))
+        odenet.zero_grad()
+        solve_pairs(odeint_adjoint, odenet, y0, t_pairs, 'dopri5', rtol = 1e-9, atol = 1e-11).pow(2).sum().backward()
+        grads.append([param.grad.clone() for param in odenet.parameters()])
+        assert bool(vjp_calls) == analytic
+        vjp_calls.clear()
+    for analytic, autograd in zip(*grads):
+        torch.testing.assert_close(analytic, autograd, rtol = 1e-7, atol = 1e-10)
+
+
+def test_sparse_model_has_no_analytic_vjp():
+    assert not ODENet('cpu', 6, neurons = 8, sparse = True).has_analytic_vjp
@@ -1,3 +1,6 @@
 from ._impl import odeint
 from ._impl import odeint_adjoint
+from ._impl import supports_checkpoint_adjoint
+from ._impl import SolverStats
+from ._impl import StepSizeCache
 __version__ = "0.1.1"
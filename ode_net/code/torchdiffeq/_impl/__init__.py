@@ -1,2 +1,4 @@
 from .odeint import odeint
-from .adjoint import odeint_adjoint
+from .adjoint import odeint_adjoint, supports_checkpoint_adjoint
+from .stats import SolverStats
+from .step_cache import StepSizeCache
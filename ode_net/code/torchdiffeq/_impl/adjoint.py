@@ -2,6 +2,19 @@ import torch
 import torch.nn as nn
 from .odeint import SOLVERS, odeint
 from .misc import _check_inputs, _flat_to_shape, _rms_norm, _mixed_linf_rms_norm, _wrap_norm
+from .checkpoint_adjoint import CHECKPOINT_SOLVERS, OdeintCheckpointAdjointMethod
+from .stats import _InstrumentedFunc
+
+# Methods that rely on structure of `func` which the augmented adjoint dynamics do not have, and the method their
+# adjoint pass uses instead when no `adjoint_method` is given.
+ADJOINT_FALLBACKS = {
+    'rosenbrock23': 'dopri5',
+}
+
+
+def supports_checkpoint_adjoint(method):
+    """Whether `odeint_adjoint` accepts `adjoint_mode='checkpoint'` for `method` (adaptive Runge-Kutta methods only)."""
+    return method in SOLVERS and issubclass(SOLVERS[method], CHECKPOINT_SOLVERS)
 
 #adjoint_forward_calls = 0
 #adjoint_backward_calls = 0
@@ -10,7 +23,7 @@ class OdeintAdjointMethod(torch.autograd.Function):
     
     @staticmethod
     def forward(ctx, shapes, func, y0, t, rtol, atol, method, options, adjoint_rtol, adjoint_atol, adjoint_method,
-                adjoint_options, t_requires_grad, *adjoint_params):
+                adjoint_options, t_requires_grad, stats, *adjoint_params):
         #torch.set_num_interop_threads(36)
         #torch.set_num_threads(1) #USING ALL POSSIBLE THREADS!
         #global adjoint_forward_calls
@@ -23,9 +36,10 @@ class OdeintAdjointMethod(torch.autograd.Function):
         ctx.adjoint_method = adjoint_method
         ctx.adjoint_options = adjoint_options
         ctx.t_requires_grad = t_requires_grad
+        ctx.stats = stats
 
         with torch.no_grad():
-            y = odeint(func, y0, t, rtol=rtol, atol=atol, method=method, options=options)
+            y = odeint(func, y0, t, rtol=rtol, atol=atol, method=method, options=options, stats=stats)
         ctx.save_for_backward(t, y, *adjoint_params)
         return y
 
@@ -44,6 +58,7 @@ class OdeintAdjointMethod(torch.autograd.Function):
             adjoint_method = ctx.adjoint_method
             adjoint_options = ctx.adjoint_options
             t_requires_grad = ctx.t_requires_grad
+            stats = ctx.stats
 
             t, y, *adjoint_params = ctx.saved_tensors
             adjoint_params = tuple(adjoint_params)
@@ -90,12 +105,26 @@ class OdeintAdjointMethod(torch.autograd.Function):
             #    Set up backward ODE func    #
             ##################################
 
+            # If func provides a closed-form vector-Jacobian product (`func.vjp(t, y, v)` returning `(func(t, y),
+            # v^T df/dy, v^T df/dparams)` with the parameter terms ordered like `func.parameters()`), use it rather
+            # than building an autograd graph at every stage. It does not provide dL/dt.
+            analytic_vjp = getattr(func, 'has_analytic_vjp', False) and not t_requires_grad
+            if analytic_vjp:
+                func_param_index = {id(param): i for i, param in enumerate(func.parameters())}
+                analytic_vjp = all(id(param) in func_param_index for param in adjoint_params)
+
             # TODO: use a nn.Module and call odeint_adjoint to implement higher order derivatives.
             def augmented_dynamics(t, y_aug):
                 # Dynamics of the original system augmented with
                 # the adjoint wrt y, and an integrator wrt t and args.
                 y = y_aug[1]
                 adj_y = y_aug[2]
+
+                if analytic_vjp:
+                    func_eval, vjp_y, func_vjp_params = func.vjp(t, y, -adj_y)
+                    vjp_params = [func_vjp_params[func_param_index[id(param)]] for param in adjoint_params]
+                    return (torch.zeros_like(t), func_eval, vjp_y, *vjp_params)
+
                 # ignore gradients wrt time and parameters
 
                 with torch.enable_grad():
@@ -134,6 +163,8 @@ class OdeintAdjointMethod(torch.autograd.Function):
                 time_vjps = torch.empty(len(t), dtype=t.dtype, device=t.device)
             else:
                 time_vjps = None
+            if stats is not None:
+                stats.phase = 'backward'
             for i in range(len(t) - 1, 0, -1):
                 if t_requires_grad:
                     # Compute the effect of moving the current time measurement point.
@@ -147,11 +178,13 @@ class OdeintAdjointMethod(torch.autograd.Function):
                 aug_state = odeint(
                     augmented_dynamics, tuple(aug_state),
                     t[i - 1:i + 1].flip(0),
-                    rtol=adjoint_rtol, atol=adjoint_atol, method=adjoint_method, options=adjoint_options
+                    rtol=adjoint_rtol, atol=adjoint_atol, method=adjoint_method, options=adjoint_options, stats=stats
                 )
                 aug_state = [a[1] for a in aug_state]  # extract just the t[i - 1] value
                 aug_state[1] = y[i - 1]  # update to use our forward-pass estimate of the state
                 aug_state[2] += grad_y[i - 1]  # update any gradients wrt state at this time point
+            if stats is not None:
+                stats.phase = 'forward'
 
             if t_requires_grad:
                 time_vjps[0] = aug_state[0]
@@ -159,11 +192,23 @@ class OdeintAdjointMethod(torch.autograd.Function):
             adj_y = aug_state[2]
             adj_params = aug_state[3:]
 
-        return (None, None, adj_y, time_vjps, None, None, None, None, None, None, None, None, None, *adj_params)
+        return (None, None, adj_y, time_vjps, None, None, None, None, None, None, None, None, None, None, *adj_params)
 
 
 def odeint_adjoint(func, y0, t, rtol=1e-7, atol=1e-9, method=None, options=None, adjoint_rtol=None, adjoint_atol=None,
-                   adjoint_method=None, adjoint_options=None, adjoint_params=None):
+                   adjoint_method=None, adjoint_options=None, adjoint_params=None, stats=None, adjoint_mode='continuous',
+                   checkpoint_budget=None):
+    """Like `odeint`, but computes gradients with an adjoint method instead of backpropagating through the solver.
+
+    With `adjoint_mode='continuous'` (the default) the adjoint ODE is solved backwards in time together with the state
+    `y`, using `adjoint_rtol`, `adjoint_atol`, `adjoint_method` and `adjoint_options`.
+
+    With `adjoint_mode='checkpoint'` the forward pass stores the state at accepted step boundaries, at most
+    `checkpoint_budget` of them (all of them if None; the spacing doubles whenever the budget is exceeded), and the
+    backward pass propagates the adjoint through the recorded steps between checkpoints instead of re-integrating `y`
+    backwards. This needs an adaptive Runge-Kutta `method` (e.g. 'dopri5' or 'batched_dopri5'); the `adjoint_*`
+    solver arguments are ignored and gradients with respect to `t` are not supported.
+    """
 
     # We need this in order to access the variables inside this module,
     # since we have no other way of getting variables along the execution path.
@@ -178,9 +223,10 @@ def odeint_adjoint(func, y0, t, rtol=1e-7, atol=1e-9, method=None, options=None,
     if adjoint_atol is None:
         adjoint_atol = atol
     if adjoint_method is None:
-        adjoint_method = method
+        adjoint_method = ADJOINT_FALLBACKS.get(method, method)
     if adjoint_options is None:
-        adjoint_options = {k: v for k, v in options.items() if k != "norm"} if options is not None else {}
+        # The forward pass's step size cache does not describe the adjoint dynamics, so it is not shared either.
+        adjoint_options = {k: v for k, v in options.items() if k not in ("norm", "step_cache")} if options is not None else {}
     if adjoint_params is None:
         adjoint_params = tuple(find_parameters(func))
     else:
@@ -192,12 +238,27 @@ def odeint_adjoint(func, y0, t, rtol=1e-7, atol=1e-9, method=None, options=None,
     # Normalise to non-tupled input
     shapes, func, y0, t, rtol, atol, method, options = _check_inputs(func, y0, t, rtol, atol, method, options, SOLVERS)
 
+    if adjoint_mode == 'checkpoint':
+        if not supports_checkpoint_adjoint(method):
+            raise ValueError('adjoint_mode="checkpoint" requires an adaptive Runge-Kutta method, got "{}".'.format(method))
+        if t.requires_grad:
+            raise ValueError('adjoint_mode="checkpoint" does not support gradients with respect to `t`.')
+        if stats is not None:
+            func = _InstrumentedFunc(func, stats)
+        solver = SOLVERS[method](func=func, y0=y0, rtol=rtol, atol=atol, **options)
+        solution = OdeintCheckpointAdjointMethod.apply(shapes, solver, y0, t, checkpoint_budget, stats, *adjoint_params)
+        if shapes is not None:
+            solution = _flat_to_shape(solution, (len(t),), shapes)
+        return solution
+    elif adjoint_mode != 'continuous':
+        raise ValueError('Invalid adjoint_mode "{}". Must be one of {{"continuous", "checkpoint"}}.'.format(adjoint_mode))
+
     if "norm" in options and "norm" not in adjoint_options:
         adjoint_shapes = [torch.Size(()), y0.shape, y0.shape] + [torch.Size([sum(param.numel() for param in adjoint_params)])]
         adjoint_options["norm"] = _wrap_norm([_rms_norm, options["norm"], options["norm"]], adjoint_shapes)
 
     solution = OdeintAdjointMethod.apply(shapes, func, y0, t, rtol, atol, method, options, adjoint_rtol, adjoint_atol,
-                                         adjoint_method, adjoint_options, t.requires_grad, *adjoint_params)
+                                         adjoint_method, adjoint_options, t.requires_grad, stats, *adjoint_params)
 
     if shapes is not None:
         solution = _flat_to_shape(solution, (len(t),), shapes)
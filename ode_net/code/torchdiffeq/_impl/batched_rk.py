@@ -0,0 +1,268 @@
+import collections
+import torch
+from .dopri5 import _DORMAND_PRINCE_SHAMPINE_TABLEAU, DPS_C_MID
+from .interp import _interp_fit
+from .rk_common import _ButcherTableau, _UncheckedAssign
+from .solvers import AdaptiveStepsizeODESolver
+
+
+_BatchedRungeKuttaState = collections.namedtuple('_BatchedRungeKuttaState', 'y1, f1, t0, t1, dt, interp_coeff')
+# Saved state of the batched Runge Kutta solver. Identical to `_RungeKuttaState`, except that every time-like
+# attribute holds one value per batch row.
+#
+# Attributes:
+#     y1: Tensor of shape (batch, ...) giving the state at the end of each row's last accepted step.
+#     f1: Tensor giving the derivative at the end of each row's last accepted step.
+#     t0: float64 Tensor of shape (batch,) giving the start of each row's last accepted step.
+#     t1: float64 Tensor of shape (batch,) giving the end of each row's last accepted step.
+#     dt: float64 Tensor of shape (batch,) giving each row's size for its next step.
+#     interp_coeff: list of Tensors giving per-row coefficients for polynomial interpolation between `t0` and `t1`.
+
+
+def _rows(x, like):
+    """Reshape a per-row Tensor of shape (batch,) so that it broadcasts against `like` of shape (batch, ...)."""
+    return x.view(-1, *([1] * (like.dim() - 1)))
+
+
+def _row_rms_norm(tensor):
+    return tensor.pow(2).flatten(1).mean(1).sqrt()
+
+
+def _batched_runge_kutta_step(func, y0, f0, t0, dt, tableau):
+    """Take one Runge-Kutta step per batch row, each row with its own `t0` and `dt`.
+
+    Same as `_runge_kutta_step`, except that `t0` and `dt` are float64 Tensors of shape (batch,).
+    """
+    t0_ = _rows(t0.type_as(y0), y0)
+    dt_ = _rows(dt.type_as(y0), y0)
+
+    k = torch.empty(*f0.shape, len(tableau.alpha) + 1, dtype=y0.dtype, device=y0.device)
+    k = _UncheckedAssign.apply(k, f0, (..., 0))
+    for i, (alpha_i, beta_i) in enumerate(zip(tableau.alpha, tableau.beta)):
+        ti = t0_ + alpha_i * dt_
+        yi = y0 + dt_ * k[..., :i + 1].matmul(beta_i)
+        f = func(ti, yi)
+        k = _UncheckedAssign.apply(k, f, (..., i + 1))
+
+    if not (tableau.c_sol[-1] == 0 and (tableau.c_sol[:-1] == tableau.beta[-1]).all()):
+        # This property (true for Dormand-Prince) lets us save a few FLOPs.
+        yi = y0 + dt_ * k.matmul(tableau.c_sol)
+
+    y1 = yi
+    f1 = k[..., -1]
+    y1_error = dt_ * k.matmul(tableau.c_error)
+    return y1, f1, y1_error, k
+
+
+class BatchedRKAdaptiveStepsizeODESolver(AdaptiveStepsizeODESolver):
+    """Adaptive Runge-Kutta solver with independent step size control for every row of a batched state.
+
+    The first dimension of `y0` is treated as the batch dimension and the rows are assumed not to interact, which
+    holds for ODENet and for `pairwise_solve.PairwiseRescaledODE`. Every row keeps its own time, step size and
+    accept/reject decision, so a single stiff row no longer forces the whole batch onto tiny steps. Rows that have
+    already reached the next requested output time are masked out of further `func` evaluations.
+
+    `func` is called as `func(t, y)` where `y` holds only the rows that are still integrating and `t` holds one
+    time per row, shaped to broadcast against `y`. If `func` has a `select_rows(index)` method it is used to obtain
+    a version of `func` restricted to those rows (e.g. for per-row time rescaling).
+
+    A one-dimensional `y0` (e.g. the flattened augmented state of the adjoint pass) is integrated as a single row
+    using the `norm` option, so this solver can also be used as `adjoint_method`.
+    """
+    order: int
+    tableau: _ButcherTableau
+    mid: torch.Tensor
+    cache_interval = None  # interval whose first accepted step still has to be stored in `step_cache`
+
+    def __init__(self, func, y0, rtol, atol, first_step=None, safety=0.9, ifactor=10.0, dfactor=0.2,
+                 max_num_steps=2 ** 31 - 1, dtype=torch.float64, step_cache=None, **kwargs):
+        super(BatchedRKAdaptiveStepsizeODESolver, self).__init__(dtype=dtype, y0=y0, **kwargs)
+
+        dtype = torch.promote_types(dtype, y0.dtype)
+        device = y0.device
+
+        self.unbatched = y0.dim() < 2
+        self.base_func = func
+        self.rtol = torch.as_tensor(rtol, dtype=dtype, device=device)
+        self.atol = torch.as_tensor(atol, dtype=dtype, device=device)
+        self.first_step = None if first_step is None else torch.as_tensor(first_step, dtype=dtype, device=device)
+        self.safety = torch.as_tensor(safety, dtype=dtype, device=device)
+        self.ifactor = torch.as_tensor(ifactor, dtype=dtype, device=device)
+        self.dfactor = torch.as_tensor(dfactor, dtype=dtype, device=device)
+        self.max_num_steps = max_num_steps
+        self.dtype = dtype
+        self.step_cache = step_cache
+
+        # Copy from class to instance to set device
+        self.tableau = _ButcherTableau(alpha=self.tableau.alpha.to(device=device, dtype=y0.dtype),
+                                       beta=[b.to(device=device, dtype=y0.dtype) for b in self.tableau.beta],
+                                       c_sol=self.tableau.c_sol.to(device=device, dtype=y0.dtype),
+                                       c_error=self.tableau.c_error.to(device=device, dtype=y0.dtype))
+        self.mid = self.mid.to(device=device, dtype=y0.dtype)
+
+    def integrate(self, t):
+        if not self.unbatched:
+            return super(BatchedRKAdaptiveStepsizeODESolver, self).integrate(t)
+        # Integrate a flat state as a single row and drop the row dimension again.
+        y0 = self.y0
+        self.y0 = y0.unsqueeze(0)
+        try:
+            solution = super(BatchedRKAdaptiveStepsizeODESolver, self).integrate(t)
+        finally:
+            self.y0 = y0
+        return solution[:, 0]
+
+    def _func(self, t, y, index=None):
+        """Evaluate `func` on the rows `index` (all rows if None), with one time per row."""
+        func = self.base_func
+        if self.unbatched:
+            return func(t[0].type_as(y), y[0]).unsqueeze(0)
+        if index is not None and hasattr(func, 'select_rows'):
+            func = func.select_rows(index)
+        return func(_rows(t.type_as(y), y), y)
+
+    def _norm(self, tensor):
+        if self.unbatched:
+            return self.norm(tensor[0]).reshape(1)
+        return _row_rms_norm(tensor)
+
+    def _select_initial_step(self, t0, y0, f0):
+        """Row-wise version of `_select_initial_step` (Hairer, Norsett & Wanner, Sec. II.4)."""
+        scale = self.atol + torch.abs(y0) * self.rtol
+        d0 = self._norm(y0 / scale).to(self.dtype)
+        d1 = self._norm(f0 / scale).to(self.dtype)
+
+        small = (d0 < 1e-5) | (d1 < 1e-5)
+        h0 = torch.where(small, torch.full_like(d0, 1e-6), 0.01 * d0 / d1.clamp_min(1e-15))
+
+        y1 = y0 + _rows(h0.type_as(y0), y0) * f0
+        f1 = self._func(t0 + h0, y1)
+        d2 = self._norm((f1 - f0) / scale).to(self.dtype) / h0
+
+        tiny = (d1 <= 1e-15) & (d2 <= 1e-15)
+        h1 = torch.where(tiny, torch.clamp_min(h0 * 1e-3, 1e-6),
+                         (0.01 / torch.max(d1, d2).clamp_min(1e-15)) ** (1. / float(self.order)))
+        return torch.min(100 * h0, h1)
+
+    def _before_integrate(self, t):
+        n_rows = self.y0.shape[0]
+        t0 = t[0].expand(n_rows).clone()
+        f0 = self._func(t0, self.y0)
+        cached_step = None
+        if self.first_step is None and self.step_cache is not None:
+            cached_step = self.step_cache.lookup(t[0], t[-1])
+            self.cache_interval = (t[0], t[-1])
+        if self.first_step is not None:
+            first_step = self.first_step.expand(n_rows).clone()
+        elif cached_step is not None:
+            first_step = torch.full((n_rows,), cached_step, dtype=self.dtype, device=self.y0.device)
+        else:
+            first_step = self._select_initial_step(t0, self.y0, f0)
+        self.rk_state = _BatchedRungeKuttaState(self.y0, f0, t0, t0, first_step, [self.y0] * 5)
+
+    def _advance(self, next_t):
+        """Integrate every row through `next_t`, then interpolate each row at `next_t`."""
+        n_steps = 0
+        while True:
+            active = self.rk_state.t1 < next_t
+            if not active.any():
+                break
+            assert n_steps < self.max_num_steps, 'max_num_steps exceeded ({}>={})'.format(n_steps, self.max_num_steps)
+            index = None if active.all() else active.nonzero().squeeze(1)
+            self.rk_state = self._adaptive_step(self.rk_state, index)
+            n_steps += 1
+        return self._interp_evaluate(self.rk_state, next_t)
+
+    def _adaptive_step(self, rk_state, index):
+        """Take one adaptive Runge-Kutta step on the rows `index` (all rows if None)."""
+        y1_all, f1_all, t0_all, t1_all, dt_all, coeff_all = rk_state
+        if index is None:
+            y0, f0, t_prev, t0, dt, coeff = y1_all, f1_all, t0_all, t1_all, dt_all, coeff_all
+        else:
+            y0, f0, t_prev, t0, dt = (x.index_select(0, index) for x in (y1_all, f1_all, t0_all, t1_all, dt_all))
+            coeff = [c.index_select(0, index) for c in coeff_all]
+
+        ########################################################
+        #                      Assertions                      #
+        ########################################################
+        assert (t0 + dt > t0).all(), 'underflow in dt {}'.format(dt.min().item())
+        assert torch.isfinite(y0).all(), 'non-finite values in state `y`: {}'.format(y0)
+
+        ########################################################
+        #                 Make step, row by row                #
+        ########################################################
+        func = lambda t, y: self._func(t, y, index)
+        y1, f1, y1_error, k = _batched_runge_kutta_step(func, y0, f0, t0, dt, tableau=self.tableau)
+
+        ########################################################
+        #                 Error Ratio, per row                 #
+        ########################################################
+        error_tol = self.atol + self.rtol * torch.max(y0.abs(), y1.abs())
+        error_ratio = self._norm(y1_error / error_tol).to(self.dtype)
+        accept_step = error_ratio <= 1
+        if self.stats is not None:
+            self.stats.record_steps(dt, accept_step)
+
+        ########################################################
+        #                 Update RK State rows                 #
+        ########################################################
+        accept_y = _rows(accept_step, y0)
+        new_coeff = self._interp_fit(y0, y1, k, dt)
+        y_next = torch.where(accept_y, y1, y0)
+        f_next = torch.where(accept_y, f1, f0)
+        t_prev_next = torch.where(accept_step, t0, t_prev)
+        t_next = torch.where(accept_step, t0 + dt, t0)
+        coeff_next = [torch.where(accept_y, c_new, c_old) for c_new, c_old in zip(new_coeff, coeff)]
+        dt_next = self._optimal_step_size(dt, error_ratio)
+        if self.cache_interval is not None and accept_step.any():
+            # One step size for all rows: the smallest proposal of the accepted rows, so no row starts out too coarse.
+            self.step_cache.update(*self.cache_interval, dt_next[accept_step].min().item())
+            self.cache_interval = None
+
+        if index is None:
+            return _BatchedRungeKuttaState(y_next, f_next, t_prev_next, t_next, dt_next, coeff_next)
+        return _BatchedRungeKuttaState(y1_all.index_copy(0, index, y_next),
+                                       f1_all.index_copy(0, index, f_next),
+                                       t0_all.index_copy(0, index, t_prev_next),
+                                       t1_all.index_copy(0, index, t_next),
+                                       dt_all.index_copy(0, index, dt_next),
+                                       [c.index_copy(0, index, c_next) for c, c_next in zip(coeff_all, coeff_next)])
+
+    def _optimal_step_size(self, last_step, error_ratio):
+        """Row-wise version of `_optimal_step_size`."""
+        dfactor = torch.where(error_ratio < 1, torch.ones_like(error_ratio), self.dfactor.expand_as(error_ratio))
+        exponent = 1. / float(self.order)
+        factor = torch.min(self.ifactor, torch.max(self.safety / error_ratio.clamp_min(1e-30) ** exponent, dfactor))
+        factor = torch.where(error_ratio == 0, self.ifactor.expand_as(factor), factor)
+        return last_step * factor
+
+    def _interp_fit(self, y0, y1, k, dt):
+        """Fit an interpolating polynomial per row to the results of a Runge-Kutta step."""
+        dt = _rows(dt.type_as(y0), y0)
+        y_mid = y0 + dt * k.matmul(self.mid)
+        f0 = k[..., 0]
+        f1 = k[..., -1]
+        return _interp_fit(y0, y1, y_mid, f0, f1, dt)
+
+    def _interp_evaluate(self, rk_state, t):
+        """Evaluate every row's interpolating polynomial at the common time point `t`."""
+        t0, t1 = rk_state.t0, rk_state.t1
+        assert ((t0 <= t) & (t <= t1)).all(), 'invalid interpolation, fails `t0 <= t <= t1`'
+        same = t1 == t0
+        x = torch.where(same, torch.ones_like(t1), (t - t0) / torch.where(same, torch.ones_like(t1), t1 - t0))
+        x = _rows(x.type_as(rk_state.y1), rk_state.y1)
+
+        coefficients = rk_state.interp_coeff
+        total = coefficients[0] + x * coefficients[1]
+        x_power = x
+        for coefficient in coefficients[2:]:
+            x_power = x_power * x
+            total = total + x_power * coefficient
+        # Rows that have not taken a step yet (t0 == t1 == t) are exactly at their current state.
+        return torch.where(_rows(same, total), rk_state.y1, total)
+
+
+class BatchedDopri5Solver(BatchedRKAdaptiveStepsizeODESolver):
+    order = 5
+    tableau = _DORMAND_PRINCE_SHAMPINE_TABLEAU
+    mid = DPS_C_MID
@@ -0,0 +1,198 @@
+import collections
+import torch
+from .batched_rk import BatchedRKAdaptiveStepsizeODESolver, _batched_runge_kutta_step
+from .rk_common import RKAdaptiveStepsizeODESolver, _runge_kutta_step
+from .stats import _clock
+
+
+CHECKPOINT_SOLVERS = (RKAdaptiveStepsizeODESolver, BatchedRKAdaptiveStepsizeODESolver)
+
+
+_StepRecord = collections.namedtuple('_StepRecord', 'index, t0, dt')
+# One accepted step of the forward pass.
+#
+# Attributes:
+#     index: for batched solvers, LongTensor of the rows that took this step (None if all rows did); always None
+#         otherwise.
+#     t0: float64 Tensor giving the start of the step (one value per row in `index` for batched solvers).
+#     dt: float64 Tensor giving the size of the step, in the same layout as `t0`.
+
+
+def _initial_derivative(solver, t0, y0):
+    if isinstance(solver, BatchedRKAdaptiveStepsizeODESolver):
+        return solver._func(t0.expand(y0.shape[0]), y0)
+    return solver.func(t0, y0)
+
+
+def _replay_step(solver, y0, f0, record):
+    """Recompute one accepted step from `y0` and `f0`, returning `(y1, f1)`."""
+    index, t0, dt = record
+    if not isinstance(solver, BatchedRKAdaptiveStepsizeODESolver):
+        y1, f1, _, _ = _runge_kutta_step(solver.func, y0, f0, t0, dt, tableau=solver.tableau)
+        return y1, f1
+    if index is None:
+        y1, f1, _, _ = _batched_runge_kutta_step(solver._func, y0, f0, t0, dt, tableau=solver.tableau)
+        return y1, f1
+    func = lambda t, y: solver._func(t, y, index)
+    y1, f1, _, _ = _batched_runge_kutta_step(func, y0.index_select(0, index), f0.index_select(0, index), t0, dt,
+                                             tableau=solver.tableau)
+    return y0.index_copy(0, index, y1), f0.index_copy(0, index, f1)
+
+
+def _checkpointed_integrate(solver, t, checkpoint_budget):
+    """Integrate like `solver.integrate(t)`, recording every accepted step and keeping a bounded set of checkpoints.
+
+    Steps are clipped so that they end exactly on every requested output time, which makes the output the state of an
+    accepted step rather than an interpolant and so lets the backward pass replay it exactly.
+
+    Returns:
+        Tuple `(solution, steps, output_steps, checkpoints)`: the usual solution Tensor; the list of `_StepRecord`s;
+        for each output time, the number of steps taken to reach it; and a list of `(step, y, f)` checkpoints taken
+        every `stride` steps, where `stride` doubles whenever more than `checkpoint_budget` checkpoints would be kept
+        (no limit if None).
+    """
+    batched = isinstance(solver, BatchedRKAdaptiveStepsizeODESolver)
+    t = t.to(solver.dtype)
+    solver._before_integrate(t)
+    state = solver.rk_state
+
+    steps = []
+    output_steps = [0]
+    checkpoints = [(0, state.y1, state.f1)]
+    stride = 1
+    solution = torch.empty(len(t), *state.y1.shape, dtype=state.y1.dtype, device=state.y1.device)
+    solution[0] = state.y1
+
+    for next_t in t[1:]:
+        n_steps = 0
+        while True:
+            active = state.t1 < next_t
+            if not active.any():
+                break
+            assert n_steps < solver.max_num_steps, 'max_num_steps exceeded ({}>={})'.format(n_steps,
+                                                                                            solver.max_num_steps)
+            remaining = next_t - state.t1
+            dt = torch.where(active, torch.min(state.dt, remaining), state.dt)
+            if batched:
+                index = None if active.all() else active.nonzero().squeeze(1)
+                new_state = solver._adaptive_step(state._replace(dt=dt), index)
+            else:
+                new_state = solver._adaptive_step(state._replace(dt=dt))
+            n_steps += 1
+
+            accepted = new_state.t1 > state.t1
+            # Land exactly on the output time rather than on t0 + (next_t - t0), which may round differently.
+            new_state = new_state._replace(t1=torch.where(accepted & (dt == remaining), next_t, new_state.t1))
+            if accepted.any():
+                if not batched or accepted.all():
+                    steps.append(_StepRecord(None, state.t1, dt))
+                else:
+                    accepted_index = accepted.nonzero().squeeze(1)
+                    steps.append(_StepRecord(accepted_index, state.t1[accepted_index], dt[accepted_index]))
+                if len(steps) % stride == 0:
+                    checkpoints.append((len(steps), new_state.y1, new_state.f1))
+                    if checkpoint_budget is not None and len(checkpoints) > checkpoint_budget:
+                        checkpoints = checkpoints[::2]
+                        stride *= 2
+            state = new_state
+
+        solution[len(output_steps)] = state.y1
+        output_steps.append(len(steps))
+
+    return solution, steps, output_steps, checkpoints
+
+
+class OdeintCheckpointAdjointMethod(torch.autograd.Function):
+    """Reverse-mode differentiation of an adaptive Runge-Kutta solve through checkpointed forward states.
+
+    The backward pass never integrates the state backwards in time. Instead every segment between two checkpoints is
+    re-run from its stored `(y, f)` with autograd on, over exactly the accepted steps of the forward pass, and the
+    adjoint and parameter gradients are propagated through it. Gradients are therefore those of the discrete forward
+    solution, with step sizes treated as constants.
+    """
+
+    @staticmethod
+    def forward(ctx, shapes, solver, y0, t, checkpoint_budget, stats, *adjoint_params):
+        unbatched = isinstance(solver, BatchedRKAdaptiveStepsizeODESolver) and solver.unbatched
+        if unbatched:
+            solver.y0 = y0.unsqueeze(0)
+
+        if stats is not None:
+            solver.stats = stats
+            start = _clock(stats, y0)
+        with torch.no_grad():
+            solution, steps, output_steps, checkpoints = _checkpointed_integrate(solver, t, checkpoint_budget)
+        if stats is not None:
+            stats.solve_time[stats.phase] += _clock(stats, y0) - start
+            stats.n_solves += 1
+
+        ctx.solver = solver
+        ctx.unbatched = unbatched
+        ctx.stats = stats
+        ctx.steps = steps
+        ctx.output_steps = output_steps
+        ctx.checkpoints = checkpoints
+        ctx.save_for_backward(t, *adjoint_params)
+        return solution[:, 0] if unbatched else solution
+
+    @staticmethod
+    def backward(ctx, grad_y):
+        solver = ctx.solver
+        stats = ctx.stats
+        steps = ctx.steps
+        checkpoints = ctx.checkpoints
+        t, *adjoint_params = ctx.saved_tensors
+        adjoint_params = tuple(adjoint_params)
+        if ctx.unbatched:
+            grad_y = grad_y.unsqueeze(1)
+        output_at_step = {step: i for i, step in enumerate(ctx.output_steps)}
+
+        if stats is not None:
+            stats.phase = 'backward'
+            start = _clock(stats, grad_y)
+
+        adj_y = grad_y[-1]
+        adj_f = torch.zeros_like(adj_y)
+        adj_params = [torch.zeros_like(param) for param in adjoint_params]
+        ends = [step for step, _, _ in checkpoints[1:]] + [len(steps)]
+        for (begin, y_c, f_c), end in reversed(list(zip(checkpoints, ends))):
+            if begin == end:
+                continue
+            with torch.enable_grad():
+                y_begin = y_c.detach().requires_grad_(True)
+                if begin == 0:
+                    # f at the very first step is a function of y0 as well.
+                    f_begin = _initial_derivative(solver, t[0].to(solver.dtype), y_begin)
+                    inputs = (y_begin,)
+                else:
+                    f_begin = f_c.detach().requires_grad_(True)
+                    inputs = (y_begin, f_begin)
+
+                outputs, grad_outputs = [], []
+                y, f = y_begin, f_begin
+                for step in range(begin, end):
+                    y, f = _replay_step(solver, y, f, steps[step])
+                    if step + 1 < end and step + 1 in output_at_step:
+                        outputs.append(y)
+                        grad_outputs.append(grad_y[output_at_step[step + 1]])
+                outputs.extend([y, f])
+                grad_outputs.extend([adj_y, adj_f])
+
+                vjps = torch.autograd.grad(outputs, inputs + adjoint_params, grad_outputs, allow_unused=True)
+
+            adj_y = torch.zeros_like(adj_y) if vjps[0] is None else vjps[0]
+            if begin != 0:
+                adj_f = torch.zeros_like(adj_f) if vjps[1] is None else vjps[1]
+            for i, vjp_param in enumerate(vjps[len(inputs):]):
+                if vjp_param is not None:
+                    adj_params[i] += vjp_param
+            if begin in output_at_step:
+                adj_y = adj_y + grad_y[output_at_step[begin]]
+
+        if stats is not None:
+            stats.solve_time[stats.phase] += _clock(stats, adj_y) - start
+            stats.phase = 'forward'
+
+        if ctx.unbatched:
+            adj_y = adj_y[0]
+        return (None, None, adj_y, None, None, None, *adj_params)
@@ -4,16 +4,23 @@ from .adaptive_heun import AdaptiveHeunSolver
 from .fixed_grid import Euler, Midpoint, RK4
 from .fixed_adams import AdamsBashforth, AdamsBashforthMoulton
 from .dopri8 import Dopri8Solver
+from .batched_rk import BatchedDopri5Solver
+from .etd import ETDRK4
+from .rosenbrock import Rosenbrock23Solver
 from .misc import _check_inputs, _flat_to_shape
+from .stats import _InstrumentedFunc, _timed_integrate
 
 SOLVERS = {
     'dopri8': Dopri8Solver,
     'dopri5': Dopri5Solver,
+    'batched_dopri5': BatchedDopri5Solver,
+    'rosenbrock23': Rosenbrock23Solver,
     'bosh3': Bosh3Solver,
     'adaptive_heun': AdaptiveHeunSolver,
     'euler': Euler,
     'midpoint': Midpoint,
     'rk4': RK4,
+    'etdrk4': ETDRK4,
     'explicit_adams': AdamsBashforth,
     'implicit_adams': AdamsBashforthMoulton,
     # Backward compatibility: use the same name as before
@@ -22,7 +29,7 @@ SOLVERS = {
 }
 
 
-def odeint(func, y0, t, rtol=1e-7, atol=1e-9, method=None, options=None): #atol=1e-9
+def odeint(func, y0, t, rtol=1e-7, atol=1e-9, method=None, options=None, stats=None): #atol=1e-9
     """Integrate a system of ordinary differential equations.
 
     Solves the initial value problem for a non-stiff system of first order ODEs:
@@ -49,6 +56,8 @@ def odeint(func, y0, t, rtol=1e-7, atol=1e-9, method=None, options=None): #atol=
         method: optional string indicating the integration method to use.
         options: optional dict of configuring options for the indicated integration
             method. Can only be provided if a `method` is explicitly set.
+        stats: optional `SolverStats` into which function evaluations, steps and
+            timings of this solve are accumulated.
 
     Returns:
         y: Tensor, where the first dimension corresponds to different
@@ -61,8 +70,11 @@ def odeint(func, y0, t, rtol=1e-7, atol=1e-9, method=None, options=None): #atol=
     """
     shapes, func, y0, t, rtol, atol, method, options = _check_inputs(func, y0, t, rtol, atol, method, options, SOLVERS)
 
+    if stats is not None:
+        func = _InstrumentedFunc(func, stats)
+
     solver = SOLVERS[method](func=func, y0=y0, rtol=rtol, atol=atol, **options)
-    solution = solver.integrate(t)
+    solution = _timed_integrate(solver, t, y0, stats)
 
     if shapes is not None:
         solution = _flat_to_shape(solution, (len(t),), shapes)
@@ -107,9 +107,10 @@ class RKAdaptiveStepsizeODESolver(AdaptiveStepsizeODESolver):
     order: int
     tableau: _ButcherTableau
     mid: torch.Tensor
+    cache_interval = None  # interval whose first accepted step still has to be stored in `step_cache`
 
     def __init__(self, func, y0, rtol, atol, first_step=None, safety=0.9, ifactor=10.0, dfactor=0.2,
-                 max_num_steps=2 ** 31 - 1, grid_points=None, eps=0., dtype=torch.float64, **kwargs):
+                 max_num_steps=2 ** 31 - 1, grid_points=None, eps=0., dtype=torch.float64, step_cache=None, **kwargs):
         super(RKAdaptiveStepsizeODESolver, self).__init__(dtype=dtype, y0=y0, **kwargs)
 
         # We use mixed precision. y has its original dtype (probably float32), whilst all 'time'-like objects use
@@ -129,6 +130,7 @@ class RKAdaptiveStepsizeODESolver(AdaptiveStepsizeODESolver):
         self.grid_points = grid_points
         self.eps = torch.as_tensor(eps, dtype=dtype, device=device)
         self.dtype = dtype
+        self.step_cache = step_cache
 
         # Copy from class to instance to set device
         self.tableau = _ButcherTableau(alpha=self.tableau.alpha.to(device=device, dtype=y0.dtype),
@@ -139,11 +141,17 @@ class RKAdaptiveStepsizeODESolver(AdaptiveStepsizeODESolver):
 
     def _before_integrate(self, t):
         f0 = self.func(t[0], self.y0)
-        if self.first_step is None:
+        cached_step = None
+        if self.first_step is None and self.step_cache is not None:
+            cached_step = self.step_cache.lookup(t[0], t[-1])
+            self.cache_interval = (t[0], t[-1])
+        if self.first_step is not None:
+            first_step = self.first_step
+        elif cached_step is not None:
+            first_step = torch.as_tensor(cached_step, dtype=self.dtype, device=self.y0.device)
+        else:
             first_step = _select_initial_step(self.func, t[0], self.y0, self.order - 1, self.rtol, self.atol,
                                               self.norm, f0=f0)
-        else:
-            first_step = self.first_step
         self.rk_state = _RungeKuttaState(self.y0, f0, t[0], t[0], first_step, [self.y0] * 5)
         self.next_grid_index = min(bisect.bisect(self.grid_points.tolist(), t[0]), len(self.grid_points) - 1)
 
@@ -198,6 +206,8 @@ class RKAdaptiveStepsizeODESolver(AdaptiveStepsizeODESolver):
         ########################################################
         error_ratio = _compute_error_ratio(y1_error, self.rtol, self.atol, y0, y1, self.norm)
         accept_step = error_ratio <= 1
+        if self.stats is not None:
+            self.stats.record_steps(dt, accept_step)
         # dtypes:
         # error_ratio.dtype == self.dtype
 
@@ -216,6 +226,9 @@ class RKAdaptiveStepsizeODESolver(AdaptiveStepsizeODESolver):
         f_next = f1 if accept_step else f0
         interp_coeff = self._interp_fit(y0, y1, k, dt) if accept_step else interp_coeff
         dt_next = _optimal_step_size(dt, error_ratio, self.safety, self.ifactor, self.dfactor, self.order)
+        if self.cache_interval is not None and accept_step:
+            self.step_cache.update(*self.cache_interval, dt_next.item())
+            self.cache_interval = None
         rk_state = _RungeKuttaState(y_next, f_next, t0, t_next, dt_next, interp_coeff)
         return rk_state
 
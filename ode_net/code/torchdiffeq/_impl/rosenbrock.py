@@ -0,0 +1,152 @@
+import collections
+import math
+import torch
+from .misc import _compute_error_ratio, _select_initial_step, _optimal_step_size
+from .solvers import AdaptiveStepsizeODESolver
+
+
+_ROSENBROCK_D = 1 / (2 + math.sqrt(2))
+_ROSENBROCK_E32 = 6 + math.sqrt(2)
+
+
+_RosenbrockState = collections.namedtuple('_RosenbrockState', 'y1, f1, t0, t1, dt, interp_coeff')
+# Saved state of the Rosenbrock solver, laid out like `_RungeKuttaState`.
+#
+# Attributes:
+#     y1: Tensor giving the state at the end of the last accepted step.
+#     f1: Tensor giving the derivative at the end of the last accepted step.
+#     t0: scalar float64 Tensor giving the start of the last accepted step.
+#     t1: scalar float64 Tensor giving the end of the last accepted step.
+#     dt: scalar float64 Tensor giving the size for the next step.
+#     interp_coeff: tuple `(y0, k1, k2)` of the last accepted step, for its continuous extension.
+
+
+def _structured_linear_solver(diag, u, v, gamma_dt):
+    """Return a function solving `(I - gamma_dt * J) x = b` for `J = diag(diag) + u v^T`, independently per batch row.
+
+    `diag` has the shape of the state `(..., n)` and `u`, `v` have shape `(..., n, r)`. With the Woodbury identity
+    each solve costs O(n * r) once the r x r capacitance matrix has been factorized, instead of O(n^3).
+    """
+    n = diag.shape[-1]
+    rank = u.shape[-1]
+    diag = diag.reshape(-1, n)
+    u = u.reshape(-1, n, rank)
+    v_t = v.reshape(-1, n, rank).transpose(1, 2)
+
+    # I - gamma_dt * J = A - (gamma_dt * u) v^T, with A = 1 - gamma_dt * diag diagonal.
+    a_inv = 1 / (1 - gamma_dt * diag)
+    a_inv_u = (gamma_dt * a_inv).unsqueeze(-1) * u
+    capacitance = torch.eye(rank, dtype=u.dtype, device=u.device) - v_t.matmul(a_inv_u)
+    lu, pivots = torch.linalg.lu_factor(capacitance)
+
+    def solve(b):
+        z = a_inv * b.reshape(-1, n)
+        correction = torch.linalg.lu_solve(lu, pivots, v_t.matmul(z.unsqueeze(-1)))
+        return (z + a_inv_u.matmul(correction).squeeze(-1)).reshape(b.shape)
+
+    return solve
+
+
+class Rosenbrock23Solver(AdaptiveStepsizeODESolver):
+    """Linearly implicit Rosenbrock method of order 2(3) for stiff problems (Shampine & Reichelt, 1997; `ode23s`).
+
+    Every stage solves a linear system with `I - d * dt * J`, where the Jacobian `J` of `func` at the start of the step
+    is given in structured form by `func.jacobian_structure(t, y)`. That returns `(diag, u, v)` such that
+    `J = diag(diag) + u v^T` independently for every vector along the last dimension of `y`: `diag` has the shape of
+    `y`, and `u` and `v` have shape `(*y.shape, r)`. For ODENet `diag` is the decay `-relu(gene_multipliers)` and
+    `r = 2 * neurons`, so the linear solves scale with the number of genes times the number of neurons.
+
+    `func` is assumed to be autonomous (no explicit dependence on `t`), as ODENet is.
+    """
+    order = 3  # local error of the propagated second-order solution, as used for step size control
+
+    def __init__(self, func, y0, rtol, atol, first_step=None, safety=0.8, ifactor=5.0, dfactor=0.2,
+                 max_num_steps=2 ** 31 - 1, dtype=torch.float64, step_cache=None, **kwargs):
+        super(Rosenbrock23Solver, self).__init__(dtype=dtype, y0=y0, **kwargs)
+        if not hasattr(func, 'jacobian_structure'):
+            raise ValueError('method "rosenbrock23" requires `func.jacobian_structure(t, y)`.')
+
+        dtype = torch.promote_types(dtype, y0.dtype)
+        device = y0.device
+
+        self.func = lambda t, y: func(t.type_as(y), y)
+        self.jacobian_structure = lambda t, y: func.jacobian_structure(t.type_as(y), y)
+        self.rtol = torch.as_tensor(rtol, dtype=dtype, device=device)
+        self.atol = torch.as_tensor(atol, dtype=dtype, device=device)
+        self.first_step = None if first_step is None else torch.as_tensor(first_step, dtype=dtype, device=device)
+        self.safety = torch.as_tensor(safety, dtype=dtype, device=device)
+        self.ifactor = torch.as_tensor(ifactor, dtype=dtype, device=device)
+        self.dfactor = torch.as_tensor(dfactor, dtype=dtype, device=device)
+        self.max_num_steps = max_num_steps
+        self.dtype = dtype
+        self.step_cache = step_cache
+        self.cache_interval = None
+
+    def _before_integrate(self, t):
+        f0 = self.func(t[0], self.y0)
+        cached_step = None
+        if self.first_step is None and self.step_cache is not None:
+            cached_step = self.step_cache.lookup(t[0], t[-1])
+            self.cache_interval = (t[0], t[-1])
+        if self.first_step is not None:
+            first_step = self.first_step
+        elif cached_step is not None:
+            first_step = torch.as_tensor(cached_step, dtype=self.dtype, device=self.y0.device)
+        else:
+            first_step = _select_initial_step(self.func, t[0], self.y0, self.order - 1, self.rtol, self.atol,
+                                              self.norm, f0=f0)
+        self.rk_state = _RosenbrockState(self.y0, f0, t[0], t[0], first_step, None)
+        self.jacobian = None
+
+    def _advance(self, next_t):
+        """Interpolate through the next time point, integrating as necessary."""
+        n_steps = 0
+        while next_t > self.rk_state.t1:
+            assert n_steps < self.max_num_steps, 'max_num_steps exceeded ({}>={})'.format(n_steps, self.max_num_steps)
+            self.rk_state = self._adaptive_step(self.rk_state)
+            n_steps += 1
+        return self._interp_evaluate(self.rk_state, next_t)
+
+    def _adaptive_step(self, rk_state):
+        """Take an adaptive Rosenbrock step."""
+        y0, f0, _, t0, dt, interp_coeff = rk_state
+        assert t0 + dt > t0, 'underflow in dt {}'.format(dt.item())
+        assert torch.isfinite(y0).all(), 'non-finite values in state `y`: {}'.format(y0)
+
+        # The Jacobian only depends on the start of the step, so it is kept across rejected attempts.
+        if self.jacobian is None:
+            self.jacobian = self.jacobian_structure(t0, y0)
+        dt_ = dt.type_as(y0)
+        solve = _structured_linear_solver(*self.jacobian, _ROSENBROCK_D * dt_)
+
+        k1 = solve(f0)
+        f_mid = self.func(t0 + 0.5 * dt, y0 + 0.5 * dt_ * k1)
+        k2 = solve(f_mid - k1) + k1
+        y1 = y0 + dt_ * k2
+        f1 = self.func(t0 + dt, y1)
+        k3 = solve(f1 - _ROSENBROCK_E32 * (k2 - f_mid) - 2 * (k1 - f0))
+        y1_error = dt_ / 6 * (k1 - 2 * k2 + k3)
+
+        error_ratio = _compute_error_ratio(y1_error, self.rtol, self.atol, y0, y1, self.norm)
+        accept_step = error_ratio <= 1
+        if self.stats is not None:
+            self.stats.record_steps(dt, accept_step)
+
+        dt_next = _optimal_step_size(dt, error_ratio, self.safety, self.ifactor, self.dfactor, self.order)
+        if self.cache_interval is not None and accept_step:
+            self.step_cache.update(*self.cache_interval, dt_next.item())
+            self.cache_interval = None
+        if not accept_step:
+            return _RosenbrockState(y0, f0, rk_state.t0, t0, dt_next, interp_coeff)
+        self.jacobian = None
+        return _RosenbrockState(y1, f1, t0, t0 + dt, dt_next, (y0, k1, k2))
+
+    def _interp_evaluate(self, rk_state, t):
+        """Evaluate the continuous extension of `ode23s` over the last accepted step."""
+        if t == rk_state.t1:
+            return rk_state.y1
+        y0, k1, k2 = rk_state.interp_coeff
+        dt = rk_state.t1 - rk_state.t0
+        s = ((t - rk_state.t0) / dt).type_as(y0)
+        dt = dt.type_as(y0)
+        return y0 + dt * (s * (1 - s) * k1 + s * (s - 2 * _ROSENBROCK_D) * k2) / (1 - 2 * _ROSENBROCK_D)
@@ -4,6 +4,8 @@ from .misc import _handle_unused_kwargs
 
 
 class AdaptiveStepsizeODESolver(metaclass=abc.ABCMeta):
+    stats = None  # set by `odeint` to a SolverStats when requested
+
     def __init__(self, dtype, y0, norm, **unused_kwargs):
         _handle_unused_kwargs(self, unused_kwargs)
         del unused_kwargs
@@ -32,11 +34,13 @@ class AdaptiveStepsizeODESolver(metaclass=abc.ABCMeta):
 
 class FixedGridODESolver(metaclass=abc.ABCMeta):
     order: int
+    stats = None  # set by `odeint` to a SolverStats when requested
 
     def __init__(self, func, y0, step_size=None, grid_constructor=None, **unused_kwargs):
         unused_kwargs.pop('rtol', None)
         unused_kwargs.pop('atol', None)
         unused_kwargs.pop('norm', None)
+        unused_kwargs.pop('step_cache', None)
         _handle_unused_kwargs(self, unused_kwargs)
         del unused_kwargs
 
@@ -86,6 +90,8 @@ class FixedGridODESolver(metaclass=abc.ABCMeta):
         for t0, t1 in zip(time_grid[:-1], time_grid[1:]):
             dy = self._step_func(self.func, t0, t1 - t0, y0)
             y1 = y0 + dy
+            if self.stats is not None:
+                self.stats.record_steps(t1 - t0, True)
 
             while j < len(t) and t1 >= t[j]:
                 solution[j] = self._linear_interp(t0, t1, y0, y1, t[j])
@@ -0,0 +1,124 @@
+import math
+from time import perf_counter
+import torch
+
+
+_PHASES = ('forward', 'backward')
+
+
+class SolverStats(object):
+    """Counters collected by `odeint` / `odeint_adjoint` when passed as their `stats` argument.
+
+    A single instance can be shared across many solves (e.g. all the batches of one training epoch); every solve adds
+    to the counters until `reset` is called. Evaluations made while solving the adjoint system are counted under the
+    'backward' phase, everything else under 'forward'.
+
+    Attributes:
+        nfe: dict mapping each phase to its number of function evaluations.
+        accepted_steps: dict mapping each phase to its number of accepted steps. For batched solvers every row counts
+            as one step.
+        rejected_steps: dict mapping each phase to its number of rejected steps.
+        func_time: dict mapping each phase to the wall time in seconds spent inside `func`.
+        solve_time: dict mapping each phase to the total wall time in seconds spent inside the solvers.
+        min_dt: smallest accepted step size, over all phases.
+        max_dt: largest accepted step size, over all phases.
+        n_solves: number of calls to the solvers.
+
+    With `timing=False` only the counters are collected: the times are not measured (they read as nan in `as_dict`), so
+    no GPU synchronisation is forced on every function evaluation.
+    """
+
+    def __init__(self, timing=True):
+        self.timing = timing
+        self.phase = 'forward'
+        self.reset()
+
+    def reset(self):
+        self.nfe = dict.fromkeys(_PHASES, 0)
+        self.accepted_steps = dict.fromkeys(_PHASES, 0)
+        self.rejected_steps = dict.fromkeys(_PHASES, 0)
+        self.func_time = dict.fromkeys(_PHASES, 0.)
+        self.solve_time = dict.fromkeys(_PHASES, 0.)
+        self.min_dt = math.inf
+        self.max_dt = 0.
+        self.n_solves = 0
+
+    def overhead_time(self, phase):
+        """Wall time spent in the solver outside of `func` during `phase`."""
+        return self.solve_time[phase] - self.func_time[phase]
+
+    def record_steps(self, dt, accepted):
+        """Record one step per element of `dt`, given as a scalar or per-row Tensor with a matching `accepted` mask."""
+        dt = torch.as_tensor(dt).reshape(-1)
+        accepted = torch.as_tensor(accepted, device=dt.device).reshape(-1).expand_as(dt)
+        n_accepted = int(accepted.sum())
+        self.accepted_steps[self.phase] += n_accepted
+        self.rejected_steps[self.phase] += dt.numel() - n_accepted
+        if n_accepted:
+            accepted_dt = dt[accepted].abs()
+            self.min_dt = min(self.min_dt, accepted_dt.min().item())
+            self.max_dt = max(self.max_dt, accepted_dt.max().item())
+
+    def as_dict(self):
+        """Flatten the counters into a dict of numbers, e.g. to write one row of a CSV file per epoch."""
+        summary = {'n_solves': self.n_solves}
+        for phase in _PHASES:
+            summary['nfe_' + phase] = self.nfe[phase]
+            summary['accepted_steps_' + phase] = self.accepted_steps[phase]
+            summary['rejected_steps_' + phase] = self.rejected_steps[phase]
+            summary['func_time_' + phase] = self.func_time[phase] if self.timing else math.nan
+            summary['overhead_time_' + phase] = self.overhead_time(phase) if self.timing else math.nan
+        summary['min_dt'] = self.min_dt if self.accepted_steps['forward'] + self.accepted_steps['backward'] else math.nan
+        summary['max_dt'] = self.max_dt if self.accepted_steps['forward'] + self.accepted_steps['backward'] else math.nan
+        return summary
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__,
+                               ', '.join('{}={}'.format(k, v) for k, v in self.as_dict().items()))
+
+
+def _synchronize(tensor):
+    # Kernels run asynchronously on the GPU, so wait for them before reading the clock.
+    if tensor.is_cuda:
+        torch.cuda.synchronize(tensor.device)
+
+
+def _clock(stats, tensor):
+    # perf_counter() once the queued work on `tensor` is done, or 0 if `stats` doesn't time (nothing is synchronised).
+    if not stats.timing:
+        return 0.
+    _synchronize(tensor)
+    return perf_counter()
+
+
+class _InstrumentedFunc(object):
+    """Wraps `func` to count its evaluations and time them into a `SolverStats`."""
+
+    def __init__(self, base_func, stats):
+        self.base_func = base_func
+        self.stats = stats
+        if hasattr(base_func, 'select_rows'):
+            self.select_rows = lambda index: _InstrumentedFunc(base_func.select_rows(index), stats)
+        if hasattr(base_func, 'diagonal_decay'):
+            self.diagonal_decay = base_func.diagonal_decay
+        if hasattr(base_func, 'jacobian_structure'):
+            self.jacobian_structure = base_func.jacobian_structure
+
+    def __call__(self, t, y):
+        start = _clock(self.stats, y)
+        f = self.base_func(t, y)
+        self.stats.func_time[self.stats.phase] += _clock(self.stats, y) - start
+        self.stats.nfe[self.stats.phase] += 1
+        return f
+
+
+def _timed_integrate(solver, t, y0, stats):
+    """Run `solver.integrate(t)`, adding its wall time to `stats` if given."""
+    if stats is None:
+        return solver.integrate(t)
+    solver.stats = stats
+    start = _clock(stats, y0)
+    solution = solver.integrate(t)
+    stats.solve_time[stats.phase] += _clock(stats, y0) - start
+    stats.n_solves += 1
+    return solution
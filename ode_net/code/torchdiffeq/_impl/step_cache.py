@@ -0,0 +1,48 @@
+import math
+
+
+class StepSizeCache(object):
+    """Warm-start cache of initial step sizes, shared between solves through the `step_cache` solver option.
+
+    Adaptive solvers normally pick their first step with `_select_initial_step`, which costs an extra function
+    evaluation per solve. Given a cache, a solver instead starts from the step size its controller proposed after the
+    first accepted step of an earlier solve over an interval of similar length, and stores its own proposal for the
+    solves that follow. Interval lengths are bucketed on a log scale, `resolution` being the width of a bucket in
+    natural-log units.
+
+    Attributes:
+        hits: number of solves that started from a cached step size.
+        misses: number of solves that fell back to the heuristic selection.
+    """
+
+    def __init__(self, resolution=0.1):
+        self.resolution = resolution
+        self.steps = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, t0, t1):
+        span = abs(float(t1 - t0))
+        if span == 0:
+            return None
+        return round(math.log(span) / self.resolution)
+
+    def lookup(self, t0, t1):
+        """Return the cached first step for the interval `[t0, t1]`, or None."""
+        step = self.steps.get(self._key(t0, t1))
+        if step is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return step
+
+    def update(self, t0, t1, step):
+        """Store `step`, a float, as the initial step for later solves over intervals like `[t0, t1]`."""
+        key = self._key(t0, t1)
+        if key is not None:
+            self.steps[key] = step
+
+    def clear(self):
+        self.steps.clear()
+        self.hits = 0
+        self.misses = 0
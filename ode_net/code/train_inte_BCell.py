@@ -1,6 +1,9 @@
 # Imports
 import sys
 import os
+import atexit
+import shutil
+import tempfile
 import argparse
 import inspect
 from datetime import datetime
@@ -11,15 +14,22 @@ from time import perf_counter, process_time
 
 import torch
 import torch.optim as optim
+from matplotlib.figure import Figure
 
 try:
-    from torchdiffeq.__init__ import odeint_adjoint as odeint
+    from torchdiffeq.__init__ import odeint_adjoint as odeint, StepSizeCache, supports_checkpoint_adjoint
 except ImportError:
-    from torchdiffeq import odeint_adjoint as odeint
+    from torchdiffeq import odeint_adjoint as odeint, StepSizeCache, supports_checkpoint_adjoint
 
 #from datagenerator import DataGenerator
 from datahandler import DataHandler
 from odenet import ODENet
+from batch_prefetcher import BatchPrefetcher
+from data_parallel import init_data_parallel, shared_seed, broadcast_module, average_gradients, mean_across_ranks, gather_objects
+from checkpointing import rng_state, set_rng_state, save_checkpoint, load_checkpoint, training_checkpoint, restore_training_checkpoint
+from artifact_writer import ArtifactWriter, snapshot
+from pairwise_solve import solve_pairs, pair_options
+from prior_loss import PriorSampler, read_prior_matrix
 from read_config import read_arguments_from_file
 from visualization_inte import *
 
@@ -31,11 +41,23 @@ def soft_sign_mod(this_x):
     abs_shifted_input = torch.abs(shifted_input)
     return(shifted_input/(1+abs_shifted_input))   #
 
+def plot_LR_range_test(all_lrs_used, training_loss, true_mean_losses, img_save_dir):
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(all_lrs_used, training_loss, color = "blue", label = "Training loss")
+    ax.plot(all_lrs_used, true_mean_losses, color = "green", label = r'True $\mu$ loss')
+    #ax.set_yscale('log')
+    ax.set_xscale('log')
+    ax.set_xlabel("Learning rate")
+    ax.set_ylabel("Error (MSE)")
+    ax.legend(loc='upper right')
+    fig.savefig("{}/LR_range_test.png".format(img_save_dir))
+
 def plot_MSE(epoch_so_far, training_loss, validation_loss, true_mean_losses, true_mean_losses_init_val_based, prior_losses, img_save_dir):
     
     # Create two subplots, one for the main MSE loss plot and one for the prior loss plot.
-    fig, (ax1, ax2) = plt.subplots(1, 2, sharey=False)
-    fig.set_size_inches(12, 6)
+    fig = Figure(figsize=(12, 6))
+    ax1, ax2 = fig.subplots(1, 2, sharey=False)
 
     ax1.plot(range(1, epoch_so_far + 1), training_loss, color="blue", label="Training loss")
     ax1.plot(range(1, epoch_so_far + 1), true_mean_losses, color="green", label="Noiseless test loss")
@@ -57,7 +79,7 @@ def plot_MSE(epoch_so_far, training_loss, validation_loss, true_mean_losses, tru
 
     #plt.subplots_adjust(wspace=0.3)
     fig.tight_layout()
-    plt.savefig("{}/MSE_loss.png".format(img_save_dir))
+    fig.savefig("{}/MSE_loss.png".format(img_save_dir))
     np.savetxt('{}full_loss_info.csv'.format(output_root_dir), np.c_[training_loss, validation_loss, true_mean_losses, true_mean_losses_init_val_based], delimiter=',')
 
 def my_r_squared(output, target):
@@ -68,12 +90,10 @@ def my_r_squared(output, target):
     my_corr = torch.sum(vx * vy) / (torch.sqrt(torch.sum(vx ** 2)) * torch.sqrt(torch.sum(vy ** 2)))
     return(my_corr**2)
 
-def get_true_val_set_r2(odenet, data_handler, method, batch_type):
+def get_true_val_set_r2(odenet, data_handler, method, batch_type, batched_solve = False, solver_options = None):
     data_pw, t_pw, target_pw = data_handler.get_true_mu_set_pairwise(val_only = True, batch_type =  "single")
     with torch.no_grad():
-        predictions_pw = torch.zeros(data_pw.shape).to(data_handler.device)
-        for index, (time, batch_point) in enumerate(zip(t_pw, data_pw)):
-            predictions_pw[index, :, :] = odeint(odenet, batch_point, time, method=method)[1] 
+        predictions_pw = solve_pairs(odeint, odenet, data_pw, t_pw, method, batched = batched_solve, options = solver_options)
         var_explained_pw = my_r_squared(predictions_pw, target_pw)
         true_val_mse = torch.mean((predictions_pw - target_pw)**2)
         
@@ -88,20 +108,9 @@ def get_true_val_set_r2(odenet, data_handler, method, batch_type):
 
 
 
-def read_prior_matrix(prior_mat_file_loc, sparse = False, num_genes = 11165):
-    if sparse == False: 
-        mat = np.genfromtxt(prior_mat_file_loc,delimiter=',')
-        mat_torch = torch.from_numpy(mat)
-        return mat_torch.float()
-    else: #when scaling up >10000
-        mat = np.genfromtxt(prior_mat_file_loc,delimiter=',')
-        sparse_mat = torch.sparse_coo_tensor([mat[:,0].astype(int)-1, mat[:,1].astype(int)-1], mat[:,2], ( num_genes,  num_genes))
-        mat_torch = sparse_mat.to_dense().float()
-        return(mat_torch)
-
 
 
-def validation(odenet, data_handler, method, explicit_time):
+def validation(odenet, data_handler, method, explicit_time, batched_solve = False, solver_options = None):
     data, t, target_full, n_val = data_handler.get_validation_set()
     if method == "trajectory":
         False
@@ -109,6 +118,11 @@ def validation(odenet, data_handler, method, explicit_time):
     init_bias_y = data_handler.init_bias_y
     #odenet.eval()
     with torch.no_grad():
+        if batched_solve:
+            predictions = solve_pairs(odeint, odenet, data, t, method, batched = True, options = solver_options)
+            loss = torch.mean((predictions - target_full)**2)
+            return [loss, n_val]
+
         predictions = []
         targets = []
         # For now we have to loop through manually, their implementation of odenet can only take fixed time lists.
@@ -122,7 +136,7 @@ def validation(odenet, data_handler, method, explicit_time):
             #target_point = target_point[not_nan_idx]
             
             # Do prediction
-            predictions.append(odeint(odenet, batch_point, time, method=method)[1])
+            predictions.append(odeint(odenet, batch_point, time, method=method, options=pair_options(solver_options, time))[1])
             targets.append(target_point) #IH comment
             #predictions[index, :, :] = odeint(odenet, batch_point[0], time, method=method)[1:]
 
@@ -157,7 +171,7 @@ def decrease_lr(opt, verbose, tot_epochs, epoch, lower_lr,  dec_lr_factor ):
         print(dir_string,"learning rate to: %f" % opt.param_groups[0]['lr'])
 
 
-def training_step(odenet, data_handler, opt, method, batch_size, explicit_time, relative_error, batch_for_prior, prior_grad, loss_lambda):
+def training_step(odenet, data_handler, opt, method, batch_size, explicit_time, relative_error, prior_sampler, loss_lambda, batched_solve = False, adjoint_mode = 'continuous', checkpoint_budget = None, solver_options = None):
     #print("Using {} threads training_step".format(torch.get_num_threads()))
     batch, t, target = data_handler.get_batch(batch_size)
     
@@ -170,18 +184,20 @@ def training_step(odenet, data_handler, opt, method, batch_size, explicit_time,
 
     init_bias_y = data_handler.init_bias_y
     opt.zero_grad()
-    predictions = torch.zeros(batch.shape).to(data_handler.device)
-    for index, (time, batch_point) in enumerate(zip(t, batch)):
-        predictions[index, :, :] = odeint(odenet, batch_point, time, method= method  )[1] + init_bias_y #IH comment
+    predictions = solve_pairs(odeint, odenet, batch, t, method, batched = batched_solve, adjoint_mode = adjoint_mode, checkpoint_budget = checkpoint_budget, options = solver_options) + init_bias_y #IH comment
     
     loss_data = torch.mean((predictions - target)**2) 
     
-    pred_grad = odenet.prior_only_forward(t,batch_for_prior)
-    loss_prior = torch.mean((pred_grad - prior_grad)**2)
+    # One sub-batch of prior states per step; no graph is needed when the prior term has zero weight
+    batch_for_prior, prior_grad = prior_sampler.sample()
+    with torch.set_grad_enabled(loss_lambda < 1):
+        pred_grad = odenet.prior_only_forward(t,batch_for_prior)
+        loss_prior = torch.mean((pred_grad - prior_grad)**2)
     #loss_prior = loss_data
 
     composed_loss = loss_lambda * loss_data + (1- loss_lambda) * loss_prior
     composed_loss.backward() #MOST EXPENSIVE STEP!
+    average_gradients(odenet)
     opt.step()
     return [loss_data, loss_prior]
 
@@ -190,7 +206,7 @@ def _build_save_file_name(save_path, epochs):
         str(datetime.now().day), str(datetime.now().hour), str(datetime.now().minute), save_path, epochs)
 
 def save_model(odenet, folder, filename):
-    odenet.save('{}{}.pt'.format(folder, filename))
+    artifact_writer.save_model(odenet, '{}{}.pt'.format(folder, filename))
 
 parser = argparse.ArgumentParser('Testing')
 parser.add_argument('--settings', type=str, default='config_BCell.cfg')
@@ -198,6 +214,7 @@ clean_name =  "mias_control_14691genes_2samples_6T"
 parser.add_argument('--data', type=str, default='../../mias_bcell_data/clean_data/{}.csv'.format(clean_name))
 test_data_name = "mias_control_14691genes_2samples_6T" 
 parser.add_argument('--test_data', type=str, default='../../mias_bcell_data/clean_data/{}.csv'.format(test_data_name))
+parser.add_argument('--resume', type=str, default=None, help='checkpoint.pt (or the output directory holding it) of a run to continue')
 
 args = parser.parse_args()
 
@@ -207,12 +224,39 @@ if __name__ == "__main__":
     sys.setrecursionlimit(3000)
     print('Loading settings from file {}'.format(args.settings))
     settings = read_arguments_from_file(args.settings)
+    checkpoint = None
+    if args.resume is not None:
+        # Continue with the settings the run was started with
+        checkpoint = load_checkpoint(args.resume)
+        settings = checkpoint['settings']
+
+    # Data-parallel training when launched with torchrun: every rank trains on a shard of each epoch and the gradients
+    # are averaged before each step. Ranks other than 0 keep their outputs in a scratch directory
+    rank, world_size = init_data_parallel(num_threads = settings['num_threads'])
+    if world_size > 1:
+        seed = shared_seed() if checkpoint is None else checkpoint['seed']
+        np.random.seed(seed % 2**32)
+        torch.manual_seed(seed)
+        if rank != 0:
+            settings['output_dir'] = tempfile.mkdtemp()
+            atexit.register(shutil.rmtree, settings['output_dir'], True)
+            settings['viz'] = False
+            settings['verbose'] = False
+    # The data noise, the train/validation split and the initial weights are drawn from here on; a resumed run
+    # restarts from the same random state, so that it reads in the same noisy data
+    if checkpoint is None:
+        initial_rng_state = gather_objects(rng_state())
+    else:
+        initial_rng_state = checkpoint['initial_rng_state']
+        set_rng_state(initial_rng_state[rank])
     cleaned_file_name = clean_name
     save_file_name = _build_save_file_name(cleaned_file_name, settings['epochs'])
 
     if settings['debug']:
         print("********************IN DEBUG MODE!********************")
         save_file_name= '(DEBUG)' + save_file_name
+    if checkpoint is not None:
+        save_file_name = checkpoint['save_file_name']
     output_root_dir = '{}/{}/'.format(settings['output_dir'], save_file_name)
 
     img_save_dir = '{}img/'.format(output_root_dir)
@@ -251,7 +295,10 @@ if __name__ == "__main__":
                                         img_save_dir = img_save_dir,
                                         scale_expression = settings['scale_expression'],
                                         log_scale = settings['log_scale'],
-                                        init_bias_y = settings['init_bias_y'], fp_test = None) #,fp_test = args.test_data)
+                                        init_bias_y = settings['init_bias_y'], fp_test = None, #,fp_test = args.test_data,
+                                        store_dir = '{}/trajectory_store'.format(output_root_dir) if settings['memmap_data'] else None)
+    if world_size > 1:
+        data_handler.shard(rank, world_size, seed)
     
     abs_prior = True
     
@@ -262,9 +309,8 @@ if __name__ == "__main__":
     if abs_prior:
         prior_mat = torch.abs(prior_mat)
 
-    K = 10000
-    batch_for_prior = (torch.rand(K,1,prior_mat.shape[0], device = data_handler.device)- 0.5)*1
-    prior_grad = torch.matmul(batch_for_prior,prior_mat) #can be any model here that predicts the derivative
+    prior_sampler = PriorSampler(prior_mat, K = settings['prior_K'], batch_size = settings['prior_batch_size'],
+                                 scale = 1 if settings['prior_scale'] is None else settings['prior_scale'], device = data_handler.device)
 
     del prior_mat
 
@@ -280,7 +326,7 @@ if __name__ == "__main__":
     
     # Initialization
     odenet = ODENet(device, data_handler.dim, explicit_time=settings['explicit_time'], neurons = settings['neurons_per_layer'], 
-                    log_scale = settings['log_scale'], init_bias_y = settings['init_bias_y'])
+                    log_scale = settings['log_scale'], init_bias_y = settings['init_bias_y'], sparse = settings['sparse_weights'])
     odenet.float()
     param_count = sum(p.numel() for p in odenet.parameters() if p.requires_grad)
     param_ratio = round(param_count/ (data_handler.dim)**2, 3)
@@ -295,6 +341,7 @@ if __name__ == "__main__":
         net_file.write(odenet.__str__())
         net_file.write('\n\n\n')
         net_file.write(inspect.getsource(ODENet.forward))
+        net_file.write(inspect.getsource(ODENet._sums_prods_concat))
         net_file.write('\n')
         if abs_prior:
             net_file.write('prior_mat = torch.abs(prior_mat)')
@@ -311,6 +358,13 @@ if __name__ == "__main__":
 
     #quit()
 
+    if world_size > 1:
+        # Same starting weights everywhere, then a different random stream per rank (e.g. for the prior sub-batches)
+        broadcast_module(odenet)
+        torch.manual_seed(seed + 1 + rank)
+    # Sparse rewiring has to pick the same positions on every rank
+    rewire_generator = torch.Generator().manual_seed(seed) if world_size > 1 else None
+
     # Select optimizer
     print('Using optimizer: {}'.format(settings['optimizer']))
     if settings['optimizer'] == 'rmsprop':
@@ -323,11 +377,9 @@ if __name__ == "__main__":
 #       opt = optim.Adam(odenet.parameters(), lr=settings['init_lr'], weight_decay=settings['weight_decay'])
         num_gene = data_handler.dim
         opt = optim.Adam([
-                {'params': odenet.net_sums.linear_out.weight}, 
-                {'params': odenet.net_sums.linear_out.bias},
-                {'params': odenet.net_prods.linear_out.weight},
-                {'params': odenet.net_prods.linear_out.bias},
-                {'params': odenet.net_alpha_combine.linear_out.weight},
+                {'params': odenet.net_sums.parameters()}, 
+                {'params': odenet.net_prods.parameters()},
+                {'params': odenet.net_alpha_combine.parameters()},
                 {'params': odenet.gene_multipliers,'lr': 5*settings['init_lr']}
                 
             ],  lr=settings['init_lr'], weight_decay=settings['weight_decay'])
@@ -338,6 +390,19 @@ if __name__ == "__main__":
     threshold_mode='abs', cooldown=0, min_lr=0, eps=1e-09, verbose=True)
 
     
+    # The checkpoint adjoint replays adaptive Runge-Kutta steps only; other methods fall back to the continuous adjoint
+    if settings['adjoint_mode'] == 'checkpoint' and not supports_checkpoint_adjoint(settings['method']):
+        print("adjoint_mode = checkpoint does not support method {}, using the continuous adjoint".format(settings['method']))
+        settings['adjoint_mode'] = 'continuous'
+
+    # One step size cache for all solves: they share the same ODENet and similar interval lengths
+    solver_options = {}
+    if settings['step_cache']:
+        solver_options['step_cache'] = StepSizeCache()
+    # Fixed-grid methods (e.g. etdrk4) take their steps from step_size, a fraction of each pair's interval
+    if settings['step_size'] is not None:
+        solver_options['step_size'] = settings['step_size']
+
     # Init plot
     if settings['viz']:
         visualizer = Visualizator1D(data_handler, odenet, settings, my_range_tuple = (0, 20))
@@ -354,14 +419,16 @@ if __name__ == "__main__":
     A_list = []
 
     min_loss = 0
+    min_val_loss = None
+    true_loss_of_min_val_model = None
     if settings['batch_type'] == 'single':
-        iterations_in_epoch = ceil(data_handler.train_data_length / settings['batch_size'])
+        iterations_in_epoch = ceil(data_handler.shard_length / settings['batch_size'])
     elif settings['batch_type'] == 'trajectory':
-        iterations_in_epoch = data_handler.train_data_length
+        iterations_in_epoch = data_handler.shard_length
     else:
-        iterations_in_epoch = ceil(data_handler.train_data_length / settings['batch_size'])
+        iterations_in_epoch = ceil(data_handler.shard_length / settings['batch_size'])
 
-    if settings['viz']:
+    if settings['viz'] and checkpoint is None:
         with torch.no_grad():
             visualizer.visualize()
             visualizer.plot()
@@ -387,11 +454,48 @@ if __name__ == "__main__":
 
     #print(get_true_val_set_r2(odenet, data_handler, settings['method'], settings['batch_type']))
     
-    for epoch in range(1, tot_epochs + 1):
+    start_epoch = 1
+    if checkpoint is not None:
+        # Restores the random state of the end of the checkpointed epoch, so nothing may draw from it before the loop
+        progress = restore_training_checkpoint(checkpoint, odenet, opt, scheduler, data_handler, solver_options, rank, world_size)
+        start_epoch = progress['epoch'] + 1
+        start_time = perf_counter() - progress['time_so_far']
+        training_loss = progress['training_loss']
+        validation_loss = progress['validation_loss']
+        prior_losses = progress['prior_losses']
+        true_mean_losses = progress['true_mean_losses']
+        true_mean_losses_init_val_based = progress['true_mean_losses_init_val_based']
+        epoch_times = progress['epoch_times']
+        all_lrs_used = progress['all_lrs_used']
+        A_list = progress['A_list']
+        min_train_loss = progress['min_train_loss']
+        min_val_loss = progress['min_val_loss']
+        true_loss_of_min_val_model = progress['true_loss_of_min_val_model']
+        consec_epochs_failed = progress['consec_epochs_failed']
+        rep_epochs_so_far = progress['rep_epochs_so_far']
+        rep_epochs_time_so_far = progress['rep_epochs_time_so_far']
+        rep_epochs_train_losses = progress['rep_epochs_train_losses']
+        rep_epochs_val_losses = progress['rep_epochs_val_losses']
+        rep_epochs_mu_losses = progress['rep_epochs_mu_losses']
+        if rewire_generator is not None:
+            rewire_generator.set_state(progress['rewire_generator'])
+        print('Continuing after epoch {}'.format(progress['epoch']))
+
+    # Assemble the next batches on a worker thread while the current step runs
+    if settings['prefetch_batches'] > 0:
+        batch_source = BatchPrefetcher(data_handler, settings['batch_size'], settings['prefetch_batches'])
+    else:
+        batch_source = data_handler
+
+    # Write models, plots and checkpoints on a worker thread so the next epoch can start right away
+    artifact_writer = ArtifactWriter()
+    atexit.register(artifact_writer.close)
+
+    for epoch in range(start_epoch, tot_epochs + 1):
             
         start_epoch_time = perf_counter()
         iteration_counter = 1
-        data_handler.reset_epoch()
+        batch_source.reset_epoch()
         #visualizer.save(img_save_dir, epoch) #IH added to test
         this_epoch_total_train_loss = 0
         this_epoch_total_prior_loss = 0
@@ -410,10 +514,10 @@ if __name__ == "__main__":
         
         if settings['verbose']:
             pbar = tqdm(total=iterations_in_epoch, desc="Training loss:")
-        while not data_handler.epoch_done:
+        while not batch_source.epoch_done:
             start_batch_time = perf_counter()
             
-            loss_list = training_step(odenet, data_handler, opt, settings['method'], settings['batch_size'], settings['explicit_time'], settings['relative_error'], batch_for_prior, prior_grad, loss_lambda)
+            loss_list = training_step(odenet, batch_source, opt, settings['method'], settings['batch_size'], settings['explicit_time'], settings['relative_error'], prior_sampler, loss_lambda, settings['batched_solve'], settings['adjoint_mode'], settings['checkpoint_budget'], solver_options)
             loss = loss_list[0]
             prior_loss = loss_list[1]
             #batch_times.append(perf_counter() - start_batch_time)
@@ -428,14 +532,16 @@ if __name__ == "__main__":
                 pbar.set_description("Training loss, Prior loss: {:.2E}, {:.2E}".format(loss.item(), prior_loss.item()))
         
         epoch_times.append(perf_counter() - start_epoch_time)
+        if settings['sparse_weights'] and settings['sparse_rewire_every'] > 0 and epoch % settings['sparse_rewire_every'] == 0:
+            print("Rewired {} sparse weights".format(odenet.rewire(settings['sparse_rewire_fraction'], opt, rewire_generator)))
 
         #Epoch done, now handle training loss
-        train_loss = this_epoch_total_train_loss/iterations_in_epoch
+        train_loss = mean_across_ranks(this_epoch_total_train_loss/iterations_in_epoch)
         training_loss.append(train_loss)
-        prior_losses.append(this_epoch_total_prior_loss/iterations_in_epoch)
+        prior_losses.append(mean_across_ranks(this_epoch_total_prior_loss/iterations_in_epoch))
         #print("Overall training loss {:.5E}".format(train_loss))
 
-        mu_loss = get_true_val_set_r2(odenet, data_handler, settings['method'], settings['batch_type'])
+        mu_loss = get_true_val_set_r2(odenet, data_handler, settings['method'], settings['batch_type'], settings['batched_solve'], solver_options)
         #mu_loss = true_loss(odenet, data_handler, settings['method'])
         true_mean_losses.append(mu_loss[1])
         true_mean_losses_init_val_based.append(mu_loss[0])
@@ -462,7 +568,7 @@ if __name__ == "__main__":
         #handle true-mu loss
        
         if data_handler.n_val > 0:
-            val_loss_list = validation(odenet, data_handler, settings['method'], settings['explicit_time'])
+            val_loss_list = validation(odenet, data_handler, settings['method'], settings['explicit_time'], settings['batched_solve'], solver_options)
             val_loss = val_loss_list[0]
             validation_loss.append(val_loss)
             if epoch == 1:
@@ -543,15 +649,16 @@ if __name__ == "__main__":
                 #print("True loss of best training model (MSE) = ", true_loss_of_min_train_model.item())
                 print("True loss of best training model (MSE) = ", 0)
             print("Saving MSE plot...")
-            plot_MSE(epoch, training_loss, validation_loss, true_mean_losses, true_mean_losses_init_val_based, prior_losses, img_save_dir)    
+            artifact_writer.submit(plot_MSE, epoch, list(training_loss), list(validation_loss), list(true_mean_losses),
+                                   list(true_mean_losses_init_val_based), list(prior_losses), img_save_dir)    
             
             if settings['lr_range_test']:
-                plot_LR_range_test(all_lrs_used, training_loss, img_save_dir)
+                artifact_writer.submit(plot_LR_range_test, list(all_lrs_used), list(training_loss), list(true_mean_losses), img_save_dir)
 
             print("Saving losses..")
             if data_handler.n_val > 0:
                 L = [rep_epochs_so_far, rep_epochs_time_so_far, rep_epochs_train_losses, rep_epochs_val_losses, rep_epochs_mu_losses]
-                np.savetxt('{}rep_epoch_losses.csv'.format(output_root_dir), np.transpose(L), delimiter=',')    
+                artifact_writer.submit(np.savetxt, '{}rep_epoch_losses.csv'.format(output_root_dir), np.transpose(L), delimiter=',')    
             
             print("Saving best intermediate val model..")
             interm_model_file_name = 'trained_model_epoch_' + str(epoch)
@@ -564,6 +671,25 @@ if __name__ == "__main__":
            
         
 
+        if settings['checkpoint_every'] > 0 and epoch % settings['checkpoint_every'] == 0:
+            progress = {
+            'epoch': epoch, 'time_so_far': perf_counter() - start_time,
+            'training_loss': training_loss, 'validation_loss': validation_loss, 'prior_losses': prior_losses,
+            'true_mean_losses': true_mean_losses, 'true_mean_losses_init_val_based': true_mean_losses_init_val_based,
+            'epoch_times': epoch_times,
+            'all_lrs_used': all_lrs_used, 'A_list': A_list,
+            'min_train_loss': min_train_loss, 'min_val_loss': min_val_loss, 'true_loss_of_min_val_model': true_loss_of_min_val_model,
+            'consec_epochs_failed': consec_epochs_failed,
+            'rep_epochs_so_far': rep_epochs_so_far, 'rep_epochs_time_so_far': rep_epochs_time_so_far,
+            'rep_epochs_train_losses': rep_epochs_train_losses, 'rep_epochs_val_losses': rep_epochs_val_losses,
+            'rep_epochs_mu_losses': rep_epochs_mu_losses,
+            'rewire_generator': None if rewire_generator is None else rewire_generator.get_state()}
+            checkpoint_state = training_checkpoint(odenet, opt, scheduler, data_handler, progress, solver_options,
+                                                   settings = settings, save_file_name = save_file_name,
+                                                   seed = seed if world_size > 1 else None, initial_rng_state = initial_rng_state)
+            if rank == 0:
+                artifact_writer.submit(save_checkpoint, '{}checkpoint.pt'.format(output_root_dir), snapshot(checkpoint_state))
+
         if consec_epochs_failed==epochs_to_fail_to_terminate:
             print("Went {} epochs without improvement; terminating.".format(epochs_to_fail_to_terminate))
             break
@@ -581,6 +707,7 @@ if __name__ == "__main__":
     np.savetxt('{}epoch_times.csv'.format(output_root_dir), epoch_times, delimiter=',')
 
         
+    artifact_writer.close()
     print("DONE!")
 
   
@@ -0,0 +1,335 @@
+# Imports
+import sys
+import os
+import atexit
+import argparse
+import inspect
+from datetime import datetime
+import numpy as np
+from tqdm import tqdm
+from math import ceil
+from time import perf_counter
+
+import torch
+import torch.optim as optim
+from matplotlib.figure import Figure
+
+try:
+    from torchdiffeq.__init__ import odeint_adjoint as odeint, SolverStats, StepSizeCache, supports_checkpoint_adjoint
+except ImportError:
+    from torchdiffeq import odeint_adjoint as odeint, SolverStats, StepSizeCache, supports_checkpoint_adjoint
+
+from datahandler import DataHandler
+from odenet import ODENet, EnsembleODENet
+from batch_prefetcher import BatchPrefetcher
+from artifact_writer import ArtifactWriter
+from pairwise_solve import solve_pairs
+from prior_loss import PriorSampler, read_prior_matrix
+from read_config import read_arguments_from_file
+from visualization_inte import *
+
+
+def plot_MSE(epoch_so_far, training_loss, validation_loss, true_mean_losses, img_save_dir):
+    ''' One training, validation and noiseless test curve per replicate '''
+    epochs = range(1, epoch_so_far + 1)
+    fig = Figure(figsize=(18, 6))
+    axes = fig.subplots(1, 3, sharey=True)
+    for ax, losses, title in zip(axes, (training_loss, validation_loss, true_mean_losses),
+                                 ("Training loss", "Validation loss", "Noiseless test loss")):
+        if len(losses) > 0:
+            ax.plot(epochs, np.array(losses))
+        ax.set_yscale('log')
+        ax.set_xlabel("Epoch")
+        ax.set_ylabel("Error (MSE)")
+        ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig("{}/MSE_loss.png".format(img_save_dir))
+    columns = [np.array(losses) for losses in (training_loss, validation_loss, true_mean_losses) if len(losses) > 0]
+    np.savetxt('{}full_loss_info.csv'.format(output_root_dir), np.hstack(columns), delimiter=',')
+
+
+def true_val_set_mse(ensemble, data_handler, method, batch_type, batched_solve = False, solver_options = None):
+    ''' Noiseless test MSE of every replicate '''
+    data_pw, t_pw, target_pw = data_handler.get_true_mu_set_pairwise(val_only = True, batch_type =  batch_type)
+    with torch.no_grad():
+        predictions_pw = solve_pairs(odeint, ensemble, ensemble.expand_states(data_pw), t_pw, method, batched = batched_solve, options = solver_options)
+        return ensemble.replicate_mse(predictions_pw, target_pw)
+
+
+def validation(ensemble, data_handler, method, batched_solve = False, solver_options = None):
+    ''' Validation MSE of every replicate '''
+    data, t, target_full, n_val = data_handler.get_validation_set()
+    with torch.no_grad():
+        predictions = solve_pairs(odeint, ensemble, ensemble.expand_states(data), t, method, batched = batched_solve, options = solver_options)
+        return [ensemble.replicate_mse(predictions, target_full), n_val]
+
+
+def decrease_lr(opt, verbose, dec_lr_factor):
+    for param_group in opt.param_groups:
+        param_group['lr'] = param_group['lr'] * dec_lr_factor
+    if verbose:
+        print("Decreasing learning rate to: %f" % opt.param_groups[0]['lr'])
+
+
+def training_step(ensemble, data_handler, opt, method, batch_size, prior_sampler, loss_lambda, batched_solve = False, solver_stats = None, adjoint_mode = 'continuous', checkpoint_budget = None, solver_options = None):
+    ''' One step of every replicate on the same batch. The replicates share no weights, so the gradient of the summed
+    losses holds each replicate's own gradient '''
+    batch, t, target = data_handler.get_batch(batch_size)
+    init_bias_y = data_handler.init_bias_y
+    opt.zero_grad()
+    predictions = solve_pairs(odeint, ensemble, ensemble.expand_states(batch), t, method, batched = batched_solve, stats = solver_stats, adjoint_mode = adjoint_mode, checkpoint_budget = checkpoint_budget, options = solver_options) + init_bias_y
+    loss_data = ensemble.replicate_mse(predictions, target)
+
+    batch_for_prior, prior_grad = prior_sampler.sample()
+    with torch.set_grad_enabled(loss_lambda < 1):
+        pred_grad = ensemble.prior_only_forward(t, ensemble.expand_states(batch_for_prior))
+        loss_prior = ensemble.replicate_mse(pred_grad, prior_grad)
+
+    composed_loss = loss_lambda * loss_data + (1- loss_lambda) * loss_prior
+    composed_loss.sum().backward()
+    opt.step()
+    return [loss_data.detach(), loss_prior.detach()]
+
+def _build_save_file_name(save_path, epochs, n_replicates):
+    return '{}-{}-{}({};{})_{}_{}reps_{}epochs'.format(str(datetime.now().year), str(datetime.now().month),
+        str(datetime.now().day), str(datetime.now().hour), str(datetime.now().minute), save_path, n_replicates, epochs)
+
+def save_replicate(ensemble, index, folder, filename):
+    artifact_writer.submit(ensemble.replicate(index).save, '{}{}_rep{}.pt'.format(folder, filename, index))
+
+parser = argparse.ArgumentParser('Testing')
+parser.add_argument('--settings', type=str, default='config_inte.cfg')
+clean_name =  "chalmers_690genes_150samples_earlyT_0bimod_1initvar"
+parser.add_argument('--data', type=str, default='../../ground_truth_simulator/clean_data/{}.csv'.format(clean_name))
+test_data_name = "chalmers_690genes_10samples_for_testing"
+parser.add_argument('--test_data', type=str, default='../../ground_truth_simulator/clean_data/{}.csv'.format(test_data_name))
+parser.add_argument('--replicates', type=int, default=None, help='overrides ensemble_replicates of the settings file')
+
+args = parser.parse_args()
+
+# Main function
+if __name__ == "__main__":
+    print('Setting recursion limit to 3000')
+    sys.setrecursionlimit(3000)
+    print('Loading settings from file {}'.format(args.settings))
+    settings = read_arguments_from_file(args.settings)
+    n_replicates = settings['ensemble_replicates'] if args.replicates is None else args.replicates
+    if settings['sparse_weights']:
+        sys.exit('The ensemble stacks dense weights; set sparse_weights = False.')
+    if settings['num_threads'] > 0:
+        torch.set_num_threads(settings['num_threads'])
+
+    save_file_name = _build_save_file_name(clean_name, settings['epochs'], n_replicates)
+    output_root_dir = '{}/{}/'.format(settings['output_dir'], save_file_name)
+    img_save_dir = '{}img/'.format(output_root_dir)
+
+    # Create image and model save directory
+    os.makedirs(img_save_dir, exist_ok=True)
+
+    # Save the settings for future reference
+    with open('{}/settings.csv'.format(output_root_dir), 'w') as f:
+        f.write("Setting,Value\n")
+        for key in settings.keys():
+            f.write("{},{}\n".format(key,settings[key]))
+        f.write("{},{}\n".format('replicates', n_replicates))
+
+    # Use GPU if available
+    if not settings['cpu']:
+        os.environ["CUDA_VISIBLE_DEVICES"]="0"
+        print("Trying to run on GPU -- cuda available: " + str(torch.cuda.is_available()))
+        device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        print("Running on", device)
+    else:
+        print("Running on CPU")
+        device = 'cpu'
+
+    data_handler = DataHandler.fromcsv(args.data, device, settings['val_split'], normalize=settings['normalize_data'],
+                                        batch_type=settings['batch_type'], batch_time=settings['batch_time'],
+                                        batch_time_frac=settings['batch_time_frac'],
+                                        noise = settings['noise'],
+                                        img_save_dir = img_save_dir,
+                                        scale_expression = settings['scale_expression'],
+                                        log_scale = settings['log_scale'],
+                                        init_bias_y = settings['init_bias_y'],
+                                        fp_test = args.test_data,
+                                        store_dir = '{}/trajectory_store'.format(output_root_dir) if settings['memmap_data'] else None)
+
+    prior_mat_loc = '../../ground_truth_simulator/clean_data/edge_prior_matrix_chalmers_690_noise_{}.csv'.format(settings['noise'])
+    prior_mat = read_prior_matrix(prior_mat_loc, sparse = False, num_genes = data_handler.dim)
+    prior_sampler = PriorSampler(prior_mat, K = settings['prior_K'], batch_size = settings['prior_batch_size'],
+                                 scale = 2 if settings['prior_scale'] is None else settings['prior_scale'], device = data_handler.device)
+    loss_lambda = 1
+
+    # Initialization: every replicate is initialized like a single ODENet, then the weights are stacked
+    replicates = []
+    for _ in range(n_replicates):
+        odenet = ODENet(device, data_handler.dim, explicit_time=settings['explicit_time'], neurons = settings['neurons_per_layer'],
+                        log_scale = settings['log_scale'], init_bias_y = settings['init_bias_y'])
+        odenet.float()
+        if settings['pretrained_model']:
+            odenet.load('output/_pretrained_best_model/best_val_model.pt')
+        replicates.append(odenet)
+    ensemble = EnsembleODENet(replicates)
+    del replicates
+    param_count = sum(p.numel() for p in ensemble.parameters() if p.requires_grad) // n_replicates
+    print("Training {} replicates with {} neurons per layer, with {} trainable parameters each".format(n_replicates, settings['neurons_per_layer'], param_count))
+
+    with open('{}/network.txt'.format(output_root_dir), 'w') as net_file:
+        net_file.write(ensemble.__str__())
+        net_file.write('\n\n\n')
+        net_file.write(inspect.getsource(EnsembleODENet.forward))
+        net_file.write(inspect.getsource(EnsembleODENet.prior_only_forward))
+        net_file.write('\n')
+        net_file.write('lambda = {}'.format(loss_lambda))
+
+    # Select optimizer; the update of every optimizer below is elementwise, so each replicate is optimized independently
+    print('Using optimizer: {}'.format(settings['optimizer']))
+    if settings['optimizer'] == 'rmsprop':
+        opt = optim.RMSprop(ensemble.parameters(), lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+    elif settings['optimizer'] == 'sgd':
+        opt = optim.SGD(ensemble.parameters(), lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+    elif settings['optimizer'] == 'adagrad':
+        opt = optim.Adagrad(ensemble.parameters(), lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+    else:
+        opt = optim.Adam([
+                {'params': [ensemble.sums_weight, ensemble.sums_bias]},
+                {'params': [ensemble.prods_weight, ensemble.prods_bias]},
+                {'params': ensemble.alpha_weight},
+                {'params': ensemble.gene_multipliers,'lr': 5*settings['init_lr']}
+            ],  lr=settings['init_lr'], weight_decay=settings['weight_decay'])
+
+    # The learning rate is shared, so the plateau schedule follows the mean validation loss of the replicates
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(opt, mode='min',
+    factor=0.9, patience=3, threshold=1e-09,
+    threshold_mode='abs', cooldown=0, min_lr=0, eps=1e-09, verbose=True)
+
+    # The checkpoint adjoint replays adaptive Runge-Kutta steps only; other methods fall back to the continuous adjoint
+    if settings['adjoint_mode'] == 'checkpoint' and not supports_checkpoint_adjoint(settings['method']):
+        print("adjoint_mode = checkpoint does not support method {}, using the continuous adjoint".format(settings['method']))
+        settings['adjoint_mode'] = 'continuous'
+
+    solver_options = {}
+    if settings['step_cache']:
+        solver_options['step_cache'] = StepSizeCache()
+    if settings['step_size'] is not None:
+        solver_options['step_size'] = settings['step_size']
+
+    # Training loop
+    epoch_times = []
+    epoch_solver_stats = []
+    solver_stats = SolverStats(timing = settings['solver_timing'])
+    validation_loss = []
+    training_loss = []
+    prior_losses = []
+    true_mean_losses = []
+
+    if settings['batch_type'] == 'trajectory':
+        iterations_in_epoch = data_handler.train_data_length
+    else:
+        iterations_in_epoch = ceil(data_handler.train_data_length / settings['batch_size'])
+
+    start_time = perf_counter()
+    tot_epochs = settings['epochs']
+    rep_epochs = [1, 5, 7, 10, 15, 25, 30, 40, 50, 60, 70, 80, 100, 120, 150, 180, 200,220, 240, 300, 350, tot_epochs]
+    rep_epochs_so_far = []
+    rep_epochs_time_so_far = []
+    rep_epochs_val_losses = []
+    rep_epochs_mu_losses = []
+    # Per replicate: best validation loss, noiseless test loss of that model and epochs since it improved
+    min_val_loss = np.full(n_replicates, np.inf)
+    true_loss_of_min_val_model = np.full(n_replicates, np.nan)
+    consec_epochs_failed = np.zeros(n_replicates, dtype=int)
+    epochs_to_fail_to_terminate = 40
+
+    if settings['prefetch_batches'] > 0:
+        batch_source = BatchPrefetcher(data_handler, settings['batch_size'], settings['prefetch_batches'])
+    else:
+        batch_source = data_handler
+
+    # Write models, plots and loss tables on a worker thread so the next epoch can start right away
+    artifact_writer = ArtifactWriter()
+    atexit.register(artifact_writer.close)
+
+    for epoch in range(1, tot_epochs + 1):
+        start_epoch_time = perf_counter()
+        solver_stats.reset()
+        batch_source.reset_epoch()
+        this_epoch_total_train_loss = torch.zeros(n_replicates)
+        this_epoch_total_prior_loss = torch.zeros(n_replicates)
+        print()
+        print("[Running epoch {}/{}]".format(epoch, settings['epochs']))
+
+        if settings['verbose']:
+            pbar = tqdm(total=iterations_in_epoch, desc="Training loss:")
+        while not batch_source.epoch_done:
+            loss, prior_loss = training_step(ensemble, batch_source, opt, settings['method'], settings['batch_size'], prior_sampler, loss_lambda, settings['batched_solve'], solver_stats, settings['adjoint_mode'], settings['checkpoint_budget'], solver_options)
+            this_epoch_total_train_loss += loss.cpu()
+            this_epoch_total_prior_loss += prior_loss.cpu()
+            if settings['verbose']:
+                pbar.update(1)
+                pbar.set_description("Mean training loss, Prior loss: {:.2E}, {:.2E}".format(loss.mean().item(), prior_loss.mean().item()))
+        if settings['verbose']:
+            pbar.close()
+
+        epoch_times.append(perf_counter() - start_epoch_time)
+        epoch_solver_stats.append(solver_stats.as_dict())
+        train_loss = (this_epoch_total_train_loss/iterations_in_epoch).numpy()
+        training_loss.append(train_loss)
+        prior_losses.append((this_epoch_total_prior_loss/iterations_in_epoch).numpy())
+        mu_loss = true_val_set_mse(ensemble, data_handler, settings['method'], settings['batch_type'], settings['batched_solve'], solver_options).cpu().numpy()
+        true_mean_losses.append(mu_loss)
+
+        if data_handler.n_val > 0:
+            val_loss_list = validation(ensemble, data_handler, settings['method'], settings['batched_solve'], solver_options)
+            val_loss = val_loss_list[0].cpu().numpy()
+            validation_loss.append(val_loss)
+            improved = val_loss < min_val_loss
+            min_val_loss[improved] = val_loss[improved]
+            true_loss_of_min_val_model[improved] = mu_loss[improved]
+            consec_epochs_failed[improved] = 0
+            consec_epochs_failed[~improved] += 1
+            if improved.any():
+                print('Replicates {} improved, saving their models'.format(np.flatnonzero(improved).tolist()))
+            for index in np.flatnonzero(improved):
+                save_replicate(ensemble, index, output_root_dir, 'best_val_model')
+            print("Validation loss per replicate {}, using {} points".format(np.array2string(val_loss, formatter={'float': '{:.5E}'.format}), val_loss_list[1]))
+            scheduler.step(val_loss.mean())
+
+        print("Training loss per replicate {}".format(np.array2string(train_loss, formatter={'float': '{:.5E}'.format})))
+        print("Noiseless test traj (pairwise) MSE per replicate: {}".format(np.array2string(mu_loss, formatter={'float': '{:.5E}'.format})))
+
+        if settings['dec_lr']:
+            decrease_lr(opt, True, dec_lr_factor = settings['dec_lr_factor'])
+
+        all_failed = data_handler.n_val > 0 and (consec_epochs_failed >= epochs_to_fail_to_terminate).all()
+        if (epoch in rep_epochs) or all_failed:
+            print()
+            rep_epochs_so_far.append(epoch)
+            rep_time_so_far = (perf_counter() - start_time)/3600
+            print("Epoch= {}, time so far= {} hrs".format(epoch, rep_time_so_far))
+            rep_epochs_time_so_far.append(rep_time_so_far)
+            if data_handler.n_val > 0:
+                print("Best validation (MSE) so far per replicate = ", min_val_loss)
+                rep_epochs_val_losses.append(min_val_loss.copy())
+                rep_epochs_mu_losses.append(true_loss_of_min_val_model.copy())
+                L = np.column_stack([rep_epochs_so_far, rep_epochs_time_so_far, np.array(rep_epochs_val_losses), np.array(rep_epochs_mu_losses)])
+                artifact_writer.submit(np.savetxt, '{}rep_epoch_losses.csv'.format(output_root_dir), L, delimiter=',')
+            print("Saving MSE plot...")
+            artifact_writer.submit(plot_MSE, epoch, list(training_loss), list(validation_loss), list(true_mean_losses), img_save_dir)
+
+        if all_failed:
+            print("Every replicate went {} epochs without improvement; terminating.".format(epochs_to_fail_to_terminate))
+            break
+
+    for index in range(n_replicates):
+        save_replicate(ensemble, index, output_root_dir, 'final_model')
+
+    print("Saving times")
+    np.savetxt('{}epoch_times.csv'.format(output_root_dir), epoch_times, delimiter=',')
+    if epoch_solver_stats:
+        stats_names = list(epoch_solver_stats[0].keys())
+        stats_table = [[epoch_stats[name] for name in stats_names] for epoch_stats in epoch_solver_stats]
+        np.savetxt('{}solver_stats.csv'.format(output_root_dir), stats_table, delimiter=',', fmt='%.6g', header=','.join(stats_names), comments='')
+
+    artifact_writer.close()
+    print("DONE!")
@@ -230,6 +230,7 @@ if __name__ == "__main__":
         net_file.write(odenet.__str__())
         net_file.write('\n\n\n')
         net_file.write(inspect.getsource(ODENet.forward))
+        net_file.write(inspect.getsource(ODENet._sums_prods_concat))
 
     #quit()
 
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import torch
+
+
+class TrajectoryStore:
+    ''' All trajectories of a dataset in one contiguous (total_timepoints, dim) array plus per-trajectory offsets.
+    Trajectory i is rows offsets[i]:offsets[i+1] of values (noisy), values_0noise and times '''
+
+    def __init__(self, values, values_0noise, times, offsets):
+        self.values = values
+        self.values_0noise = values_0noise
+        self.times = times
+        self.offsets = offsets
+        self.dim = values.shape[1]
+        self.ntraj = len(offsets) - 1
+        self._tensors = None
+
+    @classmethod
+    def allocate(cls, dim, lengths, path = None, share_0noise = False):
+        ''' Empty store for trajectories of the given lengths, as .npy files memory-mapped from directory path if given
+        (in RAM otherwise). With share_0noise the noisy and noiseless values are one array, e.g. when no noise is added '''
+        offsets = np.zeros(len(lengths) + 1, dtype = np.int64)
+        np.cumsum(lengths, out = offsets[1:])
+        total_timepoints = int(offsets[-1])
+
+        if path is None:
+            allocate_array = lambda name, shape, dtype: np.empty(shape, dtype = dtype)
+        else:
+            os.makedirs(path, exist_ok = True)
+            np.save(os.path.join(path, 'offsets.npy'), offsets)
+            allocate_array = lambda name, shape, dtype: np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode = 'w+', dtype = dtype, shape = shape)
+
+        values = allocate_array('values', (total_timepoints, dim), np.float32)
+        values_0noise = values if share_0noise else allocate_array('values_0noise', (total_timepoints, dim), np.float32)
+        times = allocate_array('times', (total_timepoints,), np.float64)
+        return cls(values, values_0noise, times, offsets)
+
+    @classmethod
+    def load(cls, path):
+        ''' Memory-map a store written by allocate(path = ...), copy-on-write so the files are never modified '''
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode = 'c')
+        values_0noise_fp = os.path.join(path, 'values_0noise.npy')
+        values_0noise = np.load(values_0noise_fp, mmap_mode = 'c') if os.path.exists(values_0noise_fp) else values
+        times = np.load(os.path.join(path, 'times.npy'), mmap_mode = 'c')
+        offsets = np.load(os.path.join(path, 'offsets.npy'))
+        return cls(values, values_0noise, times, offsets)
+
+    @classmethod
+    def from_lists(cls, data_np, data_np_0noise, time_np):
+        ''' Store holding copies of per-trajectory (length, 1, dim) arrays '''
+        lengths = [len(traj) for traj in data_np]
+        store = cls.allocate(data_np[0].shape[-1], lengths, share_0noise = data_np_0noise is None)
+        for i in range(len(lengths)):
+            rows = slice(store.offsets[i], store.offsets[i+1])
+            store.values[rows] = data_np[i].reshape(lengths[i], -1)
+            store.times[rows] = time_np[i]
+            if data_np_0noise is not None:
+                store.values_0noise[rows] = data_np_0noise[i].reshape(lengths[i], -1)
+        return store
+
+    def flush(self):
+        for array in (self.values, self.values_0noise, self.times):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def divide_values(self, divisor):
+        ''' Divide the noisy values by divisor, leaving the noiseless ones as they are '''
+        if self.values is self.values_0noise:
+            self.values = self.values/np.float32(divisor)
+        else:
+            self.values /= np.float32(divisor)
+        self._tensors = None
+
+    def tensors(self, device):
+        ''' (values, values_0noise, times) as torch tensors on device; zero-copy views of the arrays on the CPU.
+        Times are float32, like the tensors readcsv used to build '''
+        if self._tensors is None or self._tensors[0] != device:
+            values = torch.from_numpy(self.values).to(device)
+            values_0noise = values if self.values_0noise is self.values else torch.from_numpy(self.values_0noise).to(device)
+            times = torch.from_numpy(self.times).float().to(device)
+            self._tensors = (device, values, values_0noise, times)
+        return self._tensors[1:]
+
+    def as_lists(self, device):
+        ''' Per-trajectory views (data_np, data_pt, t_np, t_pt, data_np_0noise, data_pt_0noise), with the layouts
+        readcsv returns: (length, 1, dim) for the data and (length,) for the times '''
+        values_pt, values_0noise_pt, times_pt = self.tensors(device)
+        lists = ([], [], [], [], [], [])
+        for i in range(self.ntraj):
+            start, end = self.offsets[i], self.offsets[i+1]
+            shape = (end - start, 1, self.dim)
+            for target, source in zip(lists, (self.values, values_pt, self.times, times_pt, self.values_0noise, values_0noise_pt)):
+                target.append(source[start:end].reshape(shape) if source.ndim == 2 else source[start:end])
+        return lists
+
+    def flat_rows(self, pairs):
+        ''' Row indices into the store of (trajectory, time index) pairs '''
+        pairs = np.asarray(pairs, dtype = np.int64).reshape(-1, 2)
+        return self.offsets[pairs[:, 0]] + pairs[:, 1]